@@ -1,67 +1,29 @@
-import altair
 import streamlit as st
 import pandas as pd
-from dashboard import PLATFORMS
-import dashboard.projects as projects
 import dashboard.database.processor_db as processor_db
-
-
-def draw_graph(func, project_id=None):
-    df_list = []
-    for p in PLATFORMS:
-        results = func(project_id=project_id, platform=p, above_threshold=False)
-        df = pd.DataFrame(results)
-        df['platform'] = p
-        df_list.append(df)
-
-    chart = pd.concat(df_list)
-    bar_chart = altair.Chart(chart).mark_bar().encode(
-        x=altair.X('day', axis=altair.Axis(format='%m-%d')),
-        y="stories",
-        color="platform",
-        size=altair.SizeValue(5),
-    )
-    st.altair_chart(bar_chart, use_container_width=True)
-    return
-
-
-def story_results_graph(project_id=None):
-    a = processor_db.stories_by_processed_day(project_id=project_id, above_threshold=True)
-    b = processor_db.stories_by_processed_day(project_id=project_id, above_threshold=False)
-    df_list = []
-    a = pd.DataFrame(a)
-    a['platform'] = 'above'
-    b = pd.DataFrame(b)
-    b['platform'] = 'below'
-    df_list.append(a)
-    df_list.append(b)
-    chart = pd.concat(df_list)
-    bar_chart = altair.Chart(chart).mark_bar().encode(
-        x=altair.X('day', axis=altair.Axis(format='%m-%d')),
-        y="stories",
-        color="platform",
-        size=altair.SizeValue(5)
-    )
-    st.altair_chart(bar_chart, use_container_width=True)
-    return
+import dashboard.database.alerts_db as alerts_db
+from dashboard.scheduler import QueryScheduler
+from dashboard.charts import draw_graph, story_results_graph, draw_article_counts
+from dashboard.widgets import cache_controls, query_timings, query_failure, profiled_render, debug_panel
 
 st.title('Feminicides Story Dashboard')
+cache_controls('home')
 st.markdown('Investigate stories moving through the feminicides detection pipeline')
 st.divider()
 
 st.subheader('Above Threshold Stories (by date sent to main server)')
 # by posted day
 st.caption("Platform Stories by Posted Day")
-draw_graph(processor_db.stories_by_posted_day)
+posted_chart = st.container()
 st.divider()
 # History (by discovery date)
 st.subheader("History (by discovery date)")
 st.caption("Platform Stories by Published Day")
-draw_graph(processor_db.stories_by_published_day)
+published_chart = st.container()
 st.caption("Platform Stories by Discovery Day")
-draw_graph(processor_db.stories_by_processed_day)
+processed_chart = st.container()
 st.caption("Platform Stories by Discovery Day")
-story_results_graph()
+results_chart = st.container()
 st.divider()
 
 st.title('Project Speficic Email Alert Dashboard')
@@ -70,8 +32,49 @@ st.divider()
 
 # Grouped Articles
 st.subheader('Grouped Articles')
+st.caption("The same story sent by several alerts, most recently seen first (all projects)")
+groups_list = st.container()
 st.divider()
 
 # Raw Articles
 st.subheader('Raw Articles')
+st.caption("Articles by Published Day")
+articles_chart = st.container()
 st.divider()
+
+# one grouped query per date column, run side by side; stories_by_posted_day groups on processed_date too, so the
+# posted-day chart shares its results. The alerts database queries run alongside them, and everything is filled in as
+# its query comes back.
+with profiled_render('Home') as render_profiles:
+    scheduler = QueryScheduler()
+    scheduler.submit('processed', processor_db.story_counts_by_day, 'processed_date')
+    scheduler.submit('published', processor_db.story_counts_by_day, 'published_date', limit=30)
+    scheduler.submit('groups', alerts_db.grouped_articles, page_size=10)
+    scheduler.submit('articles', alerts_db.articles_by_published_day)
+    containers = dict(processed=[posted_chart, processed_chart, results_chart], published=[published_chart],
+                      groups=[groups_list], articles=[articles_chart])
+    for label, results in scheduler.as_completed(return_exceptions=True):
+        if isinstance(results, Exception):
+            for container in containers[label]:
+                with container:
+                    query_failure(results)
+        elif label == 'processed':
+            with posted_chart:
+                draw_graph(results)
+            with processed_chart:
+                draw_graph(results)
+            with results_chart:
+                story_results_graph(results)
+        elif label == 'published':
+            with published_chart:
+                draw_graph(results)
+        elif label == 'groups':
+            groups, _ = results
+            with groups_list:
+                st.dataframe(pd.DataFrame(groups, columns=alerts_db.ARTICLE_GROUP_COLUMNS), use_container_width=True,
+                             hide_index=True)
+        else:
+            with articles_chart:
+                draw_article_counts(results)
+query_timings(scheduler)
+debug_panel('home', render_profiles)
@@ -0,0 +1,133 @@
+"""
+Measure how the history charts grow with the date range: daily rows as dicts (the way they used to be fetched and
+drawn) against the columnar, bucketed counts `processor_db.story_counts_by_day` returns now (day, week or month buckets,
+picked by `bucketing.pick_bucket`). Reports the points in each chart, the bytes sent to the browser (Streamlit sends a
+chart's data as Arrow, next to the spec), the spec size with each Altair data transformer, and the time to build the
+chart and serialize it. Everything is synthetic and in memory, so it needs no database:
+
+    python -m benchmarks.chart_benchmark --days 30 90 365 730 1825 3650
+
+Streamlit swaps in its own data transformer when it draws a chart, so the transformer columns are for specs rendered
+outside it (ie. exported with `chart.save`); 'vegafusion' is only measured if the vegafusion package is installed.
+"""
+import argparse
+import datetime as dt
+import os
+import random
+import statistics
+import tempfile
+import time
+from typing import Dict, List
+
+import altair
+import pandas as pd
+import pyarrow as pa
+
+from dashboard import PLATFORMS
+from dashboard.charts import COUNT_COLUMNS, graph_chart
+from dashboard.database.bucketing import pick_bucket, bucket_start, earliest_date
+
+TRANSFORMERS = ['default', 'json', 'vegafusion']
+
+
+def daily_rows(days: int, seed: int = 1) -> List[Dict]:
+    """
+    :return: a row dict per (day, platform), newest first, like the old per-day query returned
+    """
+    rng = random.Random(seed)
+    today = dt.date.today()
+    return [dict(day=today - dt.timedelta(days=i), source=source, above=rng.randrange(50), below=rng.randrange(500))
+            for i in range(days + 1) for source in PLATFORMS]
+
+
+def bucketed_columns(rows: List[Dict], days: int) -> Dict[str, list]:
+    """
+    :return: the same counts summed into the bucket picked for the range, as column lists (what `date_trunc` and
+             `story_counts_by_day` give back)
+    """
+    bucket = pick_bucket(days)
+    start = earliest_date(days, bucket)
+    totals = {}
+    for row in rows:
+        if row['day'] >= start:
+            key = (bucket_start(row['day'], bucket), row['source'])
+            above, below = totals.get(key, (0, 0))
+            totals[key] = (above + row['above'], below + row['below'])
+    keys = sorted(totals, reverse=True)
+    return dict(day=[k[0] for k in keys], source=[k[1] for k in keys], above=[totals[k][0] for k in keys],
+                below=[totals[k][1] for k in keys])
+
+
+def dict_rows_chart(rows: List[Dict]) -> altair.Chart:
+    # the way draw_graph used to build its chart: a frame of dicts, filtered, and copied into another one
+    df = pd.DataFrame(rows, columns=COUNT_COLUMNS)
+    df = df[df['source'].isin(PLATFORMS)]
+    # (with datetimes rather than dates, which Streamlit coped with but inline specs can't serialize)
+    chart = pd.DataFrame({'day': pd.to_datetime(df['day']), 'stories': df['below'], 'platform': df['source']})
+    return altair.Chart(chart).mark_bar().encode(x=altair.X('day', axis=altair.Axis(format='%m-%d')), y="stories",
+                                                 color="platform", size=altair.SizeValue(5))
+
+
+def arrow_bytes(chart: altair.Chart) -> int:
+    table = pa.Table.from_pandas(chart.data, preserve_index=False)
+    sink = pa.BufferOutputStream()
+    with pa.ipc.new_stream(sink, table.schema) as writer:
+        writer.write_table(table)
+    return sink.getvalue().size
+
+
+def spec_bytes(chart: altair.Chart, transformer: str, directory: str):
+    """
+    :return: size of the spec with this data transformer (plus any data files it wrote), or None if it isn't available
+    """
+    if transformer not in altair.data_transformers.names():
+        return None
+    options = dict(max_rows=None) if transformer == 'default' else {}
+    if transformer == 'json':
+        options = dict(prefix=os.path.join(directory, 'altair-data'))
+    try:
+        with altair.data_transformers.enable(transformer, **options):
+            spec = chart.to_json()
+    except (ImportError, ValueError):
+        return None
+    files = sum(entry.stat().st_size for entry in os.scandir(directory))
+    for entry in os.scandir(directory):
+        os.remove(entry.path)
+    return len(spec) + files
+
+
+def build_seconds(build, repeat: int) -> float:
+    timings = []
+    for _ in range(repeat + 1):  # (the first run warms up Altair's schema validation, so it isn't counted)
+        start = time.perf_counter()
+        with altair.data_transformers.enable('default', max_rows=None):
+            build().to_dict()
+        timings.append(time.perf_counter() - start)
+    return statistics.median(timings[1:])
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark chart payload size and build time as the range grows")
+    parser.add_argument('--days', type=int, nargs='+', default=[30, 90, 365, 730, 1825, 3650])
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    print("{:>6} {:>8} {:>7} {:>10} {:>10} {:>10} {:>12} {:>10}".format(
+        "days", "layout", "points", "arrow", "inline", "json", "vegafusion", "build ms"))
+    with tempfile.TemporaryDirectory() as directory:
+        for days in args.days:
+            rows = daily_rows(days)
+            columns = bucketed_columns(rows, days)
+            bucket = pick_bucket(days)
+            for layout, build in [('dicts', lambda: dict_rows_chart(rows)),
+                                  (bucket, lambda: graph_chart(columns, bucket=bucket))]:
+                chart = build()
+                sizes = [spec_bytes(chart, transformer, directory) for transformer in TRANSFORMERS]
+                print("{:>6} {:>8} {:>7} {:>10,} {:>10} {:>10} {:>12} {:>10.1f}".format(
+                    days, layout, len(chart.data), arrow_bytes(chart),
+                    *["-" if size is None else "{:,}".format(size) for size in sizes],
+                    build_seconds(build, args.repeat) * 1000))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,135 @@
+"""
+Benchmark the near-duplicate article grouping on synthetic alert feeds: how fast articles are assigned as the set
+grows (it should stay flat per article, rather than grow with the set like an all-pairs comparison), and how well the
+groups match the stories the articles were generated from.
+
+Runs in memory by default; with --db it also loads synthetic articles into the database ALERTS_DB_URI points at (only
+ever a scratch one), groups them with `grouping.refresh` and times pages of the grouped listing.
+
+    python -m benchmarks.grouping_benchmark --sizes 10000 50000 200000
+    python -m benchmarks.grouping_benchmark --db --rows 500000
+"""
+import argparse
+import random
+import statistics
+import time
+from collections import Counter
+from typing import List, Tuple
+
+import dashboard.database.grouping as grouping
+
+OUTLETS = ['El Comercio', 'La Nacion', 'Infobae', 'El Tiempo', 'Clarin', 'El Universal', 'Pagina 12', 'La Republica']
+HOSTS = ['elcomercio.pe', 'lanacion.com.ar', 'infobae.com', 'eltiempo.com', 'clarin.com', 'eluniversal.com.mx']
+
+
+def synthetic_feed(articles: int, projects: int = 5, seed: int = 1) -> Tuple[List[tuple], List[int]]:
+    """
+    Articles the way alerts send them: each story repeated a few times (sometimes many), under titles with a word
+    dropped or an outlet name tacked on, and links with tracking parameters.
+    :return: (articles_id, project_id, title, url) tuples in id order, and the story each one is about
+    """
+    rng = random.Random(seed)
+    vocabulary = ['word{}'.format(i) for i in range(20000)]
+    feed, truth, story = [], [], 0
+    while len(feed) < articles:
+        story += 1
+        project_id = rng.randrange(projects) + 1
+        words = rng.sample(vocabulary, rng.randint(7, 14))
+        host = rng.choice(HOSTS)
+        path = '/{}/{}'.format(rng.choice(['news', 'policiales', 'sociedad']), story)
+        for _ in range(min(int(rng.paretovariate(1.2)), 50)):
+            title = list(words)
+            if rng.random() < 0.3:
+                del title[rng.randrange(len(title))]
+            if rng.random() < 0.3:
+                title += ['-', rng.choice(OUTLETS)]
+            if rng.random() < 0.5:  # same story from another outlet, so only the title gives it away
+                url = 'https://{}{}-{}'.format(rng.choice(HOSTS), path, rng.randrange(1000))
+            else:
+                url = 'https://www.{}{}?utm_source=alert&utm_medium={}'.format(host, path, rng.randrange(1000))
+            feed.append((len(feed) + 1, project_id, ' '.join(title), url))
+            truth.append(story)
+    return feed[:articles], truth[:articles]
+
+
+def _pairs(sizes) -> int:
+    return sum(n * (n - 1) // 2 for n in sizes)
+
+
+def pair_scores(predicted: List[int], truth: List[int]) -> Tuple[float, float]:
+    """
+    :return: precision and recall over pairs of articles put in the same group
+    """
+    together = _pairs(Counter(zip(predicted, truth)).values())
+    predicted_pairs, true_pairs = _pairs(Counter(predicted).values()), _pairs(Counter(truth).values())
+    return together / predicted_pairs if predicted_pairs else 1.0, together / true_pairs if true_pairs else 1.0
+
+
+def group_in_memory(feed: List[tuple], batch_size: int = grouping.BATCH_SIZE) -> Tuple[List[int], float, int]:
+    """
+    The same batch by batch assignment `grouping.refresh` does, with the band index kept in memory.
+    :return: the group of each article, seconds taken, and how many articles ended up indexed
+    """
+    index = grouping.BandIndex()
+    clusters, indexed = [], 0
+    start = time.perf_counter()
+    for i in range(0, len(feed), batch_size):
+        assigned, to_index = grouping.assign(index, grouping.signatures(feed[i:i + batch_size]))
+        clusters += [s.cluster_id for _, s in assigned]
+        indexed += len(to_index)
+    return clusters, time.perf_counter() - start, indexed
+
+
+def _benchmark_db(rows: int, repeat: int) -> None:
+    import psycopg2
+    from dashboard import settings
+    import dashboard.database.alerts_db as alerts_db
+    from dashboard.database.cache import query_cache
+    from benchmarks import synthetic
+    conn = psycopg2.connect(settings.ALERTS_DB_URI)
+    count = synthetic.load_if_empty(conn, 'articles', synthetic.load_articles, rows)
+    start = time.perf_counter()
+    summary = grouping.refresh(conn, full=True)
+    full = time.perf_counter() - start
+    start = time.perf_counter()
+    grouping.refresh(conn)
+    incremental = time.perf_counter() - start
+    conn.close()
+    print("\n{:,} articles in the database: grouped in {:.1f}s ({:.0f}/s), {:,} indexed; "
+          "incremental refresh with nothing new {:.3f}s".format(count, full, summary['articles'] / full,
+                                                               summary['indexed'], incremental))
+    for label, project_id in [('one project', 1), ('all projects', None)]:
+        timings, after = [], None
+        for _ in range(repeat):  # walk a few pages deep, each should cost the same
+            query_cache.clear()
+            start = time.perf_counter()
+            groups, after = alerts_db.grouped_articles(project_id, after)
+            timings.append(time.perf_counter() - start)
+            if after is None:
+                break
+        print("grouped_articles page ({}): median {:.1f}ms".format(label, statistics.median(timings) * 1000))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark near-duplicate article grouping")
+    parser.add_argument('--sizes', type=int, nargs='+', default=[10000, 50000, 200000],
+                        help="synthetic feed sizes to group in memory")
+    parser.add_argument('--db', action='store_true', help="also group synthetic articles in the alerts database")
+    parser.add_argument('--rows', type=int, default=500000, help="synthetic articles to load if the table is empty")
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    print("{:>10} {:>10} {:>10} {:>12} {:>10} {:>10}".format(
+        "articles", "seconds", "µs/article", "indexed", "precision", "recall"))
+    for size in args.sizes:
+        feed, truth = synthetic_feed(size)
+        clusters, seconds, indexed = group_in_memory(feed)
+        precision, recall = pair_scores(clusters, truth)
+        print("{:>10,} {:>10.2f} {:>10.1f} {:>12,} {:>10.3f} {:>10.3f}".format(
+            size, seconds, seconds / size * 1e6, indexed, precision, recall))
+    if args.db:
+        _benchmark_db(args.rows, args.repeat)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,77 @@
+"""
+Compare peak Python memory for a big story listing read the old way (`select *` through a RealDictCursor, fetchall,
+then a DataFrame of dicts) against streaming just the listed columns through a server-side cursor into a column-wise
+DataFrame.
+
+Point PROCESSOR_DB_URI at a scratch database and run:
+
+    python -m benchmarks.memory_benchmark --rows 2000000
+"""
+import argparse
+import time
+import tracemalloc
+
+import pandas as pd
+import psycopg2
+import psycopg2.extras
+
+from dashboard import PROCESSOR_DB_URI
+from dashboard.database.processor_db import STORY_LIST_COLUMNS
+import dashboard.database.streaming as streaming
+from benchmarks import synthetic
+
+QUERY = "select {} from stories where project_id = %(project_id)s and above_threshold is True"
+
+
+def _fetchall_frame(conn, project_id: int) -> pd.DataFrame:
+    with conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor) as cursor:
+        cursor.execute(QUERY.format("*"), dict(project_id=project_id))
+        rows = cursor.fetchall()
+    return pd.DataFrame(rows)
+
+
+def _streamed_frame(conn, project_id: int, itersize: int) -> pd.DataFrame:
+    query = QUERY.format(", ".join(STORY_LIST_COLUMNS))
+    return streaming.to_frame(STORY_LIST_COLUMNS,
+                              streaming.iter_batches(conn, query, dict(project_id=project_id), itersize))
+
+
+def _measure(func):
+    tracemalloc.start()
+    start = time.perf_counter()
+    df = func()
+    duration = time.perf_counter() - start
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return duration, peak, len(df), df.memory_usage(deep=True).sum()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark memory use of fetchall vs server-side cursor listings")
+    parser.add_argument('--rows', type=int, default=2000000, help="synthetic stories to load if the table is empty")
+    parser.add_argument('--project-id', type=int, default=1)
+    parser.add_argument('--itersize', type=int, default=2000)
+    args = parser.parse_args()
+
+    conn = psycopg2.connect(PROCESSOR_DB_URI)
+    with conn.cursor() as cursor:
+        cursor.execute("select to_regclass('stories') is not null")
+        has_stories = cursor.fetchone()[0]
+    if not has_stories or synthetic.table_row_count(conn, 'stories') == 0:
+        synthetic.load_stories(conn, args.rows)
+    conn.rollback()
+
+    results = dict(fetchall=_measure(lambda: _fetchall_frame(conn, args.project_id)))
+    conn.rollback()
+    results['streamed'] = _measure(lambda: _streamed_frame(conn, args.project_id, args.itersize))
+    conn.rollback()
+    conn.close()
+
+    for label, (duration, peak, rows, frame_bytes) in results.items():
+        print("{:<10} {:>10,} rows  {:.2f}s  peak {:>8.1f}MB  frame {:>8.1f}MB".format(
+            label + ':', rows, duration, peak / 1024 / 1024, frame_bytes / 1024 / 1024))
+    print("peak memory saved: {:.0f}%".format(100 * (1 - results['streamed'][1] / results['fetchall'][1])))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,63 @@
+"""
+How much planning time do prepared statements save per page load? Captures every query a Projects page render
+issues, then replays them as plain parameterized queries and as server-side prepared statements.
+
+    python -m benchmarks.planning_benchmark --project-id 1 --renders 50
+"""
+import argparse
+import statistics
+import time
+
+import psycopg2
+
+from dashboard import PROCESSOR_DB_URI, ALERTS_DB_URI
+from dashboard.database.query import execute, PreparingConnection
+from dashboard.database.schema import dashboard_queries
+
+
+def _planning_time(conn, query: str, params) -> float:
+    with conn.cursor() as cursor:
+        execute(cursor, "EXPLAIN (SUMMARY, FORMAT JSON) " + query, params)
+        plan = cursor.fetchone()[0]
+    conn.rollback()
+    return plan[0]['Planning Time']
+
+
+def _render(conns, queries, prepare: bool) -> float:
+    start = time.perf_counter()
+    for database, query, params in queries:
+        with conns[database].cursor() as cursor:
+            execute(cursor, query, params, prepare)
+            cursor.fetchall()
+    return time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark planning time saved by prepared statements")
+    parser.add_argument('--project-id', type=int, required=True)
+    parser.add_argument('--renders', type=int, default=50, help="page loads to replay in each mode")
+    args = parser.parse_args()
+
+    queries = dashboard_queries(args.project_id)
+    conns = dict(processor=psycopg2.connect(PROCESSOR_DB_URI, connection_factory=PreparingConnection),
+                 alerts=psycopg2.connect(ALERTS_DB_URI, connection_factory=PreparingConnection))
+    for conn in conns.values():
+        conn.autocommit = True
+    planning = sum(_planning_time(conns[database], query, params) for database, query, params in queries)
+
+    results = {}
+    for prepare in [False, True]:
+        _render(conns, queries, prepare)  # warm up caches (and PREPARE everything)
+        results[prepare] = statistics.median(_render(conns, queries, prepare) for _ in range(args.renders))
+    for conn in conns.values():
+        conn.close()
+
+    print("queries per page load:        {}".format(len(queries)))
+    print("planning time per page load:  {:.2f}ms".format(planning))
+    print("render, parameterized:        {:.2f}ms".format(results[False] * 1000))
+    print("render, prepared statements:  {:.2f}ms".format(results[True] * 1000))
+    print("saved per page load:          {:.2f}ms".format((results[False] - results[True]) * 1000))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,83 @@
+"""
+Compare the history chart queries against raw `stories` scans and against the `story_daily_counts` rollup.
+
+Point PROCESSOR_DB_URI at a scratch database and run:
+
+    python -m benchmarks.rollup_benchmark --rows 5000000
+"""
+import argparse
+import statistics
+import time
+
+import psycopg2
+
+from dashboard import PROCESSOR_DB_URI, settings
+import dashboard.database.processor_db as processor_db
+import dashboard.database.rollup as rollup
+from dashboard.database.cache import query_cache
+from benchmarks import synthetic
+
+
+def _time(func, repeat: int) -> float:
+    timings = []
+    for _ in range(repeat):
+        query_cache.clear()  # so every run really goes to the database
+        start = time.perf_counter()
+        func()
+        timings.append(time.perf_counter() - start)
+    return statistics.median(timings)
+
+
+def _page_queries(project_id: int):
+    processor_db.story_counts_by_day('processed_date', project_id)
+    processor_db.story_counts_by_day('published_date', project_id, limit=30)
+    processor_db.stories_by_posted_day(project_id=project_id)
+    processor_db.posted_above_story_count(project_id)
+    processor_db.below_story_count(project_id)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark rollup reads against raw stories scans")
+    parser.add_argument('--rows', type=int, default=5000000, help="synthetic stories to load if the table is empty")
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--project-id', type=int, default=1)
+    args = parser.parse_args()
+    # time the databases: with SHARED_CACHE_DIR set, cleared results would otherwise come back from the shared cache
+    query_cache.shared = False
+
+    conn = psycopg2.connect(PROCESSOR_DB_URI)
+    with conn.cursor() as cursor:
+        cursor.execute("select to_regclass('stories') is not null")
+        has_stories = cursor.fetchone()[0]
+    if not has_stories or synthetic.table_row_count(conn, 'stories') == 0:
+        synthetic.load_stories(conn, args.rows)
+    row_count = synthetic.table_row_count(conn, 'stories')
+
+    start = time.perf_counter()
+    rollup.refresh(conn, full=True)
+    full_refresh = time.perf_counter() - start
+    start = time.perf_counter()
+    rollup.refresh(conn)
+    incremental_refresh = time.perf_counter() - start
+    conn.close()
+
+    results = {}
+    for use_rollup in [False, True]:
+        settings.USE_STORY_ROLLUP = use_rollup
+        for label, project_id in [('all projects', None), ('one project', args.project_id)]:
+            if project_id is None:
+                func = lambda: processor_db.story_counts_by_day('processed_date')
+            else:
+                func = lambda: _page_queries(project_id)
+            results[(use_rollup, label)] = _time(func, args.repeat)
+
+    print("stories rows:            {:,}".format(row_count))
+    print("full rollup refresh:     {:.3f}s".format(full_refresh))
+    print("incremental refresh:     {:.3f}s".format(incremental_refresh))
+    for label in ['all projects', 'one project']:
+        raw, rolled = results[(False, label)], results[(True, label)]
+        print("{:<24} raw {:.3f}s  rollup {:.3f}s  ({:.0f}x)".format(label + ':', raw, rolled, raw / rolled))
+
+
+if __name__ == '__main__':
+    main()
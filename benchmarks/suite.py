@@ -0,0 +1,203 @@
+"""
+Time every public query function in `processor_db` and `alerts_db`, plus full renders of the dashboard pages through
+Streamlit's AppTest, against synthetic data, and save the results as JSON so releases can be compared.
+
+Point PROCESSOR_DB_URI and ALERTS_DB_URI at scratch databases and run:
+
+    python -m benchmarks.suite --stories 2000000 --articles 500000
+    python -m benchmarks.suite --compare benchmarks/results/0.0.1.json  # flag anything that got slower
+"""
+import argparse
+import datetime as dt
+import inspect
+import json
+import os
+import statistics
+import subprocess
+import time
+from typing import Callable, Dict
+
+import psycopg2
+
+from dashboard import VERSION, PROCESSOR_DB_URI, ALERTS_DB_URI, base_dir
+import dashboard.database.processor_db as processor_db
+import dashboard.database.alerts_db as alerts_db
+import dashboard.database.grouping as grouping
+import dashboard.database.reconcile as reconcile
+from dashboard.database.cache import query_cache
+from benchmarks import synthetic
+
+RESULTS_DIR = os.path.join(base_dir, 'benchmarks', 'results')
+SLOWER_THRESHOLD = 1.2  # flag timings more than 20% slower than the ones compared against
+
+# how to call each public function for one project; a new public function has to be added here too
+CALLS = {
+    processor_db: {
+        'recent_stories': lambda p: processor_db.recent_stories(p, True),
+        'story_page': lambda p: processor_db.story_page(p),
+        'story_counts_by_day': lambda p: processor_db.story_counts_by_day('processed_date', p),
+        'stories_by_posted_day': lambda p: processor_db.stories_by_posted_day(project_id=p),
+        'stories_by_processed_day': lambda p: processor_db.stories_by_processed_day(project_id=p),
+        'stories_by_published_day': lambda p: processor_db.stories_by_published_day(project_id=p),
+        'unposted_above_story_count': lambda p: processor_db.unposted_above_story_count(p),
+        'posted_above_story_count': lambda p: processor_db.posted_above_story_count(p),
+        'below_story_count': lambda p: processor_db.below_story_count(p),
+        'iter_unposted_stories': lambda p: list(processor_db.iter_unposted_stories(p, 30)),
+        'unposted_stories': lambda p: processor_db.unposted_stories(p, 30),
+        'project_summary': lambda p: processor_db.project_summary(p),
+        'score_distribution': lambda p: processor_db.score_distribution(p, by='source'),
+    },
+    alerts_db: {
+        'recent_articles': lambda p: alerts_db.recent_articles(p),
+        'articles_by_published_day': lambda p: alerts_db.articles_by_published_day(p),
+        'grouped_articles': lambda p: alerts_db.grouped_articles(p),
+        'group_articles': lambda p: [alerts_db.group_articles(g['cluster_id'])
+                                     for g in alerts_db.grouped_articles(p)[0][:1]],
+        'article_coverage_by_day': lambda p: alerts_db.article_coverage_by_day(p),
+    },
+}
+NOT_QUERIES = {'db_pool', 'using_snapshot'}
+
+
+def public_functions(module) -> Dict[str, Callable]:
+    return {name: func for name, func in inspect.getmembers(module, inspect.isfunction)
+            if func.__module__ == module.__name__ and not name.startswith('_') and name not in NOT_QUERIES}
+
+
+def _summarize(timings) -> Dict:
+    return dict(median=statistics.median(timings), min=min(timings), max=max(timings), runs=len(timings))
+
+
+def time_functions(project_id: int, repeat: int) -> Dict:
+    """
+    Time each public query function with an empty query cache, so it really goes to the database every run (`main`
+    turns the shared cache off for the same reason).
+    """
+    results = {}
+    for module, calls in CALLS.items():
+        missing = set(public_functions(module)) - set(calls)
+        if missing:
+            raise RuntimeError("No benchmark call for {}.{} - add one to CALLS".format(module.__name__, missing))
+        for name, call in calls.items():
+            timings = []
+            for _ in range(repeat):
+                query_cache.clear()
+                start = time.perf_counter()
+                call(project_id)
+                timings.append(time.perf_counter() - start)
+            results['{}.{}'.format(module.__name__.split('.')[-1], name)] = _summarize(timings)
+    return results
+
+
+def time_renders(project_title: str, repeat: int) -> Dict:
+    """
+    Time full script runs of the home page and of each Projects page section through AppTest (Streamlit 1.28+).
+    """
+    from streamlit.testing.v1 import AppTest
+    home = os.path.join(base_dir, 'Dashboard.py')
+    projects_page = os.path.join(base_dir, 'pages', '1_Projects.py')
+
+    def _timed(run: Callable, app=None):
+        query_cache.clear()
+        start = time.perf_counter()
+        app = run(app)
+        duration = time.perf_counter() - start
+        if app.exception:
+            raise RuntimeError("Render failed: {}".format(app.exception[0].message))
+        return duration, app
+
+    renders = {}
+    renders['Dashboard'] = _summarize([_timed(lambda _: AppTest.from_file(home, default_timeout=120).run())[0]
+                                       for _ in range(repeat)])
+    select_timings, section_timings = [], {}
+    for _ in range(repeat):
+        duration, app = _timed(lambda _: AppTest.from_file(projects_page, default_timeout=120).run())
+        duration, app = _timed(lambda a: a.selectbox[0].select(project_title).run(), app)
+        select_timings.append(duration)
+        for section in app.radio(key='projects_section').options:
+            if section == app.radio(key='projects_section').value:
+                continue  # the first section was drawn when the project was selected
+            duration, app = _timed(lambda a: a.radio(key='projects_section').set_value(section).run(), app)
+            section_timings.setdefault(section, []).append(duration)
+    renders['Projects: select project'] = _summarize(select_timings)
+    for section, timings in section_timings.items():
+        renders['Projects: ' + section] = _summarize(timings)
+    return renders
+
+
+def _git_commit() -> str:
+    try:
+        return subprocess.check_output(['git', 'rev-parse', 'HEAD'], cwd=base_dir, text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(results: Dict, baseline: Dict) -> None:
+    print("\nCompared with {} ({}):".format(baseline['version'], baseline['timestamp']))
+    for group in ['functions', 'renders']:
+        for name, timing in results.get(group, {}).items():
+            before = baseline.get(group, {}).get(name)
+            if before is None:
+                continue
+            ratio = timing['median'] / before['median']
+            flag = "  <-- slower" if ratio > SLOWER_THRESHOLD else ""
+            print("  {:<45} {:>8.1f}ms -> {:>8.1f}ms ({:.2f}x){}".format(
+                name, before['median'] * 1000, timing['median'] * 1000, ratio, flag))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark every dashboard query and page render")
+    parser.add_argument('--stories', type=int, default=2000000, help="synthetic stories to load if the table is empty")
+    parser.add_argument('--articles', type=int, default=500000, help="synthetic articles to load if the table is empty")
+    parser.add_argument('--projects', type=int, default=20)
+    parser.add_argument('--days', type=int, default=365)
+    parser.add_argument('--project-id', type=int, default=1)
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--skip-renders', action='store_true', help="only time the query functions")
+    parser.add_argument('--output', help="where to save the JSON results (default benchmarks/results/<version>.json)")
+    parser.add_argument('--compare', help="earlier results JSON to compare against")
+    args = parser.parse_args()
+    # time the databases: with SHARED_CACHE_DIR set, cleared results would otherwise come back from the shared cache
+    query_cache.shared = False
+
+    volumes = {}
+    for uri, table, loader, rows in [(PROCESSOR_DB_URI, 'stories', synthetic.load_stories, args.stories),
+                                     (ALERTS_DB_URI, 'articles', synthetic.load_articles, args.articles)]:
+        conn = psycopg2.connect(uri)
+        volumes[table] = synthetic.load_if_empty(conn, table, loader, rows, projects=args.projects, days=args.days)
+        if table == 'articles':
+            grouping.refresh(conn)  # so the grouped article listings have something to list
+        conn.close()
+    # and match articles to stories, for the coverage counts
+    processor_conn, alerts_conn = psycopg2.connect(PROCESSOR_DB_URI), psycopg2.connect(ALERTS_DB_URI)
+    reconcile.refresh(processor_conn, alerts_conn)
+    processor_conn.close()
+    alerts_conn.close()
+
+    results = dict(version=VERSION, commit=_git_commit(), timestamp=dt.datetime.now().isoformat(timespec='seconds'),
+                   settings=dict(project_id=args.project_id, repeat=args.repeat), rows=volumes,
+                   functions=time_functions(args.project_id, args.repeat))
+    if not args.skip_renders:
+        # the Projects page lists projects from the main server, so look up which title the project id has there
+        from dashboard import projects
+        title = [p['title'] for p in projects.load_project_list(download_if_missing=True)
+                 if p['id'] == args.project_id][0]
+        results['renders'] = time_renders(title, args.repeat)
+
+    for group in ['functions', 'renders']:
+        for name, timing in results.get(group, {}).items():
+            print("{:<45} median {:>8.1f}ms  (min {:.1f}ms, max {:.1f}ms)".format(
+                name, timing['median'] * 1000, timing['min'] * 1000, timing['max'] * 1000))
+
+    output = args.output or os.path.join(RESULTS_DIR, '{}.json'.format(VERSION))
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, 'w') as f:
+        json.dump(results, f, indent=2)
+    print("\nSaved results to {}".format(output))
+    if args.compare:
+        with open(args.compare) as f:
+            compare(results, json.load(f))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,112 @@
+"""
+Load synthetic `stories` (processor database) and `articles` (alerts database) rows into scratch Postgres databases for
+benchmarking. Rows are generated server-side with generate_series, so several million of them load in seconds. Never
+point this at a production database.
+"""
+import logging
+
+from dashboard import PLATFORMS
+
+logger = logging.getLogger(__name__)
+
+STORIES_SCHEMA = '''
+    CREATE TABLE IF NOT EXISTS stories (
+        id bigserial PRIMARY KEY,
+        stories_id bigint,
+        project_id integer,
+        model_id integer,
+        source text,
+        url text,
+        model_score double precision,
+        above_threshold boolean,
+        published_date timestamp,
+        processed_date timestamp,
+        queued_date timestamp,
+        posted_date timestamp
+    );
+'''
+
+ARTICLES_SCHEMA = '''
+    CREATE TABLE IF NOT EXISTS articles (
+        id bigserial PRIMARY KEY,
+        project_id integer,
+        source text,
+        url text,
+        title text,
+        publish_date timestamp,
+        published_date timestamp
+    );
+'''
+
+
+def table_row_count(conn, table: str) -> int:
+    with conn.cursor() as cursor:
+        cursor.execute("select count(1) from {}".format(table))
+        return cursor.fetchone()[0]
+
+
+def load_stories(conn, rows: int, projects: int = 20, days: int = 365, threshold: float = 0.75) -> None:
+    """
+    Insert `rows` synthetic stories spread over `projects` projects and the last `days` days. Scores are skewed low
+    (most stories are below threshold), published dates trail processed dates by a few days, and stories above
+    threshold are usually posted within a day of processing.
+    """
+    with conn.cursor() as cursor:
+        cursor.execute(STORIES_SCHEMA)
+        cursor.execute('''
+            INSERT INTO stories (stories_id, project_id, model_id, source, url, model_score, above_threshold,
+                                 published_date, processed_date, queued_date, posted_date)
+            SELECT g.n, 1 + (g.n %% %(projects)s), 1 + (g.n %% 3), (%(sources)s)[1 + (g.n %% %(source_count)s)],
+                   'https://example.com/' || md5(g.n::text), score.value, score.value >= %(threshold)s,
+                   processed.value - (random() * interval '5 days'),
+                   processed.value, processed.value,
+                   CASE WHEN score.value >= %(threshold)s AND random() < 0.98
+                        THEN processed.value + (random() * interval '1 day') END
+            FROM generate_series(1, %(rows)s) AS g(n)
+            CROSS JOIN LATERAL (SELECT power(random(), 2) AS value) AS score
+            CROSS JOIN LATERAL (SELECT now()::timestamp - (random() * %(days)s * interval '1 day') AS value)
+                AS processed
+        ''', dict(rows=rows, projects=projects, days=days, threshold=threshold, sources=PLATFORMS,
+                  source_count=len(PLATFORMS)))
+        cursor.execute("ANALYZE stories")
+    conn.commit()
+    logger.info("Loaded {} synthetic stories".format(rows))
+
+
+def load_articles(conn, rows: int, projects: int = 20, days: int = 365) -> None:
+    """
+    Insert `rows` synthetic articles spread over `projects` projects and the last `days` days. About a third share a
+    URL with a synthetic story (the alert came from a story we processed), and titles repeat in small families of near
+    duplicates, like syndicated copies of one wire story.
+    """
+    with conn.cursor() as cursor:
+        cursor.execute(ARTICLES_SCHEMA)
+        cursor.execute('''
+            INSERT INTO articles (project_id, source, url, title, publish_date, published_date)
+            SELECT 1 + (g.n %% %(projects)s), (%(sources)s)[1 + (g.n %% %(source_count)s)],
+                   CASE WHEN g.n %% 3 = 0 THEN 'https://example.com/' || md5(g.n::text)
+                        ELSE 'https://news.example.org/' || g.n || '?utm_source=alert' END,
+                   'Story ' || (g.n / 5) || ' about case ' || (g.n / 5 %% 997) || ' reported in city ' || (g.n %% 7),
+                   published.value, published.value
+            FROM generate_series(1, %(rows)s) AS g(n)
+            CROSS JOIN LATERAL (SELECT now()::timestamp - (random() * %(days)s * interval '1 day') AS value)
+                AS published
+        ''', dict(rows=rows, projects=projects, days=days, sources=PLATFORMS, source_count=len(PLATFORMS)))
+        cursor.execute("ANALYZE articles")
+    conn.commit()
+    logger.info("Loaded {} synthetic articles".format(rows))
+
+
+def load_if_empty(conn, table: str, loader, rows: int, **kwargs) -> int:
+    """
+    Run `loader(conn, rows, **kwargs)` unless `table` already has rows.
+    :return: how many rows the table has
+    """
+    with conn.cursor() as cursor:
+        cursor.execute("select to_regclass(%s) is not null", (table,))
+        exists = cursor.fetchone()[0]
+    if not exists or table_row_count(conn, table) == 0:
+        loader(conn, rows, **kwargs)
+    count = table_row_count(conn, table)
+    conn.commit()
+    return count
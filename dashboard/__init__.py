@@ -1,8 +1,6 @@
 import os
 import logging
-import sys
-from dotenv import load_dotenv
-from sentry_sdk import init
+import threading
 
 VERSION = "0.0.1"
 #SOURCE_GOOGLE_ALERTS = "google-alerts"
@@ -11,42 +9,117 @@ SOURCE_NEWSCATCHER = "newscatcher"
 SOURCE_WAYBACK_MACHINE = "wayback-machine"
 PLATFORMS = [SOURCE_MEDIA_CLOUD, SOURCE_NEWSCATCHER, SOURCE_WAYBACK_MACHINE]
 
-load_dotenv()  # load config from .env file (local) or env vars (production)
-
 base_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
 CONFIG_DIR = os.path.join(base_dir, "config")
 
-# set up logging
-logging.basicConfig(level=logging.INFO, format='%(asctime)s | %(levelname)s | %(name)s | %(message)s')
 logger = logging.getLogger(__name__)
-logger.info("------------------------------------------------------------------------")
-logger.info("Starting up Feminicide Dashboard v{}".format(VERSION))
-
-SENTRY_DSN = os.environ.get('SENTRY_DSN', None)  # optional
-if SENTRY_DSN:
-    init(dsn=SENTRY_DSN, release=VERSION)
-    logger.info("  SENTRY_DSN: {}".format(SENTRY_DSN))
-else:
-    logger.info("  Not logging errors to Sentry")
-
-FEMINICIDE_API_URL = os.environ.get('FEMINICIDE_API_URL', None)
-if FEMINICIDE_API_URL is None:
-    logger.error("  ❌ No FEMINICIDE_API_URL is specified. Bailing because we can't list projects to run!")
-    sys.exit(1)
-else:
-    logger.info("  Config server at at {}".format(FEMINICIDE_API_URL))
-
-FEMINICIDE_API_KEY = os.environ.get('FEMINICIDE_API_KEY', None)
-if FEMINICIDE_API_KEY is None:
-    logger.error("  ❌ No FEMINICIDE_API_KEY is specified. Bailing because we can't send things to the main server without one")
-    sys.exit(1)
-
-PROCESSOR_DB_URI = os.environ.get('PROCESSOR_DB_URI', None)
-if PROCESSOR_DB_URI is None:
-    logger.warning("  ❌ ️No PROCESSOR_DB_URI is specified")
-    sys.exit(1)
-
-ALERTS_DB_URI = os.environ.get('ALERTS_DB_URI', None)
-if ALERTS_DB_URI is None:
-    logger.warning("  ❌ ️No ALERTS_DB_URI is specified")
-    sys.exit(1)
\ No newline at end of file
+
+
+class ConfigError(RuntimeError):
+    pass
+
+
+def _flag(value: str) -> bool:
+    return value.lower() in ['true', '1', 'yes']
+
+
+QUERY_BACKENDS = ['postgres', 'duckdb']
+
+
+def _query_backend(value: str) -> str:
+    if value.lower() not in QUERY_BACKENDS:
+        raise ConfigError("QUERY_BACKEND must be one of {} (not '{}')".format(QUERY_BACKENDS, value))
+    return value.lower()
+
+
+# name -> (parser, default); settings without a default are required
+SETTINGS = {
+    'SENTRY_DSN': (str, None),  # optional
+    # share of page renders to send to Sentry as performance traces, with a span per query (0 for errors only)
+    'SENTRY_TRACES_SAMPLE_RATE': (float, 0.0),
+    'FEMINICIDE_API_URL': (str, ...),
+    'FEMINICIDE_API_KEY': (str, ...),
+    'PROCESSOR_DB_URI': (str, ...),
+    'ALERTS_DB_URI': (str, ...),
+    # read history charts and counters from the pre-aggregated daily rollup (see dashboard.database.rollup)
+    'USE_STORY_ROLLUP': (_flag, False),
+    # database connection pool settings, shared by the processor and alerts databases
+    'DB_POOL_MIN_SIZE': (int, 1),
+    'DB_POOL_MAX_SIZE': (int, 5),
+    'DB_STATEMENT_TIMEOUT': (int, 30000),  # milliseconds
+    'DB_CURSOR_ITERSIZE': (int, 2000),  # rows per batch when streaming big listings
+    # how many query results to keep in the in-memory cache (see dashboard.database.cache)
+    'QUERY_CACHE_MAX_ENTRIES': (int, 512),
+    # optional directory for query results shared by every dashboard process on the host (see
+    # dashboard.database.shared_cache), so running more workers doesn't mean more database load
+    'SHARED_CACHE_DIR': (str, None),
+    # seconds before the cached projects.json is refreshed from the main server (in the background)
+    'PROJECTS_TTL': (int, 600),
+    # where the processor queries run: 'postgres', or 'duckdb' over the Parquet snapshot in SNAPSHOT_DIR (see
+    # dashboard.database.snapshot and dashboard.database.duckdb_db)
+    'QUERY_BACKEND': (_query_backend, 'postgres'),
+    'SNAPSHOT_DIR': (str, os.path.join(base_dir, 'snapshots')),
+    # optional file to write query metrics to in the Prometheus text format (ie. for node_exporter's textfile collector)
+    'PROMETHEUS_TEXTFILE': (str, None),
+}
+
+
+class Settings:
+    """
+    Config from env vars (production) or a local .env file, read and checked the first time any setting is used rather
+    than on import - so importing the package is cheap and has no side effects, and a missing setting is reported
+    (all of them at once) where it is needed. Logging and Sentry are set up at the same time.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._loaded = False
+
+    def __getattr__(self, name):
+        if name.startswith('_') or name not in SETTINGS:
+            raise AttributeError(name)
+        self.load()
+        try:
+            return self.__dict__[name]
+        except KeyError:  # ie. deleted by a test
+            raise AttributeError(name)
+
+    def load(self) -> None:
+        with self._lock:
+            if self._loaded:
+                return
+            from dotenv import load_dotenv
+            load_dotenv()
+            logging.basicConfig(level=logging.INFO, format='%(asctime)s | %(levelname)s | %(name)s | %(message)s')
+            logger.info("------------------------------------------------------------------------")
+            logger.info("Starting up Feminicide Dashboard v{}".format(VERSION))
+            values, missing = {}, []
+            for name, (parse, default) in SETTINGS.items():
+                value = os.environ.get(name)
+                if value in [None, ''] and default is ...:
+                    missing.append(name)
+                values[name] = default if value in [None, ''] else parse(value)
+            if missing:
+                for name in missing:
+                    logger.error("  ❌ No {} is specified".format(name))
+                raise ConfigError("Missing required settings: {}".format(", ".join(missing)))
+            if values['SENTRY_DSN']:
+                from sentry_sdk import init
+                init(dsn=values['SENTRY_DSN'], release=VERSION, traces_sample_rate=values['SENTRY_TRACES_SAMPLE_RATE'])
+                logger.info("  SENTRY_DSN: {}".format(values['SENTRY_DSN']))
+            else:
+                logger.info("  Not logging errors to Sentry")
+            logger.info("  Config server at at {}".format(values['FEMINICIDE_API_URL']))
+            for name, value in values.items():
+                self.__dict__.setdefault(name, value)  # (unless a test has already patched it)
+            self._loaded = True
+
+
+settings = Settings()
+
+
+def __getattr__(name):
+    # so `from dashboard import PROCESSOR_DB_URI` still works (and loads the settings at that point)
+    if name in SETTINGS:
+        return getattr(settings, name)
+    raise AttributeError("module {!r} has no attribute {!r}".format(__name__, name))
@@ -1,7 +1,25 @@
+import time
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Optional, Tuple
+
 import requests
-from typing import Dict
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+from dashboard import settings
 
-from dashboard import FEMINICIDE_API_URL, FEMINICIDE_API_KEY
+# the dashboard is interactive, so fail fast rather than hang a page for minutes
+CONNECT_TIMEOUT = 3.05  # docs say set it to slightly larger than a multiple of 3
+READ_TIMEOUT = 30
+MAX_RETRIES = 3  # for connection errors and 5xx responses, with exponential backoff
+RETRY_BACKOFF = 0.5  # seconds; doubles on each retry
+MAX_RESPONSE_BYTES = 20 * 1024 * 1024  # refuse to decode anything bigger than this
+
+_session = None
+_session_lock = threading.Lock()
+_metrics = {}  # path -> dict of request stats
+_metrics_lock = threading.Lock()
 
 
 def get_projects_list() -> Dict:
@@ -9,8 +27,17 @@ def get_projects_list() -> Dict:
     The main server holds configuraiton and models - get the list.
     :return:
     """
-    path = FEMINICIDE_API_URL + '/api/story_processor/projects.json'
-    return _get_json(path)
+    return _get_json(_projects_list_url())
+
+
+def get_projects_list_if_modified(validators: Dict = None) -> Tuple[Optional[Dict], Dict]:
+    """
+    Like `get_projects_list`, but a conditional request: pass the validators from last time and get back None if the
+    list hasn't changed since then.
+    :param validators: `etag` and/or `last_modified` from the previous response
+    :return: the list (or None if not modified), and the validators to send next time
+    """
+    return _get_json_if_modified(_projects_list_url(), validators)
 
 
 def get_language_models_list() -> Dict:
@@ -18,12 +45,104 @@ def get_language_models_list() -> Dict:
     Each project can refer to one or two models - get them all.
     :return:
     """
-    path = FEMINICIDE_API_URL + '/api/story_processor/language_models.json'
+    path = settings.FEMINICIDE_API_URL + '/api/story_processor/language_models.json'
     return _get_json(path)
 
 
+def get_projects_and_language_models() -> Tuple[Dict, Dict]:
+    """
+    Fetch the projects and language models lists at the same time (over the same pool of keep-alive connections).
+    :return: the projects list and the language models list
+    """
+    with ThreadPoolExecutor(max_workers=2) as executor:
+        projects = executor.submit(get_projects_list)
+        models = executor.submit(get_language_models_list)
+        return projects.result(), models.result()
+
+
+def request_metrics() -> Dict:
+    """
+    :return: per-URL stats on the requests made so far: `count`, `errors`, `total_seconds`, `max_seconds`
+    """
+    with _metrics_lock:
+        return {path: dict(stats) for path, stats in _metrics.items()}
+
+
+def _projects_list_url() -> str:
+    return settings.FEMINICIDE_API_URL + '/api/story_processor/projects.json'
+
+
+def _get_session() -> requests.Session:
+    """
+    One shared session for the whole process, so calls reuse keep-alive (TLS) connections to the main server.
+    """
+    global _session
+    with _session_lock:
+        if _session is None:
+            retries = Retry(total=MAX_RETRIES, backoff_factor=RETRY_BACKOFF, status_forcelist=[500, 502, 503, 504],
+                            allowed_methods=['GET'], raise_on_status=False)
+            adapter = HTTPAdapter(pool_connections=2, pool_maxsize=10, max_retries=retries)
+            session = requests.Session()
+            session.mount('http://', adapter)
+            session.mount('https://', adapter)
+            session.headers['Accept-Encoding'] = 'gzip, deflate'
+            _session = session
+        return _session
+
+
+def _record(path: str, seconds: float, failed: bool) -> None:
+    with _metrics_lock:
+        stats = _metrics.setdefault(path, dict(count=0, errors=0, total_seconds=0.0, max_seconds=0.0))
+        stats['count'] += 1
+        stats['errors'] += 1 if failed else 0
+        stats['total_seconds'] += seconds
+        stats['max_seconds'] = max(stats['max_seconds'], seconds)
+
+
+def _read_limited(r: requests.Response) -> bytes:
+    too_big = "Response from {} is over {} bytes - not decoding it".format(r.url, MAX_RESPONSE_BYTES)
+    # Content-Length is the size on the wire, so a compressed body over the limit only gets bigger once decoded
+    if int(r.headers.get('Content-Length') or 0) > MAX_RESPONSE_BYTES:
+        r.close()
+        raise ValueError(too_big)
+    chunks = []
+    size = 0
+    for chunk in r.iter_content(64 * 1024):  # decompresses gzip as it goes
+        chunks.append(chunk)
+        size += len(chunk)
+        if size > MAX_RESPONSE_BYTES:
+            r.close()
+            raise ValueError(too_big)
+    return b''.join(chunks)
+
+
 def _get_json(path: str) -> Dict:
-    params = dict(apikey=FEMINICIDE_API_KEY)
-    r = requests.get(path, params,
-                     timeout=(3.05*20)*10)  # docs say set it to slightly larger than a multiple of 3, so 10ish minutes
-    return r.json()
+    data, _ = _get_json_if_modified(path)
+    return data
+
+
+def _get_json_if_modified(path: str, validators: Dict = None) -> Tuple[Optional[Dict], Dict]:
+    validators = validators or {}
+    params = dict(apikey=settings.FEMINICIDE_API_KEY)
+    headers = {}
+    if validators.get('etag'):
+        headers['If-None-Match'] = validators['etag']
+    if validators.get('last_modified'):
+        headers['If-Modified-Since'] = validators['last_modified']
+    start = time.perf_counter()
+    failed = True
+    try:
+        r = _get_session().get(path, params=params, headers=headers, stream=True,
+                               timeout=(CONNECT_TIMEOUT, READ_TIMEOUT))
+        with r:
+            if r.status_code == 304:
+                failed = False
+                return None, validators
+            r.raise_for_status()
+            body = _read_limited(r)
+        new_validators = dict(etag=r.headers.get('ETag'), last_modified=r.headers.get('Last-Modified'))
+        data = requests.models.complexjson.loads(body)
+        failed = False
+        return data, new_validators
+    finally:
+        _record(path, time.perf_counter() - start, failed)
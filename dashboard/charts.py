@@ -0,0 +1,111 @@
+"""
+Charts shared by the dashboard pages. Kept out of the page scripts so one page can use them without importing (and so
+running) another.
+"""
+import altair
+import streamlit as st
+import pandas as pd
+
+from dashboard import PLATFORMS
+
+COUNT_COLUMNS = ['day', 'source', 'above', 'below']
+# date format for the x axis, by time bucket (see dashboard.database.bucketing)
+BUCKET_FORMATS = {
+    'day': '%m-%d',
+    'week': '%Y-%m-%d',
+    'month': '%Y-%m',
+}
+
+
+def _time_axis(bucket: str) -> altair.X:
+    title = None if bucket == 'day' else "{} starting".format(bucket)
+    return altair.X('day:T', title=title, axis=altair.Axis(format=BUCKET_FORMATS[bucket]))
+
+
+def count_frame(counts) -> pd.DataFrame:
+    """
+    The columns of one `processor_db.story_counts_by_day` query as a DataFrame, built a column at a time, with the
+    days as datetimes (which every Altair data transformer can serialize, unlike dates) and the platforms as a category
+    so the chart data carries a small code per row rather than the name.
+    """
+    df = pd.DataFrame(counts, columns=COUNT_COLUMNS)
+    df['day'] = pd.to_datetime(df['day'])
+    df['source'] = pd.Categorical(df['source'], categories=PLATFORMS)  # (anything else becomes NaN)
+    return df
+
+
+def graph_chart(counts, above_threshold=False, bucket='day') -> altair.Chart:
+    """
+    Stacked per-platform bars, from the columns of one `processor_db.story_counts_by_day` query.
+    :param bucket: the time bucket the counts were grouped by
+    """
+    df = count_frame(counts)
+    df = df[df['source'].notna()]
+    chart = pd.DataFrame({
+        'day': df['day'],
+        'stories': df['above' if above_threshold else 'below'],
+        'platform': df['source'],
+    })
+    return altair.Chart(chart).mark_bar().encode(
+        x=_time_axis(bucket),
+        y="stories",
+        color="platform",
+        size=altair.SizeValue(5),
+    )
+
+
+def draw_graph(counts, above_threshold=False, bucket='day'):
+    st.altair_chart(graph_chart(counts, above_threshold, bucket), use_container_width=True)
+    return
+
+
+def results_chart(counts, bucket='day') -> altair.Chart:
+    """
+    Above vs. below threshold bars, summed across sources from the same columns `graph_chart` uses.
+    """
+    df = count_frame(counts)
+    totals = df.groupby('day', as_index=False, sort=False)[['above', 'below']].sum()
+    chart = totals.melt(id_vars='day', value_vars=['above', 'below'], var_name='platform', value_name='stories')
+    return altair.Chart(chart).mark_bar().encode(
+        x=_time_axis(bucket),
+        y="stories",
+        color="platform",
+        size=altair.SizeValue(5)
+    )
+
+
+def story_results_graph(counts, bucket='day'):
+    st.altair_chart(results_chart(counts, bucket), use_container_width=True)
+    return
+
+
+def draw_article_counts(counts):
+    """
+    Bars of how many alert articles were published each day, from `alerts_db.articles_by_published_day`.
+    """
+    df = pd.DataFrame(counts, columns=['day', 'articles'])
+    bar_chart = altair.Chart(df).mark_bar().encode(
+        x=altair.X('day', axis=altair.Axis(format='%m-%d')),
+        y="articles",
+        size=altair.SizeValue(5)
+    )
+    st.altair_chart(bar_chart, use_container_width=True)
+    return
+
+
+def draw_coverage(coverage):
+    """
+    Per-day bars of the alert articles that reached the story processor and the ones that are missing, from
+    `alerts_db.article_coverage_by_day`.
+    """
+    df = pd.DataFrame(coverage, columns=['day', 'articles', 'matched', 'above_threshold'])
+    df['missing'] = df['articles'] - df['matched']
+    chart = df.melt(id_vars='day', value_vars=['matched', 'missing'], var_name='status', value_name='count')
+    bar_chart = altair.Chart(chart).mark_bar().encode(
+        x=altair.X('day', axis=altair.Axis(format='%m-%d')),
+        y=altair.Y("count", title="articles"),
+        color="status",
+        size=altair.SizeValue(5)
+    )
+    st.altair_chart(bar_chart, use_container_width=True)
+    return
@@ -1,44 +1,159 @@
 import datetime as dt
-from typing import List, Dict
+from typing import List, Dict, Optional, Tuple
 import logging
-import streamlit as st
+import threading
+from contextlib import contextmanager
+from functools import partial
 import psycopg2
+import psycopg2.errors
 import psycopg2.extras
+from psycopg2 import sql
 
-from dashboard import ALERTS_DB_URI
+from dashboard import settings
+from dashboard.database.pool import ConnectionPool
+from dashboard.database.cache import query_cache
+import dashboard.database.tracing as tracing
+import dashboard.database.profiling as profiling
+from dashboard.database.query import identifier, where, as_text, execute, PreparingConnection, PREPARED_FAMILIES
+from dashboard.database.sampling import sample_sql, SAMPLE_PROBE
+from dashboard.database.paging import keyset_page_sql, split_page
 
 logger = logging.getLogger(__name__)
 
+# groups of near-duplicate articles, kept up to date by dashboard.database.grouping
+ARTICLE_GROUP_COLUMNS = ['cluster_id', 'title', 'articles', 'first_published', 'last_published', 'url']
+# most recently active first, with cluster_id to break ties (see the article_clusters_*_last indexes)
+ARTICLE_GROUP_ORDER = ['last_published', 'cluster_id']
+GROUP_ARTICLE_COLUMNS = ['id', 'source', 'title', 'url', 'published_date']
 
-@st.cache_resource  # so it only run once
-def init_connection():
-    return psycopg2.connect(ALERTS_DB_URI)
 
+_pool = None
+_pool_lock = threading.Lock()
 
-db_conn = init_connection()
 
+class NotComputedError(RuntimeError):
+    """
+    A query needs a table that a background job creates, and the job hasn't run on this database yet.
+    """
 
-def _run_query(query: str) -> List[Dict]:
-    dict_cursor = db_conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor)
-    dict_cursor.execute(query)
-    results = dict_cursor.fetchall()
+
+def db_pool() -> ConnectionPool:
+    """
+    The pool for this database, shared by every session in the process. Opened on the first query rather than on
+    import, so pages (and tests) that never query this database don't connect to it.
+    """
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = ConnectionPool(settings.ALERTS_DB_URI, min_size=settings.DB_POOL_MIN_SIZE,
+                                   max_size=settings.DB_POOL_MAX_SIZE, statement_timeout=settings.DB_STATEMENT_TIMEOUT,
+                                   connect=partial(psycopg2.connect, connection_factory=PreparingConnection))
+        return _pool
+
+
+def _execute(query: str, params: Dict, family: str) -> List[Dict]:
+    tracing.notify('alerts', query, params)
+    with profiling.profiled('alerts', family, query, params) as profile:
+        with db_pool().connection() as conn:
+            with conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor) as dict_cursor:
+                execute(dict_cursor, query, params, family in PREPARED_FAMILIES, profiling.sql_comment(family))
+                results = dict_cursor.fetchall()
+        profile.add_rows(results)
     return results
 
 
-def recent_articles(project_id: int, limit: int = 5) -> List:
+def _run_query(query, params: Dict = None, family: str = None) -> List[Dict]:
+    """
+    Run a read-only query, reusing a recent result for the same SQL and parameters if there is one in the cache.
+    :param query: SQL string or `psycopg2.sql` composition, with `%(name)s` placeholders for values
+    :param params: values for the placeholders
+    :param family: which kind of query this is, to pick how long to cache it (see dashboard.database.cache) and
+                   whether to run it as a prepared statement
+    :return:
+    """
+    text = as_text(query)
+    return query_cache.get_or_run('alerts', family, text,
+                                  lambda: _execute(text, params, family), params)
+
+
+@contextmanager
+def _computed_by(module: str):
+    """
+    Turn a missing table error from queries on tables that `python -m <module>` creates into a NotComputedError.
+    """
+    try:
+        yield
+    except psycopg2.errors.UndefinedTable:
+        raise NotComputedError("Not computed yet - run `python -m {}` to fill this in".format(module))
+
+
+def recent_articles(project_id: int, limit: int = 5, mode: str = SAMPLE_PROBE, seed=None) -> List:
     """
-    UI: show a list of the most recent stories we have processed
+    UI: show a sample of the articles from the last week
     :param project_id:
     :param limit:
+    :param mode: how to pick them - one of `sampling.SAMPLE_MODES`
+    :param seed: pass the same seed to get the same sample back on every rerun
     :return:
     """
     earliest_date = dt.date.today() - dt.timedelta(days=7)
-    sql = '''
-        SELECT * FROM articles WHERE
-            project_id={} AND publish_date >= '{}'::DATE
-            ORDER BY RANDOM() DESC LIMIT {}
-    '''.format(project_id, earliest_date, limit)
-    return _run_query(sql)
+    query, params = sample_sql('articles', sql.SQL("project_id = %(project_id)s"), dict(project_id=project_id),
+                               'publish_date', earliest_date, limit, mode, seed)
+    return _run_query(query, params, 'sample')
+
+
+def grouped_articles(project_id: int = None, after: Optional[tuple] = None,
+                     page_size: int = 20) -> Tuple[List[Dict], Optional[tuple]]:
+    """
+    UI: one page of groups of near-duplicate articles, most recently active first. Each page is a short range scan of
+    an index however many articles there are.
+    :param project_id: only this project's groups (None for every project's)
+    :param after: the `after` returned with the previous page (None for the first page)
+    :param page_size:
+    :return: the groups on this page, and the `after` to pass for the next page (None if this is the last one)
+    :raises NotComputedError: if the grouping job hasn't run yet
+    """
+    clauses = [sql.SQL("last_published is not Null")]
+    if project_id is not None:
+        clauses.append(sql.SQL("project_id = %(project_id)s"))
+    query, params = keyset_page_sql('article_clusters', ARTICLE_GROUP_COLUMNS, where(clauses),
+                                    dict(project_id=project_id), ARTICLE_GROUP_ORDER, after, page_size)
+    with _computed_by('dashboard.database.grouping'):
+        return split_page(_run_query(query, params, 'page'), ARTICLE_GROUP_ORDER, page_size)
+
+
+def group_articles(cluster_id: int, limit: int = 50) -> List[Dict]:
+    """
+    UI: the articles in one group, newest first
+    :param cluster_id: from `grouped_articles`
+    :param limit:
+    :return:
+    :raises NotComputedError: if the grouping job hasn't run yet
+    """
+    query = sql.SQL("select {columns} from article_signatures s join articles a on a.id = s.articles_id "
+                    "where s.cluster_id = %(cluster_id)s order by a.published_date desc nulls last "
+                    "limit %(limit)s").format(
+        columns=sql.SQL(", ").join(sql.Identifier('a', c) for c in GROUP_ARTICLE_COLUMNS))
+    with _computed_by('dashboard.database.grouping'):
+        return _run_query(query, dict(cluster_id=cluster_id, limit=limit), 'page')
+
+
+def article_coverage_by_day(project_id: int, limit: int = 30) -> List[Dict]:
+    """
+    UI: how many of the articles published each day reached the story processor (matched a story by URL, see
+    dashboard.database.reconcile), and how many of those were above threshold. Articles without a URL aren't counted.
+    :param project_id:
+    :param limit: how many days back to go
+    :return: `day`, `articles`, `matched` and `above_threshold` per day, newest first
+    :raises NotComputedError: if the reconcile job hasn't run yet
+    """
+    query = "select published_date::date as day, count(1) as articles, count(stories_id) as matched, " \
+            "count(1) filter (where above_threshold) as above_threshold from article_url_keys " \
+            "where project_id = %(project_id)s and published_date >= %(earliest_date)s::DATE " \
+            "group by 1 order by 1 DESC"
+    with _computed_by('dashboard.database.reconcile'):
+        return _run_query(query, dict(project_id=project_id, earliest_date=dt.date.today() - dt.timedelta(days=limit)),
+                          'history')
 
 
 def _articles_by_date_col(column_name: str, project_id: int = None, limit: int = 30) -> List:
@@ -49,20 +164,18 @@ def _articles_by_date_col(column_name: str, project_id: int = None, limit: int =
     :param limit:
     :return:
     """
-    earliest_date = dt.date.today() - dt.timedelta(days=limit)
-    clauses = []
-    if project_id is not None:
-        clauses.append("(project_id={})".format(project_id))
-    query = "select "+column_name+"::date as day, count(1) as articles from articles " \
-            "where ("+column_name+" is not Null) and ("+column_name+" >= '{}'::DATE) AND {} " \
-            "group by 1 order by 1 DESC".format(earliest_date, " AND ".join(clauses))
-    return _run_query(query)
+    params = dict(earliest_date=dt.date.today() - dt.timedelta(days=limit), project_id=project_id)
+    clauses = [sql.SQL("project_id = %(project_id)s")] if project_id is not None else []
+    query = sql.SQL("select {col}::date as day, count(1) as articles from articles "
+                    "where ({col} is not Null) and ({col} >= %(earliest_date)s::DATE) AND {clauses} "
+                    "group by 1 order by 1 DESC").format(col=identifier(column_name), clauses=where(clauses))
+    return _run_query(query, params, 'history')
 
 
 def articles_by_published_day(project_id: int = None, limit: int = 30) -> List:
     return _articles_by_date_col('published_date', project_id, limit)
 
 
-def _run_count_query(query: str) -> int:
-    data = _run_query(query)
+def _run_count_query(query, params: Dict = None) -> int:
+    data = _run_query(query, params, 'count')
     return data[0]['count']
\ No newline at end of file
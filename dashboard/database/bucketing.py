@@ -0,0 +1,57 @@
+"""
+Time buckets for the history charts. A bar per day is right for a month or two, but years of daily bars mean thousands
+of rows for the browser to draw, most of them too thin to see. Longer ranges are counted per week or per month instead,
+in the database (`date_trunc`), so every chart stays under a budget of points whatever the range.
+"""
+import datetime as dt
+
+from psycopg2 import sql
+
+# smallest first, with roughly how many days each one spans
+BUCKET_DAYS = {
+    'day': 1,
+    'week': 7,
+    'month': 30,
+}
+BUCKETS = list(BUCKET_DAYS.keys())
+DEFAULT_MAX_POINTS = 120  # bars per series
+
+
+def pick_bucket(days: int, max_points: int = DEFAULT_MAX_POINTS) -> str:
+    """
+    :param days: how far back the chart goes
+    :param max_points: most bars we want per series
+    :return: the smallest bucket that fits (or the biggest one, if none do)
+    """
+    for bucket, bucket_days in BUCKET_DAYS.items():
+        if days / bucket_days <= max_points:
+            return bucket
+    return BUCKETS[-1]
+
+
+def bucket_start(day: dt.date, bucket: str) -> dt.date:
+    """
+    :return: the first day of the bucket `day` is in, the same as `date_trunc` (weeks start on Monday)
+    """
+    if bucket == 'day':
+        return day
+    if bucket == 'week':
+        return day - dt.timedelta(days=day.weekday())
+    if bucket == 'month':
+        return day.replace(day=1)
+    raise ValueError("Unknown bucket '{}' (expected one of {})".format(bucket, BUCKETS))
+
+
+def bucket_sql(column: sql.Composable) -> sql.Composable:
+    """
+    :return: SQL for the first day of the bucket a date column is in (taking a `%(bucket)s` parameter)
+    """
+    return sql.SQL("date_trunc(%(bucket)s, {})::date").format(column)
+
+
+def earliest_date(days: int, bucket: str) -> dt.date:
+    """
+    :return: where a chart of the last `days` days should start, moved back to the start of its bucket so the first
+             bar isn't a partial one
+    """
+    return bucket_start(dt.date.today() - dt.timedelta(days=days), bucket)
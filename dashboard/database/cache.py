@@ -0,0 +1,106 @@
+"""
+Process-wide memo of query results, so Streamlit reruns (every widget click reruns the whole page) don't repeat the
+same COUNT and GROUP BY queries. Entries are keyed by the normalized SQL plus its parameters, expire after a TTL that
+depends on the query family, and the least recently used ones are evicted once the cache is full. With
+SHARED_CACHE_DIR set, misses on chart data and counters are looked up in the cache shared with the other dashboard
+processes (see dashboard.database.shared_cache) before running the query, and everything kept here is dropped when
+any process clears the shared cache.
+"""
+import re
+import threading
+import time
+from collections import OrderedDict
+from typing import Callable, Dict
+
+from dashboard import settings
+from dashboard.database.shared_cache import shared_cache, SHARED_FAMILIES
+
+# how stale (in seconds) each family of query results is allowed to get
+FAMILY_TTLS = {
+    'count': 300,  # per-project counters
+    'history': 300,  # day-by-day chart data
+    'sample': 600,  # example stories/articles, long enough to click through them
+    'page': 120,  # pages of the story browser, long enough to go back and forth between them
+}
+DEFAULT_TTL = 60
+
+_whitespace = re.compile(r'\s+')
+
+
+def normalize_sql(query: str) -> str:
+    return _whitespace.sub(' ', query).strip()
+
+
+class QueryCache:
+
+    def __init__(self, max_entries: int = None, ttls: Dict[str, float] = None, default_ttl: float = DEFAULT_TTL,
+                 shared: bool = False):
+        self._max_entries = max_entries  # None for QUERY_CACHE_MAX_ENTRIES, read when first needed
+        self.shared = shared  # whether to go through the shared cache, if SHARED_CACHE_DIR is set
+        self.ttls = FAMILY_TTLS if ttls is None else ttls
+        self.default_ttl = default_ttl
+        self._entries = OrderedDict()  # key -> (expires at, results)
+        self._lock = threading.Lock()
+        self._generation = None  # of the shared cache, when the entries were kept
+        self.hits = 0
+        self.misses = 0
+
+    @property
+    def max_entries(self) -> int:
+        if self._max_entries is None:
+            self._max_entries = settings.QUERY_CACHE_MAX_ENTRIES
+        return self._max_entries
+
+    def _key(self, namespace: str, query: str, params) -> tuple:
+        return namespace, normalize_sql(query), repr(params)
+
+    def get_or_run(self, namespace: str, family: str, query: str, run: Callable, params=None):
+        """
+        Return the cached results for this query, or call `run()` and remember what it returns.
+        :param namespace: which database the query runs against
+        :param family: picks the TTL (see FAMILY_TTLS)
+        :param query: the SQL, used as part of the key
+        :param run: does the actual work on a miss
+        :param params: any query parameters, also part of the key
+        """
+        key = self._key(namespace, query, params)
+        shared = shared_cache() if self.shared else None
+        generation = shared.generation() if shared is not None else None
+        now = time.monotonic()
+        with self._lock:
+            if generation != self._generation:  # another process cleared the shared cache, so this one goes too
+                self._entries.clear()
+                self._generation = generation
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] > now:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry[1]
+            self.misses += 1
+        # run outside the lock so slow queries don't block cache hits from other sessions
+        ttl = self.ttls.get(family, self.default_ttl)
+        if shared is None or family not in SHARED_FAMILIES:
+            results = run()
+        else:  # keep it only until the shared entry's bucket ends, so every process moves on to the next one together
+            results, ttl = shared.get_or_run(" ".join(key), ttl, run)
+        with self._lock:
+            if self._generation != generation:  # cleared while this ran, so it may be from before
+                return results
+            self._entries[key] = (time.monotonic() + ttl, results)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return results
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> Dict:
+        with self._lock:
+            return dict(entries=len(self._entries), max_entries=self.max_entries, hits=self.hits,
+                        misses=self.misses)
+
+
+# shared by both database modules, so one "refresh now" clears everything
+query_cache = QueryCache(shared=True)
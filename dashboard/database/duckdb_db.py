@@ -0,0 +1,110 @@
+"""
+Run the processor database queries with DuckDB over the Parquet snapshot (see dashboard.database.snapshot) instead of
+on Postgres, when QUERY_BACKEND is 'duckdb'. The same SQL runs on both: the snapshot tables are exposed as views with
+the table names, `%(name)s` placeholders become `$n` ones, and the few Postgres-only bits are swapped for DuckDB
+equivalents. Scans are columnar and vectorized, so multi-year history charts are quick, and nothing touches the
+production database - with a copy of SNAPSHOT_DIR this works offline.
+"""
+import glob
+import threading
+from typing import Dict, Iterator, List, Tuple
+
+from dashboard import settings, ConfigError
+from dashboard.database.query import to_positional
+import dashboard.database.snapshot as snapshot
+
+# functions the queries use that DuckDB doesn't have (width_bucket here only ever sees plain numbers)
+MACROS = [
+    "CREATE MACRO width_bucket(value, low, high, buckets) AS "
+    "CASE WHEN value < low THEN 0 WHEN value >= high THEN buckets + 1 "
+    "ELSE floor((value - low) / (high - low) * buckets)::INTEGER + 1 END",
+]
+
+# Postgres-only SQL and what to run instead (the snapshot has no physical row ids, so seeded samples order by id)
+REWRITES = [
+    ('ctid::text', 'id::text'),
+]
+
+_conn = None
+_views = set()
+_lock = threading.Lock()
+
+
+def _create_views(conn) -> None:
+    # a view is only made once its table has been exported; the glob is expanded again on every query, so days
+    # written by the export job after this show up without a restart
+    for table in snapshot.TABLES:
+        pattern = snapshot.table_glob(settings.SNAPSHOT_DIR, table)
+        if table not in _views and glob.glob(pattern):
+            conn.execute("CREATE VIEW {} AS SELECT * FROM read_parquet('{}', hive_partitioning=false)".format(
+                table, pattern.replace("'", "''")))
+            _views.add(table)
+
+
+def cursor():
+    """
+    A new cursor on the process' DuckDB connection (opened on first use, in memory - the data is in the snapshot). One
+    DuckDB connection can't be used from several threads at once, but each of its cursors can be used from one.
+    """
+    global _conn
+    with _lock:
+        if _conn is None:
+            import duckdb  # only needed with this backend, so only imported then
+            _conn = duckdb.connect()
+            for macro in MACROS:
+                _conn.execute(macro)
+        if 'stories' not in _views:
+            _create_views(_conn)
+            if 'stories' not in _views:
+                raise ConfigError("No stories snapshot in {} - export one with `python -m dashboard.database.snapshot`"
+                                  .format(settings.SNAPSHOT_DIR))
+        return _conn.cursor()
+
+
+def to_duckdb(text: str):
+    """
+    :return: the query as DuckDB SQL with `$n` placeholders, and the parameter names in $n order
+    """
+    for postgres, duckdb in REWRITES:
+        text = text.replace(postgres, duckdb)
+    return to_positional(text)
+
+
+def _execute_on(duckdb_cursor, text: str, params: Dict = None, comment: str = "") -> None:
+    positional, names = to_duckdb(text)
+    duckdb_cursor.execute(comment + positional, [(params or {})[n] for n in names])
+
+
+def fetch(text: str, params: Dict = None, comment: str = "") -> Tuple[List[str], List[tuple]]:
+    """
+    :return: the names of the result columns, and the rows as tuples
+    """
+    with cursor() as duckdb_cursor:
+        _execute_on(duckdb_cursor, text, params, comment)
+        return [d[0] for d in duckdb_cursor.description], duckdb_cursor.fetchall()
+
+
+def iter_batches(text: str, params: Dict = None, itersize: int = None, comment: str = "") -> Iterator[List[tuple]]:
+    """
+    Yield the rows of a query in lists of up to `itersize` tuples, like `streaming.iter_batches`.
+    """
+    itersize = itersize or settings.DB_CURSOR_ITERSIZE
+    with cursor() as duckdb_cursor:
+        _execute_on(duckdb_cursor, text, params, comment)
+        while True:
+            rows = duckdb_cursor.fetchmany(itersize)
+            if not rows:
+                break
+            yield rows
+
+
+def close() -> None:
+    """
+    Close the connection, so the next query opens a new one (and looks for the snapshot again).
+    """
+    global _conn
+    with _lock:
+        if _conn is not None:
+            _conn.close()
+        _conn = None
+        _views.clear()
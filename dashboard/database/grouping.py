@@ -0,0 +1,348 @@
+"""
+Group alert articles that are the same story (alert feeds send us the same one many times, under slightly different
+titles and tracking-laden URLs) so the dashboard can list each story once.
+
+Each article gets a MinHash signature of the words in its title, stored in `article_signatures`: PERMUTATIONS hash
+minimums, where the share of minimums two signatures have in common estimates how much their titles' words overlap
+(Jaccard similarity). For locality sensitive hashing the signature is cut into BANDS bands and each band hashed to one
+value, so titles that overlap by MIN_SIMILARITY or more almost always agree on at least one band, and ones that barely
+overlap almost never do. Indexing articles by (project, band, band value) in `article_signature_bands` means a new
+article only gets compared with the few earlier ones sharing a band, never with every article in the project. A hash
+of the canonical URL is indexed as one more band, so the same link with different tracking parameters lands in the
+same group whatever its title.
+
+New articles are assigned incrementally, in id order from a watermark: each joins the group of its most similar
+indexed neighbour, or starts a new group (`article_clusters`, which also keeps the per-group counts and dates the
+dashboard lists). Only articles that add something new are indexed - an exact repeat of an indexed article isn't - so
+band lookups stay short however many times a story is repeated. Run it from the command line (ie. from cron) with:
+
+    python -m dashboard.database.grouping [--full]
+"""
+import argparse
+import hashlib
+import logging
+import operator
+import re
+import struct
+from collections import defaultdict
+from typing import Dict, Iterable, List, NamedTuple, Optional, Tuple
+
+import numpy as np
+import psycopg2
+import psycopg2.extras
+
+from dashboard.database.urls import canonical_url
+
+logger = logging.getLogger(__name__)
+
+PERMUTATIONS = 32
+BANDS = 8  # of 4 minimums each: titles with 80% of their words in common share a band 98% of the time, 30% just 6%
+ROWS_PER_BAND = PERMUTATIONS // BANDS
+URL_BAND = BANDS  # band number the canonical URL hash is indexed under
+MIN_SIMILARITY = 0.6  # estimated share of title words in common to count as the same story
+BATCH_SIZE = 5000
+
+SCHEMA = '''
+    CREATE TABLE IF NOT EXISTS article_signatures (
+        articles_id bigint PRIMARY KEY,
+        project_id integer NOT NULL,
+        minhash integer[],
+        url_hash integer NOT NULL,
+        cluster_id bigint NOT NULL
+    );
+    CREATE INDEX IF NOT EXISTS article_signatures_cluster ON article_signatures (cluster_id);
+    CREATE TABLE IF NOT EXISTS article_signature_bands (
+        project_id integer NOT NULL,
+        band smallint NOT NULL,
+        band_value integer NOT NULL,
+        articles_id bigint NOT NULL
+    );
+    CREATE INDEX IF NOT EXISTS article_signature_bands_lookup
+        ON article_signature_bands (project_id, band, band_value);
+    CREATE TABLE IF NOT EXISTS article_clusters (
+        cluster_id bigint PRIMARY KEY,
+        project_id integer NOT NULL,
+        articles bigint NOT NULL,
+        title text,
+        url text,
+        first_published timestamp,
+        last_published timestamp
+    );
+    CREATE INDEX IF NOT EXISTS article_clusters_project_last
+        ON article_clusters (project_id, last_published, cluster_id);
+    CREATE INDEX IF NOT EXISTS article_clusters_last ON article_clusters (last_published, cluster_id);
+    CREATE TABLE IF NOT EXISTS article_grouping_state (
+        id integer PRIMARY KEY DEFAULT 1 CHECK (id = 1),
+        watermark bigint NOT NULL
+    );
+'''
+
+_words = re.compile(r'\w+')
+_band_struct = struct.Struct('<{}i'.format(ROWS_PER_BAND))
+
+
+class Signature(NamedTuple):
+    articles_id: int
+    minhash: Optional[Tuple[int, ...]]  # signed 32 bit values, as stored; None for an article without a title
+    url_hash: int  # signed, as stored in an integer column; 0 for an article without a URL
+    cluster_id: Optional[int]
+
+
+def create_schema(conn) -> None:
+    with conn.cursor() as cursor:
+        cursor.execute(SCHEMA)
+    conn.commit()
+
+
+def title_words(title: Optional[str]) -> List[str]:
+    return sorted(set(_words.findall((title or '').lower())))
+
+
+def _hash64(data: bytes) -> int:
+    return int.from_bytes(hashlib.blake2b(data, digest_size=8).digest(), 'big')
+
+
+def _hash32(data: bytes) -> int:
+    # signed, to fit an integer column
+    value = _hash64(data) >> 32
+    return value - (1 << 32) if value >= 1 << 31 else value
+
+
+def url_hash(url: Optional[str]) -> int:
+    canonical = canonical_url(url)
+    return _hash32(canonical.encode('utf-8')) if canonical else 0
+
+
+# multiply-shift hashing, a different (odd) multiplier and offset per permutation; fixed, as signatures are stored
+_multipliers = np.array([_hash64('minhash-a-{}'.format(i).encode()) | 1 for i in range(PERMUTATIONS)], dtype=np.uint64)
+_offsets = np.array([_hash64('minhash-b-{}'.format(i).encode()) for i in range(PERMUTATIONS)], dtype=np.uint64)
+
+
+def minhashes(word_lists: List[List[str]]) -> List[Optional[Tuple[int, ...]]]:
+    """
+    MinHash many word lists at once. Done with numpy over the whole batch, as per-word Python loops are far too slow
+    for a big backfill.
+    :return: a signature (tuple of PERMUTATIONS signed 32 bit ints) per list, None for a list with no words
+    """
+    counts = [len(words) for words in word_lists]
+    total = sum(counts)
+    if total == 0:
+        return [None] * len(word_lists)
+    hashes = np.fromiter((_hash64(w.encode('utf-8')) for words in word_lists for w in words), dtype=np.uint64,
+                         count=total)
+    with np.errstate(over='ignore'):  # wrapping around is the point
+        permuted = (hashes[:, None] * _multipliers + _offsets) >> np.uint64(32)
+    non_empty = np.array(counts) > 0
+    starts = np.cumsum([0] + counts[:-1])[non_empty]
+    minimums = np.minimum.reduceat(permuted, starts, axis=0).astype(np.uint32).view(np.int32)
+    signatures = iter(tuple(int(v) for v in row) for row in minimums)
+    return [next(signatures) if has_words else None for has_words in non_empty]
+
+
+def band_keys(signature: Signature) -> List[Tuple[int, int]]:
+    """
+    :return: (band, band value) pairs to index a signature under: its MinHash bands, plus its URL hash if it has a URL
+    """
+    keys = []
+    if signature.minhash is not None:
+        for band in range(BANDS):
+            rows = signature.minhash[band * ROWS_PER_BAND:(band + 1) * ROWS_PER_BAND]
+            keys.append((band, _hash32(_band_struct.pack(*rows))))
+    if signature.url_hash:
+        keys.append((URL_BAND, signature.url_hash))
+    return keys
+
+
+def similarity(a: Optional[Tuple[int, ...]], b: Optional[Tuple[int, ...]]) -> float:
+    """
+    :return: estimated share of words two titles have in common, from their MinHash signatures
+    """
+    if a is None or b is None:
+        return 0.0
+    return sum(map(operator.eq, a, b)) / PERMUTATIONS
+
+
+class BandIndex:
+    """
+    In-memory slice of the band index: (project, band, band value) -> indexed signatures. `refresh` loads the entries
+    a batch of new articles could match, then adds to it as the batch is assigned, so articles within one batch find
+    each other too.
+    """
+
+    def __init__(self):
+        self._entries = defaultdict(list)
+
+    def add(self, project_id: int, signature: Signature) -> None:
+        for band, value in band_keys(signature):
+            self._entries[(project_id, band, value)].append(signature)
+
+    def load(self, rows: Iterable[tuple]) -> None:
+        """
+        :param rows: (project_id, band, band_value, articles_id, minhash, url_hash, cluster_id) tuples
+        """
+        for project_id, band, value, articles_id, minhash, url_hash_, cluster_id in rows:
+            signature = Signature(articles_id, None if minhash is None else tuple(minhash), url_hash_, cluster_id)
+            self._entries[(project_id, band, value)].append(signature)
+
+    def nearest(self, project_id: int, signature: Signature) -> Tuple[Optional[Signature], float]:
+        """
+        :return: the most similar indexed signature that counts as the same story (None if there isn't one), and how
+                 similar it is (1 for a URL match)
+        """
+        best, best_similarity, seen = None, 0.0, set()
+        for band, value in band_keys(signature):
+            for candidate in self._entries.get((project_id, band, value), []):
+                if candidate.articles_id in seen and band != URL_BAND:
+                    continue
+                seen.add(candidate.articles_id)
+                # the same canonical URL is the same story whatever the title says, otherwise the titles must be close
+                score = 1.0 if band == URL_BAND else similarity(candidate.minhash, signature.minhash)
+                if score < MIN_SIMILARITY:
+                    continue
+                if best is None or (-score, candidate.articles_id) < (-best_similarity, best.articles_id):
+                    best, best_similarity = candidate, score
+        return best, best_similarity
+
+
+def signatures(articles: List[tuple]) -> List[Tuple[int, Signature]]:
+    """
+    :param articles: (articles_id, project_id, title, url) tuples
+    :return: (project_id, signature) per article, not yet assigned to a group
+    """
+    hashes = minhashes([title_words(title) for _, _, title, _ in articles])
+    return [(project_id, Signature(articles_id, minhash, url_hash(url), None))
+            for (articles_id, project_id, _, url), minhash in zip(articles, hashes)]
+
+
+def assign(index: BandIndex, signed: List[Tuple[int, Signature]]) -> Tuple[List[tuple], List[tuple]]:
+    """
+    Put each article in the group of its most similar indexed neighbour, or a new group named after itself.
+    :param index: the band index entries these articles could match (added to as we go)
+    :param signed: (project_id, signature) for each article, in id order
+    :return: (project_id, signature) for every article, and for the ones that were added to the band index
+    """
+    assigned, to_index = [], []
+    for project_id, signature in signed:
+        match, _ = index.nearest(project_id, signature)
+        signature = signature._replace(cluster_id=signature.articles_id if match is None else match.cluster_id)
+        # an exact repeat of something already indexed adds nothing new to find later matches with
+        if match is None or (match.minhash, match.url_hash) != (signature.minhash, signature.url_hash):
+            index.add(project_id, signature)
+            to_index.append((project_id, signature))
+        assigned.append((project_id, signature))
+    return assigned, to_index
+
+
+def _watermark(cursor) -> int:
+    cursor.execute("select watermark from article_grouping_state where id=1")
+    row = cursor.fetchone()
+    return row[0] if row else 0
+
+
+def _load_candidates(cursor, index: BandIndex, signed: List[Tuple[int, Signature]]) -> None:
+    keys = {(project_id, band, value) for project_id, signature in signed for band, value in band_keys(signature)}
+    if not keys:
+        return
+    projects, bands, values = zip(*keys)
+    cursor.execute('''
+        SELECT b.project_id, b.band, b.band_value, s.articles_id, s.minhash, s.url_hash, s.cluster_id
+        FROM unnest(%(projects)s::integer[], %(bands)s::smallint[], %(values)s::integer[]) AS k(project_id, band, value)
+        JOIN article_signature_bands b ON b.project_id = k.project_id AND b.band = k.band AND b.band_value = k.value
+        JOIN article_signatures s ON s.articles_id = b.articles_id
+    ''', dict(projects=list(projects), bands=list(bands), values=list(values)))
+    index.load(cursor.fetchall())
+
+
+def _save(cursor, rows: List[tuple], assigned: List[tuple], to_index: List[tuple]) -> int:
+    """
+    :param rows: the (id, project_id, title, url, published_date) article rows that were assigned
+    :return: how many groups were started or added to
+    """
+    psycopg2.extras.execute_values(cursor, '''
+        INSERT INTO article_signatures (articles_id, project_id, minhash, url_hash, cluster_id) VALUES %s
+        ON CONFLICT (articles_id) DO NOTHING
+    ''', [(s.articles_id, project_id, None if s.minhash is None else list(s.minhash), s.url_hash, s.cluster_id)
+          for project_id, s in assigned])
+    psycopg2.extras.execute_values(cursor, '''
+        INSERT INTO article_signature_bands (project_id, band, band_value, articles_id) VALUES %s
+    ''', [(project_id, band, value, s.articles_id) for project_id, s in to_index for band, value in band_keys(s)])
+    clusters = {}  # cluster_id -> [project_id, articles, title, url, first published, last published]
+    for (_, project_id, title, url, published), (_, s) in zip(rows, assigned):
+        # title and url are only used if the group is new, so they're the ones of the article that started it
+        cluster = clusters.setdefault(s.cluster_id, [project_id, 0, title, url, published, published])
+        cluster[1] += 1
+        if published is not None:
+            cluster[4] = published if cluster[4] is None else min(cluster[4], published)
+            cluster[5] = published if cluster[5] is None else max(cluster[5], published)
+    psycopg2.extras.execute_values(cursor, '''
+        INSERT INTO article_clusters (cluster_id, project_id, articles, title, url, first_published, last_published)
+        VALUES %s
+        ON CONFLICT (cluster_id) DO UPDATE SET
+            articles = article_clusters.articles + EXCLUDED.articles,
+            first_published = least(article_clusters.first_published, EXCLUDED.first_published),
+            last_published = greatest(article_clusters.last_published, EXCLUDED.last_published)
+    ''', [(cluster_id, *values) for cluster_id, values in clusters.items()])
+    return len(clusters)
+
+
+def refresh(conn, full: bool = False, batch_size: int = BATCH_SIZE) -> Dict:
+    """
+    Group every article added since the last run, a batch at a time (each batch is its own transaction, so an
+    interrupted run picks up where it stopped). Articles without a project aren't grouped.
+    :param conn: a psycopg2 connection to the alerts database
+    :param full: throw away all the groups and start again from the first article
+    :param batch_size: articles to read, assign and save per transaction
+    :return: summary of what was grouped
+    """
+    create_schema(conn)
+    totals = dict(articles=0, groups_touched=0, indexed=0)
+    with conn.cursor() as cursor:
+        if full:
+            cursor.execute("TRUNCATE article_signatures, article_signature_bands, article_clusters, "
+                           "article_grouping_state")
+            conn.commit()
+        watermark = _watermark(cursor)
+        while True:
+            cursor.execute('''
+                SELECT id, project_id, title, url, published_date FROM articles
+                WHERE id > %(watermark)s AND project_id IS NOT NULL
+                ORDER BY id LIMIT %(batch_size)s
+            ''', dict(watermark=watermark, batch_size=batch_size))
+            rows = cursor.fetchall()
+            if not rows:
+                break
+            signed = signatures([row[:4] for row in rows])
+            index = BandIndex()
+            _load_candidates(cursor, index, signed)
+            assigned, to_index = assign(index, signed)
+            totals['groups_touched'] += _save(cursor, rows, assigned, to_index)
+            watermark = rows[-1][0]
+            cursor.execute('''
+                INSERT INTO article_grouping_state (id, watermark) VALUES (1, %(watermark)s)
+                ON CONFLICT (id) DO UPDATE SET watermark = EXCLUDED.watermark
+            ''', dict(watermark=watermark))
+            conn.commit()
+            totals['articles'] += len(rows)
+            totals['indexed'] += len(to_index)
+            logger.info("Grouped {} articles up to id {}".format(totals['articles'], watermark))
+    conn.commit()
+    return dict(totals, watermark=watermark)
+
+
+def main():
+    from dashboard import settings
+    parser = argparse.ArgumentParser(description="Group near-duplicate articles in the alerts database")
+    parser.add_argument('--full', action='store_true', help="regroup every article instead of just the new ones")
+    parser.add_argument('--batch-size', type=int, default=BATCH_SIZE)
+    args = parser.parse_args()
+    conn = psycopg2.connect(settings.ALERTS_DB_URI)
+    try:
+        summary = refresh(conn, full=args.full, batch_size=args.batch_size)
+        logger.info("Grouped {articles} new articles into {groups_touched} groups ({indexed} indexed), "
+                    "watermark {watermark}".format(**summary))
+    finally:
+        conn.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,82 @@
+"""
+Model score histograms binned in the database, with their percentiles and the threshold counters from the same scan.
+`width_bucket` works on the float column directly (no cast to numeric for every row), the number of bins is a
+parameter, and results come back as parallel column lists that go straight into a DataFrame for Altair instead of a
+dict per bin.
+"""
+from typing import Dict, List
+
+from psycopg2 import sql
+
+from dashboard.database.query import identifier
+
+# ways to break a histogram down, and the SQL expression for each
+BREAKDOWNS = {
+    'source': sql.SQL("source"),
+    'day': sql.SQL("processed_date::date"),
+}
+DEFAULT_PERCENTILES = [0.1, 0.25, 0.5, 0.75, 0.9]
+
+
+# width_bucket puts a score of exactly 1 in bucket bins + 1, so fold it (and anything out of range) into the ends
+BUCKET = sql.SQL("least(greatest(width_bucket(model_score, 0, 1, %(bins)s), 1), %(bins)s)")
+
+
+def summary_sql(table: str, filters: sql.Composable, by: str = None) -> sql.Composable:
+    """
+    The score histogram, its percentiles and the threshold counters, from one scan of the matching rows: they are read
+    once into a CTE (Postgres materializes a CTE used twice), which is both aggregated whole and grouped into bins.
+    :param table: table with `model_score` (between 0 and 1), `above_threshold` and `posted_date` columns
+    :param filters: SQL conditions that rows have to match
+    :param by: optional breakdown of the histogram, one of BREAKDOWNS
+    :return: query (taking `%(bins)s` and `%(percentiles)s` parameters) with a row per non-empty `bucket` (1 to bins)
+             and breakdown value, each carrying the totals too: the `unposted_above`, `posted_above` and `below` counts
+             and the `scores` at each percentile (NULL if there are no scores). With no scores at all there is a single
+             row, whose `bucket` is NULL.
+    """
+    if by is not None and by not in BREAKDOWNS:
+        raise ValueError("Unknown breakdown '{}' (expected one of {})".format(by, list(BREAKDOWNS.keys())))
+    breakdown = sql.SQL("")
+    order = sql.SQL("bins.bucket")
+    if by is not None:
+        breakdown = sql.SQL(", {} AS {}").format(BREAKDOWNS[by], sql.Identifier(by))
+        order = sql.SQL("bins.{}, bins.bucket").format(sql.Identifier(by))
+    return sql.SQL(
+        "WITH matched AS ("
+        "SELECT model_score, above_threshold, posted_date{breakdown} FROM {table} WHERE {filters}"
+        "), totals AS ("
+        "SELECT count(1) FILTER (WHERE above_threshold IS True AND posted_date IS NULL) AS unposted_above, "
+        "count(1) FILTER (WHERE above_threshold IS True AND posted_date IS NOT NULL) AS posted_above, "
+        "count(1) FILTER (WHERE above_threshold IS False) AS below, "
+        "percentile_cont(%(percentiles)s::float8[]) WITHIN GROUP (ORDER BY model_score) AS scores FROM matched"
+        "), bins AS ("
+        "SELECT {bucket} AS bucket{columns}, count(1) AS stories FROM matched "
+        "WHERE model_score IS NOT NULL GROUP BY {group}"
+        ") SELECT totals.*, bins.* FROM totals LEFT JOIN bins ON True ORDER BY {order}").format(
+        breakdown=breakdown, table=identifier(table), filters=filters, bucket=BUCKET,
+        columns=sql.SQL("") if by is None else sql.SQL(", {}").format(sql.Identifier(by)),
+        group=sql.SQL("1") if by is None else sql.SQL("1, 2"), order=order)
+
+
+def bin_edges(bins: int) -> List[float]:
+    return [round(i / bins, 6) for i in range(bins + 1)]
+
+
+def histogram_columns(rows: List[Dict], bins: int, by: str = None) -> Dict[str, list]:
+    """
+    Turn the `summary_sql` bins into parallel column lists. Without a breakdown every bin is included (empty ones with
+    a count of zero) so the chart has no gaps.
+    :return: dict of `bin_start`, `bin_end`, `stories` and, with a breakdown, the `by` column
+    """
+    edges = bin_edges(bins)
+    if by is None:
+        counts = [0] * bins
+        for row in rows:
+            counts[row['bucket'] - 1] = row['stories']
+        return dict(bin_start=edges[:-1], bin_end=edges[1:], stories=counts)
+    return {
+        'bin_start': [edges[row['bucket'] - 1] for row in rows],
+        'bin_end': [edges[row['bucket']] for row in rows],
+        'stories': [row['stories'] for row in rows],
+        by: [row[by] for row in rows],
+    }
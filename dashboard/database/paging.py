@@ -0,0 +1,50 @@
+"""
+Keyset ("seek") pagination for long listings. Each page starts right after the last row of the previous one
+(`WHERE (a, b) < (last a, last b)`) rather than at an OFFSET, which has to read and throw away every earlier row. With
+an index on the filter columns followed by the sort keys every page costs the same, however deep into the listing it is.
+"""
+from typing import Dict, List, Optional, Tuple
+
+from psycopg2 import sql
+
+from dashboard.database.query import identifier
+
+
+def keyset_page_sql(table: str, columns: List[str], filters: sql.Composable, params: Dict, order_columns: List[str],
+                    after: Optional[tuple] = None, page_size: int = 50) -> Tuple[sql.Composable, Dict]:
+    """
+    :param table: table to list
+    :param columns: columns to return (they must include the `order_columns`)
+    :param filters: SQL conditions that rows have to match
+    :param params: values for any placeholders in `filters`
+    :param order_columns: unique sort key, newest first (ie. a date and then an id to break ties)
+    :param after: the sort key values of the last row on the previous page (None for the first page)
+    :param page_size: rows per page; one extra is fetched to tell whether there is a next page
+    :return: the query and its parameters
+    """
+    params = dict(params, limit=page_size + 1)
+    keys = [identifier(c) for c in order_columns]
+    clauses = [filters]
+    if after is not None:
+        for i, value in enumerate(after):
+            params['after_{}'.format(i)] = value
+        clauses.append(sql.SQL("({}) < ({})").format(
+            sql.SQL(", ").join(keys),
+            sql.SQL(", ").join(sql.Placeholder('after_{}'.format(i)) for i in range(len(after)))))
+    query = sql.SQL("SELECT {columns} FROM {table} WHERE {where} ORDER BY {order} LIMIT %(limit)s").format(
+        columns=sql.SQL(", ").join(sql.Identifier(c) for c in columns),
+        table=identifier(table),
+        where=sql.SQL(" AND ").join(clauses),
+        order=sql.SQL(", ").join(sql.SQL("{} DESC").format(k) for k in keys))
+    return query, params
+
+
+def split_page(rows: List[Dict], order_columns: List[str], page_size: int) -> Tuple[List[Dict], Optional[tuple]]:
+    """
+    :param rows: results of a `keyset_page_sql` query
+    :return: the rows for this page, and the `after` to pass for the next page (None if this is the last one)
+    """
+    if len(rows) <= page_size:
+        return rows, None
+    page = rows[:page_size]
+    return page, tuple(page[-1][c] for c in order_columns)
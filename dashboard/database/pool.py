@@ -0,0 +1,150 @@
+"""
+A small thread-safe Postgres connection pool shared by the database modules. Each query checks a connection out, uses
+its own cursor and hands it back, so concurrent browser sessions don't queue up behind one shared connection. Broken
+connections are thrown away and replaced instead of poisoning the process until it restarts.
+"""
+import logging
+import threading
+import time
+from contextlib import contextmanager
+from typing import Callable
+
+import psycopg2
+import psycopg2.extensions
+from psycopg2.pool import PoolError
+
+logger = logging.getLogger(__name__)
+
+APPLICATION_NAME = "feminicide-dashboard"
+
+
+class ConnectionPool:
+
+    def __init__(self, dsn: str, min_size: int = 1, max_size: int = 5, statement_timeout: int = 30000,
+                 checkout_timeout: float = 30, health_check_after: float = 30,
+                 connect: Callable = psycopg2.connect):
+        """
+        :param dsn: database URI to connect to
+        :param min_size: connections to open right away
+        :param max_size: most connections that can be checked out at once
+        :param statement_timeout: milliseconds before Postgres cancels a query (0 for no limit)
+        :param checkout_timeout: seconds to wait for a free connection before giving up
+        :param health_check_after: seconds a connection can sit idle before we ping it on checkout
+        :param connect: function that opens a connection (swap it for a stand-in in tests)
+        """
+        if min_size > max_size:
+            raise ValueError("min_size ({}) can't be more than max_size ({})".format(min_size, max_size))
+        self._dsn = dsn
+        self._statement_timeout = statement_timeout
+        self._checkout_timeout = checkout_timeout
+        self._health_check_after = health_check_after
+        self._connect = connect
+        self._max_size = max_size
+        self._slots = threading.BoundedSemaphore(max_size)
+        self._lock = threading.Lock()
+        self._idle = []  # (connection, last returned time) pairs, most recently used last
+        self._in_use = 0
+        self._closed = False
+        for _ in range(min_size):
+            self._idle.append((self._new_connection(), time.monotonic()))
+
+    def _new_connection(self):
+        return self._connect(self._dsn, application_name=APPLICATION_NAME,
+                             options='-c statement_timeout={}'.format(self._statement_timeout))
+
+    def _is_healthy(self, conn, idle_since: float) -> bool:
+        if conn.closed:
+            return False
+        if time.monotonic() - idle_since < self._health_check_after:
+            return True
+        try:
+            with conn.cursor() as cursor:
+                cursor.execute("select 1")
+            conn.rollback()
+            return True
+        except psycopg2.Error:
+            logger.warning("Dropping unhealthy pooled connection")
+            return False
+
+    @staticmethod
+    def _close_quietly(conn) -> None:
+        try:
+            conn.close()
+        except psycopg2.Error:
+            pass
+
+    def getconn(self):
+        """
+        Check out a healthy connection, reconnecting if the idle ones have gone bad. Blocks until one is free.
+        """
+        if self._closed:
+            raise PoolError("connection pool is closed")
+        if not self._slots.acquire(timeout=self._checkout_timeout):
+            raise PoolError("no database connection free after {}s".format(self._checkout_timeout))
+        try:
+            while True:
+                with self._lock:
+                    conn, idle_since = self._idle.pop() if self._idle else (None, None)
+                if conn is None:
+                    conn = self._new_connection()
+                    break
+                if self._is_healthy(conn, idle_since):
+                    break
+                self._close_quietly(conn)
+        except Exception:
+            self._slots.release()
+            raise
+        with self._lock:
+            self._in_use += 1
+        return conn
+
+    def putconn(self, conn, discard: bool = False) -> None:
+        """
+        Return a connection, rolling back anything left open. Broken (or discarded) connections are closed instead.
+        """
+        if not (discard or conn.closed or self._closed):
+            try:
+                if conn.get_transaction_status() != psycopg2.extensions.TRANSACTION_STATUS_IDLE:
+                    conn.rollback()
+            except psycopg2.Error:
+                discard = True
+        with self._lock:
+            self._in_use -= 1
+            if discard or conn.closed or self._closed:
+                keep = False
+            else:
+                self._idle.append((conn, time.monotonic()))
+                keep = True
+        if not keep:
+            self._close_quietly(conn)
+        self._slots.release()
+
+    @contextmanager
+    def connection(self):
+        """
+        Use like `with pool.connection() as conn:` - commits on success, rolls back on error, and always returns the
+        connection to the pool.
+        """
+        conn = self.getconn()
+        try:
+            yield conn
+            conn.commit()
+        except Exception as e:
+            broken = conn.closed or isinstance(e, (psycopg2.OperationalError, psycopg2.InterfaceError))
+            self.putconn(conn, discard=broken)
+            raise
+        except BaseException:  # ie. a generator streaming rows out of this connection was closed early
+            self.putconn(conn)  # rolls back the open transaction
+            raise
+        self.putconn(conn)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return dict(idle=len(self._idle), in_use=self._in_use, max_size=self._max_size)
+
+    def closeall(self) -> None:
+        with self._lock:
+            self._closed = True
+            idle, self._idle = self._idle, []
+        for conn, _ in idle:
+            self._close_quietly(conn)
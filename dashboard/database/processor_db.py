@@ -1,63 +1,229 @@
 import datetime as dt
-from typing import List, Dict
+from functools import partial
+from typing import List, Dict, Iterator, Optional, Tuple, TYPE_CHECKING
 import logging
-import streamlit as st
+import threading
 import psycopg2
-import psycopg2.extras
+from psycopg2 import sql
 
-from dashboard import PROCESSOR_DB_URI
+from dashboard import settings
+from dashboard.database.pool import ConnectionPool
+from dashboard.database.cache import query_cache
+import dashboard.database.tracing as tracing
+import dashboard.database.profiling as profiling
+from dashboard.database.query import identifier, where, as_text, execute, PreparingConnection, PREPARED_FAMILIES
+from dashboard.database.sampling import sample_sql, SAMPLE_PROBE
+from dashboard.database.paging import keyset_page_sql, split_page
+import dashboard.database.histogram as histogram
+import dashboard.database.bucketing as bucketing
+from dashboard.database.rollup import DATE_KINDS
+import dashboard.database.streaming as streaming
+import dashboard.database.duckdb_db as duckdb_db
+
+if TYPE_CHECKING:
+    import pandas as pd  # imported where it's used, it is slow to import
 
 logger = logging.getLogger(__name__)
 
+# stories column -> date_kind in the story_daily_counts rollup
+ROLLUP_DATE_KINDS = {column_name: date_kind for date_kind, column_name in DATE_KINDS.items()}
+
+# what story listings show - never `select *`, because the full rows are much bigger than what we display
+STORY_LIST_COLUMNS = ['stories_id', 'source', 'url', 'model_score', 'published_date', 'processed_date']
+# newest first, with stories_id to break ties (see the stories_project_processed_story index)
+STORY_PAGE_ORDER = ['processed_date', 'stories_id']
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def db_pool() -> ConnectionPool:
+    """
+    The pool for this database, shared by every session in the process. Opened on the first query rather than on
+    import, so pages (and tests) that never query this database don't connect to it.
+    """
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = ConnectionPool(settings.PROCESSOR_DB_URI, min_size=settings.DB_POOL_MIN_SIZE,
+                                   max_size=settings.DB_POOL_MAX_SIZE, statement_timeout=settings.DB_STATEMENT_TIMEOUT,
+                                   connect=partial(psycopg2.connect, connection_factory=PreparingConnection))
+        return _pool
+
 
-@st.cache_resource  # so it only run once
-def init_connection():
-    return psycopg2.connect(PROCESSOR_DB_URI)
+def using_snapshot() -> bool:
+    """
+    Whether queries run with DuckDB over the Parquet snapshot instead of on Postgres (see dashboard.database.duckdb_db).
+    Long date ranges are only cheap then.
+    """
+    return settings.QUERY_BACKEND == 'duckdb'
 
 
-db_conn = init_connection()
+def _use_rollup() -> bool:
+    # the snapshot only has the raw stories (and DuckDB counts those fast enough without a rollup)
+    return settings.USE_STORY_ROLLUP and not using_snapshot()
 
 
-def _run_query(query: str) -> List[Dict]:
-    dict_cursor = db_conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor)
-    dict_cursor.execute(query)
-    results = dict_cursor.fetchall()
-    return results
+def _execute(query: str, params: Dict, family: str, as_columns: bool = False):
+    tracing.notify('processor', query, params)
+    with profiling.profiled('processor', family, query, params) as profile:
+        if using_snapshot():
+            columns, rows = duckdb_db.fetch(query, params, profiling.sql_comment(family))
+        else:
+            with db_pool().connection() as conn:
+                with conn.cursor() as cursor:
+                    execute(cursor, query, params, family in PREPARED_FAMILIES, profiling.sql_comment(family))
+                    rows = cursor.fetchall()
+                    columns = [d[0] for d in cursor.description]
+        profile.add_rows(rows)
+    if as_columns:  # straight from the tuples, without a dict per row on the way
+        return streaming.to_columns(columns, rows)
+    return [dict(zip(columns, row)) for row in rows]
 
 
-def recent_stories(project_id: int, above_threshold: bool, limit: int = 5) -> List:
+def _stream_query(query, params: Dict = None, itersize: int = None) -> Iterator[List[tuple]]:
+    """
+    Read a big listing in batches of row tuples through a server-side cursor. Not cached - these are too big to keep.
+    The pooled connection is held until the generator is exhausted or closed.
     """
-    UI: show a list of the most recent stories we have processed
+    text = as_text(query)
+    tracing.notify('processor', text, params)
+    with profiling.profiled('processor', 'stream', text, params) as profile:
+        if using_snapshot():
+            for rows in duckdb_db.iter_batches(text, params, itersize, profiling.sql_comment('stream')):
+                profile.add_rows(rows)
+                yield rows
+            return
+        with db_pool().connection() as conn:
+            for rows in streaming.iter_batches(conn, text, params, itersize, profiling.sql_comment('stream')):
+                profile.add_rows(rows)
+                yield rows
+
+
+def _run_query(query, params: Dict = None, family: str = None, as_columns: bool = False):
+    """
+    Run a read-only query, reusing a recent result for the same SQL and parameters if there is one in the cache.
+    :param query: SQL string or `psycopg2.sql` composition, with `%(name)s` placeholders for values
+    :param params: values for the placeholders
+    :param family: which kind of query this is, to pick how long to cache it (see dashboard.database.cache) and
+                   whether to run it as a prepared statement
+    :param as_columns: return a dict of parallel column lists (ie. for a chart's DataFrame) instead of a dict per row
+    :return:
+    """
+    text = as_text(query)
+    return query_cache.get_or_run('processor.columns' if as_columns else 'processor', family, text,
+                                  lambda: _execute(text, params, family, as_columns), params)
+
+
+def recent_stories(project_id: int, above_threshold: bool, limit: int = 5, mode: str = SAMPLE_PROBE,
+                   seed=None) -> List:
+    """
+    UI: show a sample of the stories we have processed in the last week
     :param project_id:
     :param above_threshold:
     :param limit:
+    :param mode: how to pick them - one of `sampling.SAMPLE_MODES`
+    :param seed: pass the same seed to get the same sample back on every rerun
     :return:
     """
     earliest_date = dt.date.today() - dt.timedelta(days=7)
-    sql = '''
-        SELECT * FROM stories WHERE
-            project_id={} AND above_threshold={} AND published_date >= '{}'::DATE
-            ORDER BY RANDOM() DESC LIMIT {}
-    '''.format(project_id, above_threshold, earliest_date, limit)
-    return _run_query(sql)
+    filters = sql.SQL("project_id = %(project_id)s AND above_threshold = %(above_threshold)s")
+    query, params = sample_sql('stories', filters, dict(project_id=project_id, above_threshold=above_threshold),
+                               'published_date', earliest_date, limit, mode, seed)
+    return _run_query(query, params, 'sample')
+
+
+def story_page(project_id: int, source: str = None, above_threshold: bool = None, min_score: float = None,
+               max_score: float = None, after: Optional[tuple] = None,
+               page_size: int = 50) -> Tuple[List[Dict], Optional[tuple]]:
+    """
+    UI: one page of a project's stories, newest first, for browsing through all of them.
+    :param project_id:
+    :param source: only stories from this platform
+    :param above_threshold: only stories above (True) or below (False) threshold
+    :param min_score: only stories with at least this model score
+    :param max_score: only stories with at most this model score
+    :param after: the `after` returned with the previous page (None for the first page)
+    :param page_size:
+    :return: the stories on this page, and the `after` to pass for the next page (None if this is the last one)
+    """
+    params = dict(project_id=project_id, source=source, above_threshold=above_threshold, min_score=min_score,
+                  max_score=max_score)
+    clauses = [sql.SQL("project_id = %(project_id)s"), sql.SQL("processed_date is not Null")]
+    if source is not None:
+        clauses.append(sql.SQL("source = %(source)s"))
+    if above_threshold is not None:
+        clauses.append(sql.SQL("above_threshold = %(above_threshold)s"))
+    if min_score is not None:
+        clauses.append(sql.SQL("model_score >= %(min_score)s"))
+    if max_score is not None:
+        clauses.append(sql.SQL("model_score <= %(max_score)s"))
+    query, params = keyset_page_sql('stories', STORY_LIST_COLUMNS, where(clauses), params, STORY_PAGE_ORDER, after,
+                                    page_size)
+    return split_page(_run_query(query, params, 'page'), STORY_PAGE_ORDER, page_size)
 
 
 def _stories_by_date_col(column_name: str, project_id: int = None, platform: str = None, above_threshold: bool = None,
                          is_posted: bool = None, limit: int = 30) -> List:
-    earliest_date = dt.date.today() - dt.timedelta(days=limit)
+    params = dict(earliest_date=dt.date.today() - dt.timedelta(days=limit), project_id=project_id, source=platform,
+                  above_threshold=above_threshold)
     clauses = []
     if project_id is not None:
-        clauses.append("(project_id={})".format(project_id))
+        clauses.append(sql.SQL("project_id = %(project_id)s"))
     if platform is not None:
-        clauses.append("(source='{}')".format(platform))
+        clauses.append(sql.SQL("source = %(source)s"))
     if above_threshold is not None:
-        clauses.append("(above_threshold is {})".format('True' if above_threshold else 'False'))
+        clauses.append(sql.SQL("above_threshold = %(above_threshold)s"))
+    if _use_rollup():
+        if is_posted is not None:
+            clauses.append(sql.SQL("is_posted = %(is_posted)s"))
+        params.update(date_kind=ROLLUP_DATE_KINDS[column_name], is_posted=is_posted)
+        query = sql.SQL("select day, sum(stories) as stories from story_daily_counts "
+                        "where (date_kind = %(date_kind)s) and (day >= %(earliest_date)s::DATE) AND {} "
+                        "group by 1 order by 1 DESC").format(where(clauses))
+        return _run_query(query, params, 'history')
     if is_posted is not None:
-        clauses.append("(posted_date {} Null)".format("is not" if is_posted else "is"))
-    query = "select "+column_name+"::date as day, count(1) as stories from stories " \
-            "where ("+column_name+" is not Null) and ("+column_name+" >= '{}'::DATE) AND {} " \
-            "group by 1 order by 1 DESC".format(earliest_date, " AND ".join(clauses))
-    return _run_query(query)
+        clauses.append(sql.SQL("posted_date is not Null" if is_posted else "posted_date is Null"))
+    query = sql.SQL("select {col}::date as day, count(1) as stories from stories "
+                    "where ({col} is not Null) and ({col} >= %(earliest_date)s::DATE) AND {clauses} "
+                    "group by 1 order by 1 DESC").format(col=identifier(column_name), clauses=where(clauses))
+    return _run_query(query, params, 'history')
+
+
+def story_counts_by_day(column_name: str, project_id: int = None, limit: int = 45,
+                        bucket: str = None) -> Dict[str, list]:
+    """
+    UI: story counts for a date column, per day (or week or month, for long ranges), broken out by source and
+    threshold in one grouped query (instead of one query per platform).
+    :param column_name: the date column to group by (ie. 'processed_date')
+    :param project_id: optional project to limit to
+    :param limit: number of days back to include
+    :param bucket: one of `bucketing.BUCKETS`; by default the smallest that keeps the chart within its budget of points
+    :return: parallel `day` (the first day of each bucket), `source`, `above` and `below` threshold count columns, one
+             entry per (bucket, source), newest first
+    """
+    bucket = bucket or bucketing.pick_bucket(limit)
+    params = dict(earliest_date=bucketing.earliest_date(limit, bucket), project_id=project_id, bucket=bucket)
+    clauses = [sql.SQL("project_id = %(project_id)s")] if project_id is not None else []
+    if _use_rollup():
+        params.update(date_kind=ROLLUP_DATE_KINDS[column_name])
+        query = sql.SQL("select {day} as day, source, "
+                        "coalesce(sum(stories) filter (where above_threshold is True), 0) as above, "
+                        "coalesce(sum(stories) filter (where above_threshold is False), 0) as below "
+                        "from story_daily_counts "
+                        "where (date_kind = %(date_kind)s) and (day >= %(earliest_date)s::DATE) AND {clauses} "
+                        "group by 1, 2 order by 1 DESC").format(day=bucketing.bucket_sql(sql.SQL("day")),
+                                                                clauses=where(clauses))
+        return _run_query(query, params, 'history', as_columns=True)
+    col = identifier(column_name)
+    query = sql.SQL("select {day} as day, source, "
+                    "count(1) filter (where above_threshold is True) as above, "
+                    "count(1) filter (where above_threshold is False) as below "
+                    "from stories where ({col} is not Null) and ({col} >= %(earliest_date)s::DATE) AND {clauses} "
+                    "group by 1, 2 order by 1 DESC").format(day=bucketing.bucket_sql(col), col=col,
+                                                            clauses=where(clauses))
+    return _run_query(query, params, 'history', as_columns=True)
 
 
 def stories_by_posted_day(project_id: int = None, platform: str = None, above_threshold: bool = True,
@@ -75,8 +241,8 @@ def stories_by_published_day(project_id: int = None, platform: str = None, above
     return _stories_by_date_col('published_date', project_id, platform, above_threshold, is_posted, limit)
 
 
-def _run_count_query(query: str) -> int:
-    data = _run_query(query)
+def _run_count_query(query, params: Dict = None) -> int:
+    data = _run_query(query, params, 'count')
     return data[0]['count']
 
 
@@ -84,13 +250,22 @@ def unposted_above_story_count(project_id: int, limit: int = None) -> int:
     """
     UI: How many stories about threshold have *not* been sent to main server (should be zero!).
     """
-    date_clause = "(posted_date is not Null)"
+    params = dict(project_id=project_id)
+    date_clause = sql.SQL("True")
+    if limit:
+        params['earliest_date'] = dt.date.today() - dt.timedelta(days=limit)
+    if _use_rollup():
+        if limit:
+            date_clause = sql.SQL("day >= %(earliest_date)s::DATE")
+        query = sql.SQL("select coalesce(sum(stories), 0) as count from story_daily_counts "
+                        "where date_kind = 'processed' and is_posted is False and project_id = %(project_id)s "
+                        "and above_threshold is True and {}").format(date_clause)
+        return _run_count_query(query, params)
     if limit:
-        earliest_date = dt.date.today() - dt.timedelta(days=limit)
-        date_clause+= " AND (posted_date >= '{}'::DATE)".format(earliest_date)
-    query = "select count(1) from stories where project_id={} and above_threshold is True and {}".\
-        format(project_id, date_clause)
-    return _run_count_query(query)
+        date_clause = sql.SQL("processed_date >= %(earliest_date)s::DATE")
+    query = sql.SQL("select count(1) as count from stories where project_id = %(project_id)s "
+                    "and above_threshold is True and posted_date is Null and {}").format(date_clause)
+    return _run_count_query(query, params)
 
 
 def posted_above_story_count(project_id: int) -> int:
@@ -99,10 +274,13 @@ def posted_above_story_count(project_id: int) -> int:
     :param project_id:
     :return:
     """
-    query = "select count(1) from stories " \
-            "where project_id={} and posted_date is not Null and above_threshold is True".\
-        format(project_id)
-    return _run_count_query(query)
+    if _use_rollup():
+        query = "select coalesce(sum(stories), 0) as count from story_daily_counts " \
+                "where date_kind = 'posted' and project_id = %(project_id)s and above_threshold is True"
+        return _run_count_query(query, dict(project_id=project_id))
+    query = "select count(1) as count from stories " \
+            "where project_id = %(project_id)s and posted_date is not Null and above_threshold is True"
+    return _run_count_query(query, dict(project_id=project_id))
 
 
 def below_story_count(project_id: int) -> int:
@@ -111,29 +289,79 @@ def below_story_count(project_id: int) -> int:
     :param project_id:
     :return:
     """
-    query = "select count(1) from stories where project_id={} and above_threshold is False".\
-        format(project_id)
-    return _run_count_query(query)
+    if _use_rollup():
+        # every story gets a processed_date, so that date_kind covers all of them
+        query = "select coalesce(sum(stories), 0) as count from story_daily_counts " \
+                "where date_kind = 'processed' and project_id = %(project_id)s and above_threshold is False"
+        return _run_count_query(query, dict(project_id=project_id))
+    query = "select count(1) as count from stories where project_id = %(project_id)s and above_threshold is False"
+    return _run_count_query(query, dict(project_id=project_id))
 
 
-def unposted_stories(project_id: int, limit: int):
+def iter_unposted_stories(project_id: int, limit: int, itersize: int = None) -> Iterator['pd.DataFrame']:
     """
-    How many stories were not posted to the main server (should be same as below_story_count)
-    :return:
+    Like `unposted_stories`, but a page of up to `itersize` stories at a time, so memory use stays flat however many
+    there are (ie. during a posting outage).
+    """
+    query = sql.SQL("select {columns} from stories "
+                    "where project_id = %(project_id)s and posted_date is Null "
+                    "and processed_date >= %(earliest_date)s::DATE and above_threshold is True "
+                    "order by processed_date, stories_id").format(
+        columns=sql.SQL(", ").join(sql.Identifier(c) for c in STORY_LIST_COLUMNS))
+    params = dict(project_id=project_id, earliest_date=dt.date.today() - dt.timedelta(days=limit))
+    for rows in _stream_query(query, params, itersize):
+        yield streaming.to_frame(STORY_LIST_COLUMNS, [rows])
+
+
+def unposted_stories(project_id: int, limit: int) -> 'pd.DataFrame':
+    """
+    Stories above threshold processed in the last `limit` days that were not posted to the main server (should be
+    none!). Streamed from the server and built column-wise, with just the `STORY_LIST_COLUMNS`.
+    :return: one row per story
+    """
+    import pandas as pd
+    frames = list(iter_unposted_stories(project_id, limit))
+    if not frames:
+        return streaming.to_frame(STORY_LIST_COLUMNS, [])
+    return pd.concat(frames, ignore_index=True)
+
+
+def project_summary(project_id: int, bins: int = 10, by: str = None, limit: int = 30,
+                    percentiles: List[float] = None) -> Dict:
+    """
+    UI: All the per-project statistics in one scan of the project's stories - the same counts as
+    `unposted_above_story_count`, `posted_above_story_count` and `below_story_count`, plus the histogram of model
+    scores binned in the database and their percentiles.
+    :param project_id:
+    :param bins: how many equal-width bins to split 0-1 into
+    :param by: optional breakdown of the histogram, 'source' or 'day' (by processed day)
+    :param limit: with the 'day' breakdown, the number of days back to include (in the counts too)
+    :param percentiles: which percentiles of the scores to compute (defaults to `histogram.DEFAULT_PERCENTILES`)
+    :return: dict with `unposted_above`, `posted_above` and `below` counts, the bin `edges`, the histogram `columns`
+             (see `histogram.histogram_columns`) and the score at each of the `percentiles` (None without scores)
+    """
+    percentiles = percentiles or histogram.DEFAULT_PERCENTILES
+    params = dict(project_id=project_id, bins=bins, percentiles=percentiles)
+    clauses = [sql.SQL("project_id = %(project_id)s")]
+    if by == 'day':
+        params['earliest_date'] = dt.date.today() - dt.timedelta(days=limit)
+        clauses.append(sql.SQL("processed_date >= %(earliest_date)s::DATE"))
+    rows = _run_query(histogram.summary_sql('stories', where(clauses), by), params, 'count')
+    totals = rows[0]  # every row carries the totals, and there is always at least one
+    return dict(
+        unposted_above=totals['unposted_above'],
+        posted_above=totals['posted_above'],
+        below=totals['below'],
+        edges=histogram.bin_edges(bins),
+        columns=histogram.histogram_columns([row for row in rows if row['bucket'] is not None], bins, by),
+        percentiles=dict(zip(percentiles, totals['scores'] or [None] * len(percentiles))),
+    )
+
+
+def score_distribution(project_id: int, bins: int = 10, by: str = None, limit: int = 30,
+                       percentiles: List[float] = None) -> Dict:
+    """
+    UI: histogram of a project's model scores. It comes from the same query as `project_summary`, so with the default
+    bins and no breakdown the Model Scores section reuses the Statistics section's cached result.
     """
-    earliest_date = dt.date.today() - dt.timedelta(days=limit)
-    query = "select * from stories " \
-            "where project_id={} and posted_date is Null and (posted_date >= '{}'::DATE) and above_threshold is True".\
-        format(project_id, earliest_date)
-    return _run_query(query)
-
-
-def project_binned_model_scores(project_id: int) -> List:
-    query = """
-        select ROUND(CAST(model_score as numeric), 1) as value, count(1) as frequency
-        from stories
-        where project_id={} and model_score is not NULL
-        group by 1
-        order by 1
-    """.format(project_id)
-    return _run_query(query)
+    return project_summary(project_id, bins, by, limit, percentiles)
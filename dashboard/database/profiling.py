@@ -0,0 +1,209 @@
+"""
+Per-query profiling: how long each query the dashboard sends to Postgres took, how many rows and (roughly) how many
+bytes came back, and which chart asked for it. Every profile is
+  * added to whatever `collecting()` block is active (ie. the in-page debug panel for the current render),
+  * rolled up into Prometheus-style metrics (see `prometheus_text`, and PROMETHEUS_TEXTFILE to export them),
+  * sent to Sentry as a `db.sql.query` span when performance tracing is on (SENTRY_TRACES_SAMPLE_RATE).
+Statements are also tagged with a SQL comment naming the chart, so slow query logs and pg_stat_activity show where they
+came from (the connections already identify themselves with `application_name`).
+"""
+import contextvars
+import logging
+import os
+import re
+import tempfile
+import threading
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+from typing import Dict, Iterator, List
+
+from dashboard import settings
+from dashboard.database.pool import APPLICATION_NAME
+
+logger = logging.getLogger(__name__)
+
+# upper bounds (in seconds) of the query duration histogram buckets
+DURATION_BUCKETS = [0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30]
+TEXTFILE_INTERVAL = 15  # seconds between rewrites of PROMETHEUS_TEXTFILE
+BYTES_SAMPLE_ROWS = 100  # rows per fetched batch whose size is measured; bigger batches are estimated from these
+
+_chart = contextvars.ContextVar('chart', default=None)
+_collector = contextvars.ContextVar('collector', default=None)
+_unsafe_comment_chars = re.compile(r'[^\w .:/-]')
+
+_metrics_lock = threading.Lock()
+_metrics = defaultdict(lambda: dict(count=0, seconds=0.0, rows=0, bytes=0, buckets=[0] * len(DURATION_BUCKETS)))
+_textfile_written = 0
+
+
+class QueryProfile:
+
+    def __init__(self, database: str, family: str, query: str, params: Dict = None):
+        self.database = database
+        self.family = family or 'other'
+        self.chart = _chart.get() or 'unlabelled'
+        self.query = query
+        self.params = params
+        self.seconds = None
+        self.rows = 0
+        self.bytes = 0
+
+    def add_rows(self, rows: List) -> None:
+        """
+        Count a batch of fetched rows (dicts or tuples). Bytes are estimated as the length of each value as text, which
+        is about what Postgres sends over the wire - measured on an evenly spread sample of BYTES_SAMPLE_ROWS rows and
+        scaled up, as this runs on every fetch and big history and streamed listings would pay for it twice otherwise.
+        """
+        self.rows += len(rows)
+        step = max(1, len(rows) // BYTES_SAMPLE_ROWS)
+        sample = rows[::step][:BYTES_SAMPLE_ROWS]
+        if not sample:
+            return
+        sample_bytes = 0
+        for row in sample:
+            values = row.values() if isinstance(row, dict) else row
+            sample_bytes += sum(len(str(v)) for v in values if v is not None)
+        self.bytes += round(sample_bytes * len(rows) / len(sample))
+
+    def as_dict(self) -> Dict:
+        return dict(database=self.database, family=self.family, chart=self.chart, query=self.query,
+                    seconds=self.seconds, rows=self.rows, bytes=self.bytes)
+
+
+@contextmanager
+def chart(label: str) -> Iterator[None]:
+    """
+    Attribute the queries run inside the block (including ones the QueryScheduler runs for it) to a chart or section.
+    Nested labels are joined with '/', ie. 'History/processed'.
+    """
+    outer = _chart.get()
+    token = _chart.set(label if outer is None else outer + '/' + label)
+    try:
+        yield
+    finally:
+        _chart.reset(token)
+
+
+@contextmanager
+def collecting() -> Iterator[List[QueryProfile]]:
+    """
+    Collect the profile of every query run inside the block (including on QueryScheduler threads started from it).
+    """
+    profiles = []
+    token = _collector.set(profiles)
+    try:
+        yield profiles
+    finally:
+        _collector.reset(token)
+
+
+def sql_comment(family: str = None) -> str:
+    """
+    A comment to put in front of a statement, naming who sent it. Kept to plain characters so it can't end the comment
+    early or be mistaken for a parameter placeholder.
+    """
+    tags = dict(application=APPLICATION_NAME, chart=_chart.get() or 'unlabelled', family=family or 'other')
+    return "/* {} */ ".format(" ".join("{}={}".format(k, _unsafe_comment_chars.sub('_', v)) for k, v in tags.items()))
+
+
+@contextmanager
+def profiled(database: str, family: str, query: str, params: Dict = None) -> Iterator[QueryProfile]:
+    """
+    Time a query. Use like `with profiled(...) as profile:`, calling `profile.add_rows(...)` with what was fetched.
+    """
+    import sentry_sdk  # here rather than at the top, so importing this module stays cheap
+    profile = QueryProfile(database, family, query, params)
+    with sentry_sdk.start_span(op='db.sql.query', description=query) as span:
+        span.set_tag('db.system', 'postgresql')
+        span.set_tag('db.name', database)
+        span.set_tag('chart', profile.chart)
+        start = time.perf_counter()
+        try:
+            yield profile
+        finally:
+            profile.seconds = time.perf_counter() - start
+            span.set_data('rows', profile.rows)
+            span.set_data('bytes', profile.bytes)
+            _record(profile)
+
+
+def _record(profile: QueryProfile) -> None:
+    collector = _collector.get()
+    if collector is not None:
+        collector.append(profile)
+    with _metrics_lock:
+        stats = _metrics[(profile.database, profile.chart, profile.family)]
+        stats['count'] += 1
+        stats['seconds'] += profile.seconds
+        stats['rows'] += profile.rows
+        stats['bytes'] += profile.bytes
+        for i, bound in enumerate(DURATION_BUCKETS):
+            if profile.seconds <= bound:
+                stats['buckets'][i] += 1
+    if settings.PROMETHEUS_TEXTFILE:
+        _maybe_write_textfile()
+
+
+def metrics() -> Dict:
+    """
+    :return: (database, chart, family) -> totals of `count`, `seconds`, `rows` and `bytes`, and per-bucket `buckets`
+    """
+    with _metrics_lock:
+        return {key: dict(stats, buckets=list(stats['buckets'])) for key, stats in _metrics.items()}
+
+
+def reset_metrics() -> None:
+    with _metrics_lock:
+        _metrics.clear()
+
+
+def prometheus_text() -> str:
+    """
+    All the query metrics so far, in the Prometheus text exposition format.
+    """
+    lines = [
+        "# HELP dashboard_query_duration_seconds Time spent running dashboard queries against Postgres.",
+        "# TYPE dashboard_query_duration_seconds histogram",
+    ]
+    totals = []
+    for (database, chart_label, family), stats in sorted(metrics().items()):
+        labels = 'database="{}",chart="{}",family="{}"'.format(database, chart_label.replace('"', '\\"'), family)
+        for bound, count in zip(DURATION_BUCKETS, stats['buckets']):
+            lines.append('dashboard_query_duration_seconds_bucket{{{},le="{}"}} {}'.format(labels, bound, count))
+        lines.append('dashboard_query_duration_seconds_bucket{{{},le="+Inf"}} {}'.format(labels, stats['count']))
+        lines.append('dashboard_query_duration_seconds_sum{{{}}} {}'.format(labels, stats['seconds']))
+        lines.append('dashboard_query_duration_seconds_count{{{}}} {}'.format(labels, stats['count']))
+        totals.append((labels, stats))
+    for name, key, description in [('rows', 'rows', "Rows returned"), ('bytes', 'bytes', "Approximate bytes fetched")]:
+        lines.append("# HELP dashboard_query_{}_total {} by dashboard queries.".format(name, description))
+        lines.append("# TYPE dashboard_query_{}_total counter".format(name))
+        for labels, stats in totals:
+            lines.append('dashboard_query_{}_total{{{}}} {}'.format(name, labels, stats[key]))
+    return "\n".join(lines) + "\n"
+
+
+def write_textfile(path: str) -> None:
+    """
+    Write the metrics for node_exporter's textfile collector (atomically, so it never reads half a file).
+    """
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(path)), prefix='.tmp-', suffix='.prom')
+    try:
+        with os.fdopen(fd, 'w') as f:
+            f.write(prometheus_text())
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
+
+
+def _maybe_write_textfile() -> None:
+    global _textfile_written
+    with _metrics_lock:
+        if time.monotonic() - _textfile_written < TEXTFILE_INTERVAL:
+            return
+        _textfile_written = time.monotonic()
+    try:
+        write_textfile(settings.PROMETHEUS_TEXTFILE)
+    except OSError as e:
+        logger.warning("Couldn't write query metrics to {}: {}".format(settings.PROMETHEUS_TEXTFILE, e))
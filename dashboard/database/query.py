@@ -0,0 +1,111 @@
+"""
+Helpers for building SQL with bound parameters instead of `str.format`. Values always go in as `%(name)s`
+placeholders; the only things spliced into the SQL text are identifiers from the IDENTIFIERS whitelist. Because the
+text no longer changes with every project or date, Postgres can reuse plans, and the hot queries are run as
+server-side prepared statements so repeat renders skip planning altogether.
+"""
+import hashlib
+import re
+from typing import Dict, List
+
+import psycopg2.extensions
+from psycopg2 import sql
+
+# tables and columns that callers are allowed to pick at runtime
+IDENTIFIERS = {
+    'stories', 'articles', 'stories_id', 'article_clusters', 'cluster_id',
+    'published_date', 'processed_date', 'posted_date', 'publish_date', 'last_published',
+}
+
+# query families (see dashboard.database.cache) worth keeping prepared on each connection
+PREPARED_FAMILIES = {'history', 'count', 'page'}
+
+_param_pattern = re.compile(r'%%|%\((\w+)\)s')
+
+
+def identifier(name: str) -> sql.Identifier:
+    if name not in IDENTIFIERS:
+        raise ValueError("'{}' isn't an allowed table or column name".format(name))
+    return sql.Identifier(name)
+
+
+def where(clauses: List[sql.Composable]) -> sql.Composable:
+    """
+    AND together a list of SQL conditions (True if there aren't any).
+    """
+    if not clauses:
+        return sql.SQL("True")
+    return sql.SQL(" AND ").join(sql.SQL("({})").format(c) for c in clauses)
+
+
+def as_text(query) -> str:
+    """
+    Render a query to SQL text without needing a connection (used for cache keys, tracing and statement names).
+    Placeholders are left as `%(name)s`.
+    """
+    if isinstance(query, str):
+        return query
+    if isinstance(query, sql.Composed):
+        return "".join(as_text(part) for part in query.seq)
+    if isinstance(query, sql.SQL):
+        return query.string
+    if isinstance(query, sql.Identifier):
+        return ".".join('"' + s.replace('"', '""') + '"' for s in query.strings)
+    if isinstance(query, sql.Placeholder):
+        return "%({})s".format(query.name) if query.name else "%s"
+    raise TypeError("Can't render {!r} without a connection - pass it as a parameter instead".format(query))
+
+
+def to_positional(text: str):
+    """
+    Turn `%(name)s` placeholders into Postgres' `$1` style, as PREPARE needs.
+    :return: the converted SQL and the parameter names in $n order
+    """
+    names = []
+
+    def _replace(match):
+        name = match.group(1)
+        if name is None:
+            return '%'
+        if name not in names:
+            names.append(name)
+        return '${}'.format(names.index(name) + 1)
+    return _param_pattern.sub(_replace, text), names
+
+
+class PreparingConnection(psycopg2.extensions.connection):
+    """
+    A connection that remembers which statements have been prepared on it (prepared statements last as long as the
+    session does).
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.prepared = set()
+
+
+def execute(cursor, query, params: Dict = None, prepare: bool = False, comment: str = "") -> None:
+    """
+    Execute a query on a cursor. With `prepare`, the statement is PREPAREd the first time this connection sees it and
+    EXECUTEd after that.
+    :param comment: SQL comment to send in front of the statement (see `profiling.sql_comment`); it can't contain `%`
+    """
+    text = as_text(query)
+    params = params or {}
+    prepared = getattr(cursor.connection, 'prepared', None)
+    if not prepare or prepared is None:
+        if params:
+            cursor.execute(comment + text, params)
+        else:  # psycopg2 only treats % specially when there are parameters
+            cursor.execute(comment + text.replace('%%', '%'))
+        return
+    positional, names = to_positional(text)
+    name = 'dashboard_' + hashlib.md5(positional.encode('utf-8')).hexdigest()[:16]
+    if name not in prepared:
+        cursor.execute(comment + "PREPARE {} AS {}".format(name, positional))
+        prepared.add(name)
+    if names:
+        cursor.execute(comment + "EXECUTE {} ({})".format(name, ", ".join(["%s"] * len(names))),
+                       [params[n] for n in names])
+    else:
+        cursor.execute(comment + "EXECUTE {}".format(name))
@@ -0,0 +1,280 @@
+"""
+Relate the alert articles (alerts database) to the stories they became (processor database), by URL. The two are
+separate Postgres databases, so they can't be joined in SQL.
+
+Both sides get a URL index: `story_url_keys` in the processor database and `article_url_keys` in the alerts database,
+keyed by (project_id, url_key), where url_key is a fixed-width hash of the canonical URL (see dashboard.database.urls).
+Matching is a merge join in sorted batches: one side is streamed in (project_id, url_key) order through a server-side
+cursor, the matching keys are looked up on the other side in the same order, and the two sorted lists are walked
+together - so memory stays one batch deep however big the tables are. Each article keeps the best-scoring story it
+matched, which is what the per-day coverage counts (`alerts_db.article_coverage_by_day`) are read from.
+
+Runs are incremental: only stories and articles added since the last run (by id, from a watermark kept in each
+database) are indexed, new articles are matched against every story, and new stories against every article with their
+URL, so an article moves on to a better-scoring story that turns up later. Run it from the command line (ie. from
+cron, after the story processor) with:
+
+    python -m dashboard.database.reconcile [--full]
+"""
+import argparse
+import logging
+from collections import namedtuple
+from typing import Dict, Iterator, List, Tuple
+
+import psycopg2
+import psycopg2.extras
+
+from dashboard.database.urls import url_key
+import dashboard.database.streaming as streaming
+
+logger = logging.getLogger(__name__)
+
+BATCH_SIZE = 5000
+
+STORY_SCHEMA = '''
+    CREATE TABLE IF NOT EXISTS story_url_keys (
+        id bigint PRIMARY KEY,
+        stories_id bigint,
+        project_id integer NOT NULL,
+        url_key bigint NOT NULL,
+        model_score double precision,
+        above_threshold boolean
+    );
+    CREATE INDEX IF NOT EXISTS story_url_keys_project_key ON story_url_keys (project_id, url_key);
+    CREATE TABLE IF NOT EXISTS story_url_key_state (
+        id integer PRIMARY KEY DEFAULT 1 CHECK (id = 1),
+        watermark bigint NOT NULL
+    );
+'''
+
+ARTICLE_SCHEMA = '''
+    CREATE TABLE IF NOT EXISTS article_url_keys (
+        articles_id bigint PRIMARY KEY,
+        project_id integer NOT NULL,
+        url_key bigint NOT NULL,
+        published_date timestamp,
+        stories_id bigint,
+        model_score double precision,
+        above_threshold boolean
+    );
+    CREATE INDEX IF NOT EXISTS article_url_keys_project_key ON article_url_keys (project_id, url_key);
+    CREATE INDEX IF NOT EXISTS article_url_keys_project_published ON article_url_keys (project_id, published_date);
+    CREATE INDEX IF NOT EXISTS article_url_keys_unmatched ON article_url_keys (project_id, url_key)
+        WHERE stories_id IS NULL;
+    CREATE TABLE IF NOT EXISTS article_url_key_state (
+        id integer PRIMARY KEY DEFAULT 1 CHECK (id = 1),
+        watermark bigint NOT NULL
+    );
+'''
+
+# a table to index the URLs of: the query for its rows after a watermark (id first, url last), and where they go
+UrlSource = namedtuple('UrlSource', ['table', 'query', 'index_table', 'columns', 'state_table'])
+
+STORY_SOURCE = UrlSource('stories', '''
+        SELECT id, stories_id, project_id, model_score, above_threshold, url FROM stories
+        WHERE id > %(watermark)s AND project_id IS NOT NULL ORDER BY id LIMIT %(batch_size)s
+    ''', 'story_url_keys', ['id', 'stories_id', 'project_id', 'model_score', 'above_threshold', 'url_key'],
+    'story_url_key_state')
+ARTICLE_SOURCE = UrlSource('articles', '''
+        SELECT id, project_id, published_date, url FROM articles
+        WHERE id > %(watermark)s AND project_id IS NOT NULL ORDER BY id LIMIT %(batch_size)s
+    ''', 'article_url_keys', ['articles_id', 'project_id', 'published_date', 'url_key'], 'article_url_key_state')
+
+# the other side of a merge, for a batch of (project_id, url_key) keys, in the same order
+STORY_LOOKUP = '''
+    SELECT s.project_id, s.url_key, s.stories_id, s.model_score, s.above_threshold
+    FROM unnest(%(projects)s::integer[], %(url_keys)s::bigint[]) AS k(project_id, url_key)
+    JOIN story_url_keys s ON s.project_id = k.project_id AND s.url_key = k.url_key
+    ORDER BY 1, 2
+'''
+# every article with the key, matched or not: `_save_matches` decides whether a new story is a better match
+ARTICLE_LOOKUP = '''
+    SELECT a.project_id, a.url_key, a.articles_id
+    FROM unnest(%(projects)s::integer[], %(url_keys)s::bigint[]) AS k(project_id, url_key)
+    JOIN article_url_keys a ON a.project_id = k.project_id AND a.url_key = k.url_key
+    ORDER BY 1, 2
+'''
+
+
+def create_schema(processor_conn, alerts_conn) -> None:
+    for conn, schema in [(processor_conn, STORY_SCHEMA), (alerts_conn, ARTICLE_SCHEMA)]:
+        with conn.cursor() as cursor:
+            cursor.execute(schema)
+        conn.commit()
+
+
+def merge_join(left: List[tuple], right: List[tuple]) -> Iterator[Tuple[tuple, List[tuple]]]:
+    """
+    Walk two batches of rows, both sorted by their (project_id, url_key) first two values, side by side.
+    :return: each left row with the right rows that have the same key (an empty list if none do)
+    """
+    start = 0
+    for row in left:
+        key = row[:2]
+        while start < len(right) and right[start][:2] < key:
+            start += 1
+        end = start
+        while end < len(right) and right[end][:2] == key:
+            end += 1
+        yield row, right[start:end]  # (start stays put, in case the next left row has the same key)
+
+
+def _watermark(cursor, state_table: str) -> int:
+    cursor.execute("select watermark from {} where id=1".format(state_table))
+    row = cursor.fetchone()
+    return row[0] if row else 0
+
+
+def _set_watermark(cursor, state_table: str, watermark: int) -> None:
+    cursor.execute('''
+        INSERT INTO {} (id, watermark) VALUES (1, %(watermark)s)
+        ON CONFLICT (id) DO UPDATE SET watermark = EXCLUDED.watermark
+    '''.format(state_table), dict(watermark=watermark))
+
+
+def index_new(conn, source: UrlSource, batch_size: int = BATCH_SIZE) -> Tuple[int, int]:
+    """
+    Add the url_key of every row added to a source table since the last run to its index table, a batch (and a
+    transaction) at a time. Rows without a URL are skipped.
+    :return: the watermark before and after
+    """
+    with conn.cursor() as cursor:
+        start = watermark = _watermark(cursor, source.state_table)
+        while True:
+            cursor.execute(source.query, dict(watermark=watermark, batch_size=batch_size))
+            rows = cursor.fetchall()
+            if not rows:
+                break
+            keyed = [row[:-1] + (url_key(row[-1]),) for row in rows]
+            psycopg2.extras.execute_values(cursor, "INSERT INTO {} ({}) VALUES %s ON CONFLICT DO NOTHING".format(
+                source.index_table, ", ".join(source.columns)), [row for row in keyed if row[-1] is not None])
+            watermark = rows[-1][0]
+            _set_watermark(cursor, source.state_table, watermark)
+            conn.commit()
+        logger.info("Indexed {} URLs up to id {}".format(source.table, watermark))
+    conn.commit()
+    return start, watermark
+
+
+def _best_story(matches: List[tuple]):
+    # (project_id, url_key, stories_id, model_score, above_threshold) rows; the highest scoring story wins
+    return max(matches, key=lambda m: (m[3] is not None, m[3] or 0, m[2]))
+
+
+def _lookup(conn, query: str, keys: List[tuple]) -> List[tuple]:
+    projects, url_keys = zip(*keys) if keys else ((), ())
+    with conn.cursor() as cursor:
+        cursor.execute(query, dict(projects=list(projects), url_keys=list(url_keys)))
+        return cursor.fetchall()
+
+
+def _save_matches(alerts_conn, matched: List[tuple]) -> int:
+    """
+    Record each article's story, unless it already has one that scores at least as high.
+    :param matched: (articles_id, stories_id, model_score, above_threshold) tuples
+    :return: how many articles were updated
+    """
+    if not matched:
+        return 0
+    with alerts_conn.cursor() as cursor:
+        updated = psycopg2.extras.execute_values(cursor, '''
+            UPDATE article_url_keys a SET stories_id = m.stories_id, model_score = m.model_score,
+                                          above_threshold = m.above_threshold
+            FROM (VALUES %s) AS m(articles_id, stories_id, model_score, above_threshold)
+            WHERE a.articles_id = m.articles_id
+              AND (a.stories_id IS NULL OR a.model_score IS NULL OR a.model_score < m.model_score)
+            RETURNING a.articles_id
+        ''', matched, template="(%s::bigint, %s::bigint, %s::double precision, %s::boolean)", fetch=True)
+    return len(updated)
+
+
+def match_new_articles(processor_conn, alerts_conn, after: int, batch_size: int = BATCH_SIZE) -> int:
+    """
+    Match the articles indexed after id `after` against every story.
+    :return: how many of them got a story
+    """
+    query = '''
+        SELECT project_id, url_key, articles_id FROM article_url_keys
+        WHERE articles_id > %(after)s ORDER BY project_id, url_key
+    '''
+    # the stream holds a transaction open on the alerts connection, so updates go in with it and commit at the end
+    total = 0
+    for batch in streaming.iter_batches(alerts_conn, query, dict(after=after), batch_size):
+        stories = _lookup(processor_conn, STORY_LOOKUP, sorted({row[:2] for row in batch}))
+        matched = [(article[2], *_best_story(matches)[2:]) for article, matches in merge_join(batch, stories)
+                   if matches]
+        total += _save_matches(alerts_conn, matched)
+    alerts_conn.commit()
+    processor_conn.commit()  # just reads, but don't leave it idle in a transaction
+    return total
+
+
+def match_new_stories(processor_conn, alerts_conn, after: int, batch_size: int = BATCH_SIZE) -> int:
+    """
+    Match the stories indexed after id `after` against every article with the same URL key: unmatched articles get
+    one, and matched ones move to a new story that scores higher (including one from a later batch of this run).
+    :return: how many articles got a new or better story
+    """
+    query = '''
+        SELECT project_id, url_key, stories_id, model_score, above_threshold FROM story_url_keys
+        WHERE id > %(after)s ORDER BY project_id, url_key
+    '''
+    total = 0
+    for batch in streaming.iter_batches(processor_conn, query, dict(after=after), batch_size):
+        articles = _lookup(alerts_conn, ARTICLE_LOOKUP, sorted({row[:2] for row in batch}))
+        # articles on the left this time, so each gets the best of the new stories with its URL
+        best = {}
+        for article, matches in merge_join(articles, batch):
+            if matches:
+                best[article[2]] = _best_story(matches)
+        total += _save_matches(alerts_conn, [(articles_id, *story[2:]) for articles_id, story in best.items()])
+    alerts_conn.commit()
+    processor_conn.commit()
+    return total
+
+
+def refresh(processor_conn, alerts_conn, full: bool = False, batch_size: int = BATCH_SIZE) -> Dict:
+    """
+    Index the stories and articles added since the last run and match them up.
+    :param processor_conn: a psycopg2 connection to the processor database
+    :param alerts_conn: a psycopg2 connection to the alerts database
+    :param full: throw away both indexes and start again
+    :param batch_size: rows per batch when indexing and merging
+    :return: summary of what was done
+    """
+    create_schema(processor_conn, alerts_conn)
+    if full:
+        for conn, tables in [(processor_conn, "story_url_keys, story_url_key_state"),
+                             (alerts_conn, "article_url_keys, article_url_key_state")]:
+            with conn.cursor() as cursor:
+                cursor.execute("TRUNCATE " + tables)
+            conn.commit()
+    stories_before, stories_after = index_new(processor_conn, STORY_SOURCE, batch_size)
+    articles_before, articles_after = index_new(alerts_conn, ARTICLE_SOURCE, batch_size)
+    matched_articles = match_new_articles(processor_conn, alerts_conn, articles_before, batch_size)
+    # the new articles have just been matched against every story, new ones included, so after a full rebuild (when
+    # every article is new) there's nothing left for the new stories to match
+    matched_by_stories = 0 if full else match_new_stories(processor_conn, alerts_conn, stories_before, batch_size)
+    summary = dict(stories_watermark=stories_after, articles_watermark=articles_after,
+                   new_articles_matched=matched_articles, older_articles_matched=matched_by_stories)
+    logger.info("Reconciled: {}".format(summary))
+    return summary
+
+
+def main():
+    from dashboard import settings
+    parser = argparse.ArgumentParser(description="Match alert articles to processor stories by URL")
+    parser.add_argument('--full', action='store_true', help="rebuild both URL indexes instead of adding new rows")
+    parser.add_argument('--batch-size', type=int, default=BATCH_SIZE)
+    args = parser.parse_args()
+    processor_conn = psycopg2.connect(settings.PROCESSOR_DB_URI)
+    alerts_conn = psycopg2.connect(settings.ALERTS_DB_URI)
+    try:
+        refresh(processor_conn, alerts_conn, full=args.full, batch_size=args.batch_size)
+    finally:
+        processor_conn.close()
+        alerts_conn.close()
+
+
+if __name__ == '__main__':
+    main()
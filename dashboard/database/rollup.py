@@ -0,0 +1,142 @@
+"""
+Daily rollup of story counts, so the history charts read a row per day instead of counting raw `stories` rows.
+
+The `story_daily_counts` table is keyed by (date_kind, day, project_id, source, above_threshold, is_posted), with a
+unique index on the key so a day can't be counted twice. It is refreshed incrementally: we only recompute the days
+touched by stories processed or posted since the last watermark. Refreshes take an advisory lock, so one started while
+another is still running (ie. a slow `--full` when cron fires again) waits for it and then picks up from its watermark.
+Run it from the command line (ie. from cron) with:
+
+    python -m dashboard.database.rollup [--full]
+"""
+import argparse
+import datetime as dt
+import logging
+from typing import Dict
+
+import psycopg2
+from psycopg2 import sql
+
+logger = logging.getLogger(__name__)
+
+# date_kind -> column on the stories table it is based on
+DATE_KINDS = {
+    'published': 'published_date',
+    'processed': 'processed_date',
+    'posted': 'posted_date',
+}
+
+# recompute a little before the watermark too, to catch rows committed late with an earlier timestamp
+DEFAULT_OVERLAP = dt.timedelta(hours=1)
+# pg_advisory_xact_lock key held while refreshing ("rollup" in ASCII)
+LOCK_KEY = 0x726f6c6c7570
+
+SCHEMA = '''
+    CREATE TABLE IF NOT EXISTS story_daily_counts (
+        date_kind text NOT NULL,
+        day date NOT NULL,
+        project_id integer,
+        source text,
+        above_threshold boolean,
+        is_posted boolean NOT NULL,
+        stories bigint NOT NULL
+    );
+    -- the nullable key columns are coalesced, as NULLs never clash in a unique index (before Postgres 15)
+    CREATE UNIQUE INDEX IF NOT EXISTS story_daily_counts_key ON story_daily_counts (date_kind, day,
+        coalesce(project_id, -1), coalesce(source, ''), coalesce(above_threshold::int, -1), is_posted);
+    CREATE INDEX IF NOT EXISTS story_daily_counts_kind_day ON story_daily_counts (date_kind, day);
+    CREATE INDEX IF NOT EXISTS story_daily_counts_kind_project_day ON story_daily_counts (date_kind, project_id, day);
+    CREATE TABLE IF NOT EXISTS story_rollup_state (
+        id integer PRIMARY KEY DEFAULT 1 CHECK (id = 1),
+        watermark timestamp NOT NULL
+    );
+'''
+
+
+def create_schema(conn) -> None:
+    with conn.cursor() as cursor:
+        cursor.execute(SCHEMA)
+    conn.commit()
+
+
+def _watermark(cursor):
+    cursor.execute("select watermark from story_rollup_state where id=1")
+    row = cursor.fetchone()
+    return row[0] if row else None
+
+
+def refresh(conn, full: bool = False, overlap: dt.timedelta = DEFAULT_OVERLAP) -> Dict:
+    """
+    Recompute the rollup rows for every (date_kind, day) touched since the last watermark, in one transaction.
+    :param conn: a psycopg2 connection to the processor database
+    :param full: ignore the watermark and rebuild every day
+    :param overlap: how far before the watermark to look for touched stories
+    :return: summary of what was refreshed
+    """
+    create_schema(conn)
+    with conn.cursor() as cursor:
+        # held until the commit, and taken before reading the watermark so a waiting refresh starts from the new one
+        cursor.execute("select pg_advisory_xact_lock(%(key)s)", dict(key=LOCK_KEY))
+        watermark = None if full else _watermark(cursor)
+        since = dt.datetime.min if watermark is None else watermark - overlap
+        # find the newest change first, so anything that lands while we work is picked up next run
+        cursor.execute("select greatest(max(processed_date), max(posted_date)) from stories")
+        new_watermark = cursor.fetchone()[0]
+        if new_watermark is None:
+            conn.commit()
+            return dict(days=0, rows=0, watermark=watermark)
+        cursor.execute('''
+            CREATE TEMP TABLE touched_days ON COMMIT DROP AS
+            SELECT DISTINCT k.date_kind, k.day
+            FROM stories s
+            CROSS JOIN LATERAL (VALUES ('published', s.published_date::date),
+                                      ('processed', s.processed_date::date),
+                                      ('posted', s.posted_date::date)) AS k(date_kind, day)
+            WHERE (s.processed_date > %(since)s OR s.posted_date > %(since)s) AND k.day IS NOT NULL
+        ''', dict(since=since))
+        if full:
+            cursor.execute("TRUNCATE story_daily_counts")
+        cursor.execute("select count(1) from touched_days")
+        touched_count = cursor.fetchone()[0]
+        cursor.execute('''
+            DELETE FROM story_daily_counts c USING touched_days t
+            WHERE c.date_kind = t.date_kind AND c.day = t.day
+        ''')
+        inserted = 0
+        for date_kind, column_name in DATE_KINDS.items():
+            # range join on the raw column so an index on it can be used, instead of casting every row
+            cursor.execute(sql.SQL('''
+                INSERT INTO story_daily_counts
+                    (date_kind, day, project_id, source, above_threshold, is_posted, stories)
+                SELECT t.date_kind, t.day, s.project_id, s.source, s.above_threshold, s.posted_date IS NOT NULL,
+                       count(1)
+                FROM touched_days t
+                JOIN stories s ON s.{col} >= t.day AND s.{col} < t.day + 1
+                WHERE t.date_kind = %(date_kind)s
+                GROUP BY 1, 2, 3, 4, 5, 6
+            ''').format(col=sql.Identifier(column_name)), dict(date_kind=date_kind))
+            inserted += cursor.rowcount
+        cursor.execute('''
+            INSERT INTO story_rollup_state (id, watermark) VALUES (1, %(watermark)s)
+            ON CONFLICT (id) DO UPDATE SET watermark = EXCLUDED.watermark
+        ''', dict(watermark=new_watermark))
+    conn.commit()
+    logger.info("Refreshed story rollup: {} days, {} rows, watermark {}".format(touched_count, inserted,
+                                                                                new_watermark))
+    return dict(days=touched_count, rows=inserted, watermark=new_watermark)
+
+
+def main():
+    from dashboard import settings
+    parser = argparse.ArgumentParser(description="Refresh the daily story count rollup in the processor database")
+    parser.add_argument('--full', action='store_true', help="rebuild every day instead of just the touched ones")
+    args = parser.parse_args()
+    conn = psycopg2.connect(settings.PROCESSOR_DB_URI)
+    try:
+        refresh(conn, full=args.full)
+    finally:
+        conn.close()
+
+
+if __name__ == '__main__':
+    main()
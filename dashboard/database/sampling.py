@@ -0,0 +1,70 @@
+"""
+Ways to pick a handful of example rows for the UI. `ORDER BY RANDOM()` has to sort every matching row, so the other
+modes walk an index on the date column instead and cost the same however many rows match.
+"""
+import datetime as dt
+import random
+from typing import Dict, Tuple
+
+from psycopg2 import sql
+
+from dashboard.database.query import identifier
+
+SAMPLE_RANDOM = 'random'  # uniformly random, but sorts every matching row
+SAMPLE_RECENT = 'recent'  # the newest rows
+SAMPLE_PROBE = 'probe'  # the rows right after a random point in the date range
+SAMPLE_MODES = [SAMPLE_RANDOM, SAMPLE_RECENT, SAMPLE_PROBE]
+
+
+def probe_point(earliest: dt.datetime, latest: dt.datetime, seed=None) -> dt.datetime:
+    """
+    Pick a point in the date range to start reading from. The same seed picks the same point, so a sample doesn't
+    change on every Streamlit rerun.
+    """
+    fraction = random.Random(seed).random()
+    return earliest + (latest - earliest) * fraction
+
+
+def sample_sql(table: str, filters: sql.Composable, params: Dict, date_column: str, earliest_date: dt.date,
+               limit: int, mode: str, seed=None) -> Tuple[sql.Composable, Dict]:
+    """
+    :param table: table to sample from
+    :param filters: SQL conditions that rows have to match
+    :param params: values for any placeholders in `filters`
+    :param date_column: indexed date column the sample is drawn along
+    :param earliest_date: only rows from this date onward
+    :param limit: how many rows to return
+    :param mode: one of SAMPLE_MODES
+    :param seed: makes SAMPLE_RANDOM and SAMPLE_PROBE repeatable
+    :return: the query and its parameters
+    """
+    params = dict(params, earliest_date=earliest_date, limit=limit)
+    parts = dict(table=identifier(table), col=identifier(date_column),
+                 where=sql.SQL("{} AND {} >= %(earliest_date)s::DATE").format(filters, identifier(date_column)))
+    if mode == SAMPLE_RECENT:
+        query = sql.SQL("SELECT * FROM {table} WHERE {where} ORDER BY {col} DESC LIMIT %(limit)s").format(**parts)
+        return query, params
+    if mode == SAMPLE_PROBE:
+        # range ends at midnight tonight (not now) so the same seed gives the same parameters, and cache hits, all day
+        earliest = dt.datetime.combine(earliest_date, dt.time())
+        latest = dt.datetime.combine(dt.date.today() + dt.timedelta(days=1), dt.time())
+        params['probe'] = probe_point(earliest, latest, seed)
+        # read forward from the probe point, wrapping around to the start of the range if we run off the end;
+        # the second branch only runs when the first comes up short
+        query = sql.SQL('''
+            (SELECT * FROM {table} WHERE {where} AND {col} >= %(probe)s ORDER BY {col} LIMIT %(limit)s)
+            UNION ALL
+            (SELECT * FROM {table} WHERE {where} AND {col} < %(probe)s ORDER BY {col} LIMIT %(limit)s)
+            LIMIT %(limit)s
+        ''').format(**parts)
+        return query, params
+    if mode == SAMPLE_RANDOM:
+        if seed is None:
+            order = sql.SQL("RANDOM()")
+        else:
+            order = sql.SQL("md5(ctid::text || %(seed)s)")
+            params['seed'] = str(seed)
+        query = sql.SQL("SELECT * FROM {table} WHERE {where} ORDER BY {order} LIMIT %(limit)s").format(order=order,
+                                                                                                       **parts)
+        return query, params
+    raise ValueError("Unknown sample mode '{}' (expected one of {})".format(mode, SAMPLE_MODES))
@@ -0,0 +1,194 @@
+"""
+Indexes backing the dashboard's query patterns, and a check that the queries actually use them.
+
+    python -m dashboard.database.schema migrate [--dry-run]   # create any missing indexes (CONCURRENTLY)
+    python -m dashboard.database.schema explain --project-id 1  # EXPLAIN (ANALYZE, BUFFERS) every dashboard query
+
+Every processor query filters on some mix of project_id, source, above_threshold and one of the date columns, and every
+alerts query on project_id plus a date column, so the indexes lead with project_id (or the date, for the all-projects
+charts on the home page).
+"""
+import argparse
+import json
+import logging
+from collections import namedtuple
+from typing import Dict, List
+
+from dashboard.database.query import execute
+
+logger = logging.getLogger(__name__)
+
+Index = namedtuple('Index', ['name', 'table', 'columns', 'where'])
+
+PROCESSOR_INDEXES = [
+    # per-project history charts, the random/recent story samples and (with stories_id as a tie-breaker) the sort
+    # key of the paginated story browser, so each page is a short index range scan
+    Index('stories_project_processed_story', 'stories', 'project_id, processed_date, stories_id', None),
+    Index('stories_project_published', 'stories', 'project_id, published_date', None),
+    # posted-day chart and the posted counter only care about stories above threshold
+    Index('stories_project_posted_above', 'stories', 'project_id, posted_date', 'above_threshold'),
+    Index('stories_project_processed_above', 'stories', 'project_id, processed_date', 'above_threshold'),
+    # "unposted above threshold" should stay (close to) empty, so a partial index on it is tiny
+    Index('stories_project_unposted_above', 'stories', 'project_id, processed_date',
+          'above_threshold AND posted_date IS NULL'),
+    # all-projects charts on the home page group by day and source
+    Index('stories_processed_source', 'stories', 'processed_date, source', None),
+    Index('stories_published_source', 'stories', 'published_date, source', None),
+    # score histogram and threshold counters can be answered from the index alone
+    Index('stories_project_score', 'stories', 'project_id, model_score, above_threshold, posted_date', None),
+]
+
+ALERTS_INDEXES = [
+    Index('articles_project_published', 'articles', 'project_id, published_date', None),
+    Index('articles_project_publish', 'articles', 'project_id, publish_date', None),
+]
+
+
+def index_ddl(index: Index) -> str:
+    ddl = "CREATE INDEX CONCURRENTLY IF NOT EXISTS {} ON {} ({})".format(index.name, index.table, index.columns)
+    if index.where:
+        ddl += " WHERE {}".format(index.where)
+    return ddl
+
+
+def migrate(conn, indexes: List[Index], dry_run: bool = False) -> None:
+    """
+    Create any missing indexes. CONCURRENTLY means writers aren't blocked, but it can't run inside a transaction.
+    """
+    if dry_run:
+        for index in indexes:
+            print(index_ddl(index) + ";")
+        return
+    conn.autocommit = True
+    with conn.cursor() as cursor:
+        for index in indexes:
+            logger.info("Creating index {} (if missing)".format(index.name))
+            cursor.execute(index_ddl(index))
+            cursor.execute("ANALYZE {}".format(index.table))
+
+
+def dashboard_queries(project_id: int) -> List:
+    """
+    Run the same database calls the dashboard pages make, and return the (database, query, params) sent for each
+    distinct query.
+    """
+    import dashboard.database.processor_db as processor_db
+    import dashboard.database.alerts_db as alerts_db
+    from dashboard.database.cache import query_cache
+    import dashboard.database.tracing as tracing
+    calls = [
+        lambda: processor_db.story_counts_by_day('processed_date'),
+        lambda: processor_db.story_counts_by_day('published_date', limit=30),
+        lambda: processor_db.story_counts_by_day('processed_date', project_id),
+        lambda: processor_db.story_counts_by_day('published_date', project_id, limit=30),
+        lambda: processor_db.stories_by_posted_day(project_id=project_id),
+        lambda: processor_db.stories_by_processed_day(project_id=project_id),
+        lambda: processor_db.stories_by_published_day(project_id=project_id),
+        lambda: processor_db.project_summary(project_id),
+        lambda: processor_db.score_distribution(project_id),
+        lambda: processor_db.score_distribution(project_id, by='source'),
+        lambda: processor_db.unposted_above_story_count(project_id),
+        lambda: processor_db.posted_above_story_count(project_id),
+        lambda: processor_db.below_story_count(project_id),
+        lambda: processor_db.unposted_stories(project_id, 30),
+        lambda: processor_db.recent_stories(project_id, True),
+        lambda: processor_db.recent_stories(project_id, False),
+        # the story browser's keyset pages: the first, the next and a filtered one (see stories_project_processed_story)
+        lambda: processor_db.story_page(project_id),
+        lambda: processor_db.story_page(project_id, after=processor_db.story_page(project_id)[1]),
+        lambda: processor_db.story_page(project_id, source='media-cloud', above_threshold=True, min_score=0.5,
+                                        max_score=0.9),
+        lambda: alerts_db.recent_articles(project_id),
+        lambda: alerts_db.articles_by_published_day(project_id),
+        lambda: alerts_db.grouped_articles(project_id),
+        lambda: alerts_db.grouped_articles(),
+        # one group's articles, as opened from the first page of the listing (looked up through article_signatures)
+        lambda: [alerts_db.group_articles(g['cluster_id']) for g in alerts_db.grouped_articles(project_id)[0][:1]],
+        lambda: alerts_db.article_coverage_by_day(project_id),
+    ]
+    query_cache.clear()  # so every call really goes to the database
+    with tracing.recording() as queries:
+        for call in calls:
+            call()
+    distinct = {}
+    for database, query, params in queries:
+        distinct.setdefault((database, query), params)
+    return [(database, query, params) for (database, query), params in distinct.items()]
+
+
+def _plan_nodes(plan: Dict):
+    yield plan
+    for child in plan.get('Plans', []):
+        yield from _plan_nodes(child)
+
+
+def explain(conn, query: str, params: Dict = None) -> Dict:
+    """
+    EXPLAIN (ANALYZE, BUFFERS) one query, and pull out the bits we care about.
+    :return: dict with `time` (ms), `planning_time` (ms), `shared_read` blocks, `seq_scans` (relations scanned
+             sequentially) and the full `plan`
+    """
+    with conn.cursor() as cursor:
+        execute(cursor, "EXPLAIN (ANALYZE, BUFFERS, FORMAT JSON) " + query, params)
+        result = cursor.fetchone()[0]
+    conn.rollback()
+    explained = result[0] if isinstance(result, list) else json.loads(result)[0]
+    nodes = list(_plan_nodes(explained['Plan']))
+    return dict(
+        time=explained['Execution Time'],
+        planning_time=explained['Planning Time'],
+        shared_read=explained['Plan'].get('Shared Read Blocks', 0),
+        seq_scans=sorted({n['Relation Name'] for n in nodes if n['Node Type'] == 'Seq Scan'}),
+        plan=explained,
+    )
+
+
+def explain_report(project_id: int, slowest: int = 5) -> List[Dict]:
+    import dashboard.database.processor_db as processor_db
+    import dashboard.database.alerts_db as alerts_db
+    pools = dict(processor=processor_db.db_pool(), alerts=alerts_db.db_pool())
+    report = []
+    for database, query, params in dashboard_queries(project_id):
+        with pools[database].connection() as conn:
+            info = explain(conn, query, params)
+        info.update(database=database, query=" ".join(query.split()))
+        report.append(info)
+    report.sort(key=lambda r: r['time'], reverse=True)
+    for r in report:
+        flag = "SEQ SCAN on " + ", ".join(r['seq_scans']) if r['seq_scans'] else "no seq scans"
+        print("{:>10.1f}ms  plan {:>6.1f}ms  read {:>7} blocks  {:<9}  {}".format(
+            r['time'], r['planning_time'], r['shared_read'], r['database'], flag))
+        print("    " + r['query'][:200])
+    seq = [r for r in report if r['seq_scans']]
+    print("\n{} of {} queries use a sequential scan".format(len(seq), len(report)))
+    for r in report[:slowest]:
+        print("\n--- {:.1f}ms: {}".format(r['time'], r['query'][:200]))
+        print(json.dumps(r['plan']['Plan'], indent=2, default=str)[:4000])
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Dashboard index migrations and query plan checks")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    migrate_parser = subparsers.add_parser('migrate', help="create any missing indexes on both databases")
+    migrate_parser.add_argument('--dry-run', action='store_true', help="just print the DDL")
+    explain_parser = subparsers.add_parser('explain', help="EXPLAIN (ANALYZE, BUFFERS) every dashboard query")
+    explain_parser.add_argument('--project-id', type=int, required=True)
+    explain_parser.add_argument('--slowest', type=int, default=5, help="print full plans for this many queries")
+    args = parser.parse_args()
+    if args.command == 'migrate':
+        import psycopg2
+        from dashboard import settings
+        for uri, indexes in [(settings.PROCESSOR_DB_URI, PROCESSOR_INDEXES), (settings.ALERTS_DB_URI, ALERTS_INDEXES)]:
+            conn = None if args.dry_run else psycopg2.connect(uri)
+            try:
+                migrate(conn, indexes, dry_run=args.dry_run)
+            finally:
+                if conn is not None:
+                    conn.close()
+    else:
+        explain_report(args.project_id, args.slowest)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,297 @@
+"""
+Query results shared by every dashboard process on a host, so running more Streamlit workers doesn't multiply the load
+on the databases. It sits behind the in-memory `query_cache`: on a miss there, chart data and counter results (the
+SHARED_FAMILIES) are looked up in SHARED_CACHE_DIR before going to the database.
+
+Entries are Arrow IPC files, memory-mapped when read, named by a hash of the query, its parameters and the time bucket
+it was computed in (the family's TTL, counted from the epoch). Every worker agrees on the bucket, so an entry is
+computed at most once per bucket: the first worker to miss takes an exclusive lock on the key, and the others wait for
+its file instead of running the same query. Clearing the cache also starts a new generation, which every worker's
+in-memory `query_cache` checks for, so a "Refresh now" on one worker drops the results all of them keep. A prewarm job
+fills the current bucket for every project ahead of any visitor, and clears out old entries:
+
+    python -m dashboard.database.shared_cache prewarm
+    python -m dashboard.database.shared_cache prune
+"""
+import argparse
+import errno
+import hashlib
+import logging
+import os
+import threading
+import time
+from typing import Callable, Dict, List, Optional, Tuple
+
+from dashboard import settings
+
+logger = logging.getLogger(__name__)
+
+# query families (see dashboard.database.cache) whose results are shared: the chart data and the counters
+SHARED_FAMILIES = {'history', 'count'}
+
+LOCK_POLL = 0.05  # seconds between attempts to take a key's lock
+PRUNE_EVERY = 60  # seconds between clean-ups of old entries, per process
+ENTRY_SUFFIX = '.arrow'
+LOCK_SUFFIX = '.lock'
+GENERATION_FILE = 'generation'  # replaced on every clear, so its identity changes
+
+
+COLUMNS_LAYOUT = b'columns'
+
+
+def to_arrow(results) -> bytes:
+    """
+    :param results: a list of row dicts, or a dict of parallel column lists
+    :return: the results as an Arrow IPC file, a column per key
+    """
+    import pyarrow as pa  # only needed with a shared cache, so only imported then
+    if isinstance(results, dict):
+        table = pa.table(results).replace_schema_metadata({b'layout': COLUMNS_LAYOUT})
+    else:
+        table = pa.Table.from_pylist([dict(row) for row in results])
+    sink = pa.BufferOutputStream()
+    with pa.ipc.new_file(sink, table.schema) as writer:
+        writer.write_table(table)
+    return sink.getvalue().to_pybytes()
+
+
+def from_arrow(path: str):
+    """
+    :return: the results, in the same layout they were saved in
+    """
+    import pyarrow as pa
+    with pa.memory_map(path) as source:
+        table = pa.ipc.open_file(source).read_all()
+    if (table.schema.metadata or {}).get(b'layout') == COLUMNS_LAYOUT:
+        return table.to_pydict()
+    return table.to_pylist()
+
+
+class SharedCache:
+
+    def __init__(self, directory: str, lock_timeout: float = 60):
+        """
+        :param directory: where to keep the entries; every process sharing it has to be on the same host
+        :param lock_timeout: seconds to wait for another process computing the same entry before computing it anyway
+        """
+        self.directory = directory
+        self.lock_timeout = lock_timeout
+        os.makedirs(directory, exist_ok=True)
+        self._last_prune = 0
+        self._stats_lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.waits = 0
+
+    def _path(self, key: str, bucket: int) -> str:
+        # with the generation in the name, a result still being computed when the cache is cleared is never read
+        name = hashlib.sha1("{}\n{}\n{}".format(self.generation(), bucket, key).encode('utf-8')).hexdigest()
+        return os.path.join(self.directory, name)
+
+    def generation(self) -> str:
+        """
+        Identifies the last `clear()`, by any process: changes every time the cache is cleared. A stat, no reads, so it
+        is cheap enough to check on every lookup.
+        """
+        try:
+            stat = os.stat(os.path.join(self.directory, GENERATION_FILE))
+        except FileNotFoundError:
+            return ''
+        return "{}-{}".format(stat.st_ino, stat.st_mtime_ns)
+
+    def _count(self, stat: str) -> None:
+        with self._stats_lock:
+            setattr(self, stat, getattr(self, stat) + 1)
+
+    def _read(self, path: str):
+        try:
+            return from_arrow(path + ENTRY_SUFFIX)
+        except FileNotFoundError:
+            return None
+
+    def _write(self, path: str, results) -> None:
+        try:
+            data = to_arrow(results)
+        except Exception as e:  # ie. a column of mixed types; the result is still good, it just isn't shared
+            logger.warning("Can't share query results: {}".format(e))
+            return
+        tmp_path = "{}.{}.tmp".format(path, os.getpid())
+        with open(tmp_path, 'wb') as f:
+            f.write(data)
+        os.replace(tmp_path, path + ENTRY_SUFFIX)
+
+    def _lock(self, path: str):
+        """
+        Take the key's lock, waiting for whoever holds it (up to `lock_timeout`).
+        :return: the open lock file (close it to release the lock), or None if we gave up waiting
+        """
+        import fcntl
+        lock_file = open(path + LOCK_SUFFIX, 'a')
+        deadline = time.monotonic() + self.lock_timeout
+        while True:
+            try:
+                fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                return lock_file
+            except OSError as e:
+                if e.errno not in (errno.EAGAIN, errno.EACCES):
+                    raise
+            if time.monotonic() > deadline:
+                lock_file.close()
+                return None
+            time.sleep(LOCK_POLL)
+
+    def get_or_run(self, key: str, ttl: float, run: Callable) -> Tuple[object, float]:
+        """
+        Return this bucket's results for the key, or call `run()` (in one process at a time) and share what it returns.
+        :param key: identifies the query and its parameters
+        :param ttl: length of the time buckets, in seconds
+        :param run: does the actual work on a miss, returning a list of row dicts or a dict of column lists
+        :return: the results, and how many seconds are left until the bucket ends
+        """
+        now = time.time()
+        bucket = int(now // ttl)
+        expires_in = (bucket + 1) * ttl - now
+        path = self._path(key, bucket)
+        results = self._read(path)
+        if results is not None:
+            self._count('hits')
+            return results, expires_in
+        lock_file = self._lock(path)
+        try:
+            results = self._read(path)  # whoever held the lock has probably just written it
+            if results is not None:
+                self._count('waits')
+                return results, expires_in
+            self._count('misses')
+            results = run()
+            if lock_file is not None:
+                self._write(path, results)
+        finally:
+            if lock_file is not None:
+                lock_file.close()
+        self._prune_now_and_then()
+        return results, expires_in
+
+    def _prune_now_and_then(self) -> None:
+        if time.monotonic() - self._last_prune > PRUNE_EVERY:
+            self._last_prune = time.monotonic()
+            self.prune()
+
+    def prune(self, max_age: float = None, suffixes: Tuple[str, ...] = (ENTRY_SUFFIX, LOCK_SUFFIX, '.tmp')) -> int:
+        """
+        Delete entries (and their lock files) older than `max_age` seconds, by default twice the longest family TTL.
+        :return: how many files were deleted
+        """
+        from dashboard.database.cache import FAMILY_TTLS
+        max_age = max_age if max_age is not None else 2 * max(FAMILY_TTLS[family] for family in SHARED_FAMILIES)
+        cutoff = time.time() - max_age
+        deleted = 0
+        for entry in os.scandir(self.directory):
+            try:
+                if entry.name.endswith(suffixes) and entry.stat().st_mtime < cutoff:
+                    os.remove(entry.path)
+                    deleted += 1
+            except FileNotFoundError:  # another process pruned it first
+                pass
+        return deleted
+
+    def clear(self) -> None:
+        """
+        Start a new generation and delete every entry, so each worker drops the results it keeps in memory and its next
+        miss goes back to the database (once, between them). Lock files are left alone, since they may be held right
+        now.
+        """
+        path = os.path.join(self.directory, GENERATION_FILE)
+        tmp_path = "{}.{}.tmp".format(path, os.getpid())
+        with open(tmp_path, 'w') as f:
+            f.write("{} {}".format(time.time_ns(), os.getpid()))
+        os.replace(tmp_path, path)  # a new inode, so the generation changes even within the mtime's resolution
+        self.prune(max_age=-1, suffixes=(ENTRY_SUFFIX,))
+
+    def stats(self) -> Dict:
+        with self._stats_lock:
+            return dict(hits=self.hits, misses=self.misses, waits=self.waits)
+
+
+_shared = None
+_shared_lock = threading.Lock()
+
+
+def shared_cache() -> Optional[SharedCache]:
+    """
+    The process' shared cache, or None if SHARED_CACHE_DIR isn't set.
+    """
+    global _shared
+    with _shared_lock:
+        if _shared is None and settings.SHARED_CACHE_DIR:
+            _shared = SharedCache(settings.SHARED_CACHE_DIR, lock_timeout=settings.DB_STATEMENT_TIMEOUT / 1000)
+        return _shared
+
+
+def page_calls(project_id: int = None) -> List[Callable]:
+    """
+    The shared queries a page makes: the home page's with no project, or a project's Statistics, Model Scores, History
+    and Coverage sections. Same arguments as the pages, so the results land on the keys they look up.
+    """
+    import dashboard.database.processor_db as processor_db
+    import dashboard.database.alerts_db as alerts_db
+    if project_id is None:
+        return [
+            lambda: processor_db.story_counts_by_day('processed_date'),
+            lambda: processor_db.story_counts_by_day('published_date', limit=30),
+            lambda: alerts_db.articles_by_published_day(),
+        ]
+    return [
+        lambda: processor_db.project_summary(project_id),
+        lambda: processor_db.score_distribution(project_id),
+        lambda: processor_db.story_counts_by_day('processed_date', project_id),
+        lambda: processor_db.story_counts_by_day('published_date', project_id, limit=30),
+        lambda: alerts_db.article_coverage_by_day(project_id),
+    ]
+
+
+def prewarm() -> Dict:
+    """
+    Fill the current bucket for the home page and every project, so visitors (on any worker) start with warm charts.
+    Run it every few minutes, just after the buckets turn over (ie. from cron on the five minute marks).
+    :return: summary of what was run
+    """
+    import dashboard.projects as projects
+    from dashboard.database.cache import query_cache
+    cache = shared_cache()
+    if cache is None:
+        raise ValueError("Set SHARED_CACHE_DIR to prewarm the shared cache")
+    project_ids = [None] + [p['id'] for p in projects.load_project_list(download_if_missing=True)]
+    start = time.perf_counter()
+    failed = 0
+    for project_id in project_ids:
+        query_cache.clear()  # so every call goes through to the shared cache
+        for call in page_calls(project_id):
+            try:
+                call()
+            except Exception as e:  # one broken project shouldn't leave the rest cold
+                failed += 1
+                logger.warning("Prewarming project {} failed: {}".format(project_id, e))
+    cache.prune()
+    summary = dict(projects=len(project_ids) - 1, seconds=time.perf_counter() - start, failed=failed,
+                   **cache.stats())
+    logger.info("Prewarmed shared cache: {}".format(summary))
+    return summary
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Shared query result cache for dashboard workers")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    subparsers.add_parser('prewarm', help="compute the current results for the home page and every project")
+    subparsers.add_parser('prune', help="delete old entries")
+    args = parser.parse_args()
+    if args.command == 'prewarm':
+        prewarm()
+    else:
+        cache = shared_cache()
+        if cache is not None:
+            logger.info("Pruned {} old shared cache files".format(cache.prune()))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,190 @@
+"""
+Columnar snapshot of the `stories` and `articles` tables, as date-partitioned Parquet files, for long-range history
+views that would otherwise mean heavy scans on the production processor database (see dashboard.database.duckdb_db,
+which runs the processor queries over these files when QUERY_BACKEND is 'duckdb').
+
+Each table goes in its own directory under SNAPSHOT_DIR, with one file per day of its partition column:
+
+    snapshots/stories/day=2023-05-01/part.parquet
+    snapshots/stories/day=none/part.parquet  (rows without a date)
+
+The export is incremental, like the rollup: we only rewrite the days touched by rows changed since the last watermark
+(kept in `_state.json` next to the partitions). Rows are streamed out of Postgres a batch at a time and each file is
+written next to the old one and renamed over it, so readers never see a half-written day. The directory can be copied
+to a laptop and used there without any database. Run it from the command line (ie. from cron) with:
+
+    python -m dashboard.database.snapshot [--full] [--tables stories articles]
+"""
+import argparse
+import datetime as dt
+import json
+import logging
+import os
+import shutil
+from collections import namedtuple
+from typing import Dict, List, Optional
+
+import psycopg2
+from psycopg2 import sql
+
+from dashboard.database.rollup import DEFAULT_OVERLAP
+import dashboard.database.streaming as streaming
+
+logger = logging.getLogger(__name__)
+
+PART_FILE = 'part.parquet'
+STATE_FILE = '_state.json'
+NO_DAY = 'none'
+
+# database: which settings URI to read from; columns: (name, Arrow type) so every file has the same schema;
+# partition: the date column to split files by; watermark: SQL for the newest change; changed: SQL condition on rows
+# changed since the `%(since)s` watermark; parse: turns the saved watermark back into a value; overlap: how far before
+# the watermark to look, to catch rows committed late
+SnapshotTable = namedtuple('SnapshotTable', ['name', 'database', 'columns', 'partition', 'watermark', 'changed',
+                                             'parse', 'overlap'])
+
+TABLES = {
+    'stories': SnapshotTable(
+        'stories', 'PROCESSOR_DB_URI',
+        [('id', 'int64'), ('stories_id', 'int64'), ('project_id', 'int32'), ('model_id', 'int32'),
+         ('source', 'string'), ('url', 'string'), ('model_score', 'float64'), ('above_threshold', 'bool'),
+         ('published_date', 'timestamp[us]'), ('processed_date', 'timestamp[us]'), ('queued_date', 'timestamp[us]'),
+         ('posted_date', 'timestamp[us]')],
+        'processed_date', "greatest(max(processed_date), max(posted_date))",
+        "processed_date > %(since)s OR posted_date > %(since)s", dt.datetime.fromisoformat, DEFAULT_OVERLAP),
+    # articles are only ever added, so the id is enough to find new ones
+    'articles': SnapshotTable(
+        'articles', 'ALERTS_DB_URI',
+        [('id', 'int64'), ('project_id', 'int32'), ('source', 'string'), ('url', 'string'), ('title', 'string'),
+         ('publish_date', 'timestamp[us]'), ('published_date', 'timestamp[us]')],
+        'published_date', "max(id)", "id > %(since)s", int, 0),
+}
+
+
+def table_dir(directory: str, table: str) -> str:
+    return os.path.join(directory, table)
+
+
+def table_glob(directory: str, table: str) -> str:
+    """
+    :return: glob matching every partition file of a table (and not the temporary files being written)
+    """
+    return os.path.join(table_dir(directory, table), 'day=*', PART_FILE)
+
+
+def partition_dir(directory: str, table: str, day: Optional[dt.date]) -> str:
+    return os.path.join(table_dir(directory, table), 'day={}'.format(NO_DAY if day is None else day.isoformat()))
+
+
+def arrow_schema(table: SnapshotTable):
+    import pyarrow as pa  # only needed to export, so only imported then
+    return pa.schema([(name, pa.type_for_alias(type_name)) for name, type_name in table.columns])
+
+
+def load_state(directory: str, table: SnapshotTable) -> Optional[Dict]:
+    path = os.path.join(table_dir(directory, table.name), STATE_FILE)
+    if not os.path.exists(path):
+        return None
+    with open(path) as f:
+        state = json.load(f)
+    return dict(state, watermark=table.parse(state['watermark']))
+
+
+def _save_state(directory: str, table: SnapshotTable, watermark, days: int) -> None:
+    path = os.path.join(table_dir(directory, table.name), STATE_FILE)
+    with open(path + '.tmp', 'w') as f:
+        json.dump(dict(watermark=str(watermark), days=days, exported=dt.datetime.now().isoformat()), f)
+    os.replace(path + '.tmp', path)
+
+
+def _touched_days(cursor, table: SnapshotTable, since) -> List[Optional[dt.date]]:
+    changed = sql.SQL("True") if since is None else sql.SQL(table.changed)
+    cursor.execute(sql.SQL("SELECT DISTINCT {col}::date FROM {table} WHERE {changed}").format(
+        col=sql.Identifier(table.partition), table=sql.Identifier(table.name), changed=changed), dict(since=since))
+    return [row[0] for row in cursor.fetchall()]
+
+
+def write_partition(conn, directory: str, table: SnapshotTable, day: Optional[dt.date]) -> int:
+    """
+    Stream one day of a table into its Parquet file, replacing whatever was there.
+    :param day: the day to write, or None for the rows without a date
+    :return: how many rows were written (the file is removed if there are none)
+    """
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+    schema = arrow_schema(table)
+    col = sql.Identifier(table.partition)
+    if day is None:
+        condition = sql.SQL("{} IS NULL").format(col)
+    else:
+        condition = sql.SQL("{col} >= %(day)s AND {col} < %(day)s + 1").format(col=col)
+    query = sql.SQL("SELECT {columns} FROM {table} WHERE {condition} ORDER BY {col}, id").format(
+        columns=sql.SQL(", ").join(sql.Identifier(name) for name in schema.names), table=sql.Identifier(table.name),
+        condition=condition, col=col)
+    path = os.path.join(partition_dir(directory, table.name, day), PART_FILE)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    rows = 0
+    with pq.ParquetWriter(path + '.tmp', schema, compression='zstd') as writer:
+        for batch in streaming.iter_batches(conn, query, dict(day=day)):
+            writer.write_batch(pa.RecordBatch.from_arrays(
+                [pa.array(values, type=field.type) for values, field in zip(zip(*batch), schema)], schema=schema))
+            rows += len(batch)
+    if rows:
+        os.replace(path + '.tmp', path)
+    else:
+        os.remove(path + '.tmp')
+        shutil.rmtree(os.path.dirname(path), ignore_errors=True)
+    return rows
+
+
+def refresh(conn, directory: str, table: SnapshotTable, full: bool = False) -> Dict:
+    """
+    Rewrite the partitions of every day touched since the last watermark (and the dateless rows, which we can't tell
+    apart by day).
+    :param conn: a psycopg2 connection to the database the table is in
+    :param directory: the snapshot directory (ie. SNAPSHOT_DIR)
+    :param full: ignore the watermark and rewrite every day, dropping partitions that no longer have any rows
+    :return: summary of what was exported
+    """
+    os.makedirs(table_dir(directory, table.name), exist_ok=True)
+    state = None if full else load_state(directory, table)
+    since = None if state is None else state['watermark'] - table.overlap
+    with conn.cursor() as cursor:
+        # find the newest change first, so anything that lands while we work is picked up next run
+        cursor.execute(sql.SQL("SELECT {} FROM {}").format(sql.SQL(table.watermark), sql.Identifier(table.name)))
+        watermark = cursor.fetchone()[0]
+        if watermark is None:
+            conn.commit()
+            return dict(table=table.name, days=0, rows=0, watermark=None)
+        days = _touched_days(cursor, table, since)
+    if None not in days:
+        days.append(None)
+    rows = sum(write_partition(conn, directory, table, day) for day in days)
+    conn.commit()
+    if full:
+        keep = {os.path.basename(partition_dir(directory, table.name, day)) for day in days}
+        for name in os.listdir(table_dir(directory, table.name)):
+            if name.startswith('day=') and name not in keep:
+                shutil.rmtree(os.path.join(table_dir(directory, table.name), name))
+    _save_state(directory, table, watermark, len(days))
+    logger.info("Exported {} snapshot: {} days, {} rows, watermark {}".format(table.name, len(days), rows, watermark))
+    return dict(table=table.name, days=len(days), rows=rows, watermark=watermark)
+
+
+def main():
+    from dashboard import settings
+    parser = argparse.ArgumentParser(description="Export stories and articles to date-partitioned Parquet files")
+    parser.add_argument('--full', action='store_true', help="rewrite every day instead of just the touched ones")
+    parser.add_argument('--tables', nargs='+', choices=list(TABLES.keys()), default=list(TABLES.keys()))
+    args = parser.parse_args()
+    for name in args.tables:
+        table = TABLES[name]
+        conn = psycopg2.connect(getattr(settings, table.database))
+        try:
+            refresh(conn, settings.SNAPSHOT_DIR, table, full=args.full)
+        finally:
+            conn.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,61 @@
+"""
+Read big result sets through a named (server-side) cursor a batch at a time, instead of `fetchall()`ing every row into
+dicts first. Rows stay as plain tuples and DataFrames are built a column at a time, so memory use stays around one
+batch deep while reading.
+"""
+import itertools
+from typing import Dict, Iterable, Iterator, List, TYPE_CHECKING
+
+from dashboard import settings
+from dashboard.database.query import execute
+
+if TYPE_CHECKING:
+    import pandas as pd
+
+_cursor_ids = itertools.count()
+
+
+def iter_batches(conn, query, params: Dict = None, itersize: int = None,
+                 comment: str = "") -> Iterator[List[tuple]]:
+    """
+    Yield the rows of a query in lists of up to `itersize` tuples. Has to run inside a transaction (named cursors only
+    live that long), so don't use this on an autocommit connection.
+    :param conn: connection to read from; it is busy until the generator is exhausted or closed
+    :param query: SQL string or `psycopg2.sql` composition, with `%(name)s` placeholders for values
+    :param params: values for the placeholders
+    :param itersize: how many rows to fetch from the server per round trip (default DB_CURSOR_ITERSIZE)
+    :param comment: SQL comment to send in front of the statement
+    """
+    itersize = itersize or settings.DB_CURSOR_ITERSIZE
+    with conn.cursor(name='dashboard_stream_{}'.format(next(_cursor_ids))) as cursor:
+        cursor.itersize = itersize
+        execute(cursor, query, params, comment=comment)
+        while True:
+            rows = cursor.fetchmany(itersize)
+            if not rows:
+                break
+            yield rows
+
+
+def to_columns(columns: List[str], rows: List[tuple]) -> Dict[str, list]:
+    """
+    Turn row tuples into parallel column lists, ie. for a chart's DataFrame.
+    :param columns: names of the columns, in the order they are in each tuple
+    """
+    if not rows:
+        return {column: [] for column in columns}
+    return dict(zip(columns, map(list, zip(*rows))))
+
+
+def to_frame(columns: List[str], batches: Iterable[List[tuple]]) -> 'pd.DataFrame':
+    """
+    Build a DataFrame column-wise from batches of row tuples (without making a dict per row along the way).
+    :param columns: names of the columns, in the order they are in each tuple
+    :param batches: lists of row tuples, ie. from `iter_batches`
+    """
+    import pandas as pd
+    data = [[] for _ in columns]
+    for rows in batches:
+        for values, column in zip(zip(*rows), data):
+            column.extend(values)
+    return pd.DataFrame(dict(zip(columns, data)), columns=columns)
@@ -0,0 +1,48 @@
+"""
+Hooks to see which SQL the dashboard actually runs. Database modules call `notify` for every query they send to
+Postgres (cache hits don't count); anything registered with `add_listener` (or the `recording` context) hears about it.
+"""
+import threading
+from contextlib import contextmanager
+from typing import Callable, Dict, List
+
+_listeners = []
+_lock = threading.Lock()
+
+
+def add_listener(listener: Callable) -> None:
+    with _lock:
+        _listeners.append(listener)
+
+
+def remove_listener(listener: Callable) -> None:
+    with _lock:
+        _listeners.remove(listener)
+
+
+def notify(database: str, query: str, params: Dict = None) -> None:
+    """
+    :param database: which database the query ran against ('processor' or 'alerts')
+    :param query: the SQL, with `%(name)s` placeholders
+    :param params: values for the placeholders
+    """
+    with _lock:
+        listeners = list(_listeners)
+    for listener in listeners:
+        listener(database, query, params)
+
+
+@contextmanager
+def recording() -> List:
+    """
+    Collect every (database, query, params) run inside the block.
+    """
+    queries = []
+
+    def _record(database, query, params):
+        queries.append((database, query, params))
+    add_listener(_record)
+    try:
+        yield queries
+    finally:
+        remove_listener(_record)
@@ -0,0 +1,61 @@
+"""
+URL canonicalization, so links to the same page compare equal across the stories and articles tables (and across the
+alert feeds that send them to us with their own tracking parameters).
+"""
+import hashlib
+from typing import Optional
+from urllib.parse import urlsplit, parse_qsl, urlencode
+
+# query parameters that only say where a click came from; any other parameter may pick the page, so it's kept
+TRACKING_PARAMS = {'fbclid', 'gclid', 'dclid', 'gbraid', 'wbraid', 'msclkid', 'yclid', 'igshid', 'mc_cid', 'mc_eid',
+                   '_ga', '_gl', '_hsenc', '_hsmi'}
+TRACKING_PREFIXES = ('utm_',)
+
+# redirect links (ie. the ones in Google Alerts emails): host and path, and the parameters that can hold the target
+REDIRECTS = {
+    ('google.com', '/url'): ('url', 'q'),
+}
+MAX_REDIRECTS = 3  # unwrapped at most, in case a link is wrapped more than once
+
+
+def _host(netloc: str) -> str:
+    host = netloc.split('@')[-1].split(':')[0].lower()
+    return host[4:] if host.startswith('www.') else host
+
+
+def _is_tracking(name: str) -> bool:
+    name = name.lower()
+    return name in TRACKING_PARAMS or name.startswith(TRACKING_PREFIXES)
+
+
+def canonical_url(url: Optional[str]) -> str:
+    """
+    Host, path and the meaningful query parameters, so the same link with tracking parameters (utm_* and friends),
+    fragments, schemes, `www.` prefixes or its parameters in another order compares equal, while `?id=1` and `?id=2`
+    don't. Redirect links are followed to their target. The path keeps its case, as servers can tell them apart.
+    """
+    if not url:
+        return ''
+    parts = urlsplit(url.strip())
+    params = parse_qsl(parts.query, keep_blank_values=True)
+    for _ in range(MAX_REDIRECTS):
+        names = REDIRECTS.get((_host(parts.netloc), parts.path))
+        target = next((value for name in names or () for key, value in params if key == name and value), None)
+        if target is None:
+            break
+        parts = urlsplit(target.strip())
+        params = parse_qsl(parts.query, keep_blank_values=True)
+    query = urlencode(sorted((name, value) for name, value in params if not _is_tracking(name)))
+    return _host(parts.netloc) + parts.path.rstrip('/') + ('?' + query if query else '')
+
+
+def url_key(url: Optional[str]) -> Optional[int]:
+    """
+    A fixed-width key for the canonical URL: 64 bits of its hash, signed to fit a bigint column.
+    :return: the key, or None if there's no URL
+    """
+    canonical = canonical_url(url)
+    if not canonical:
+        return None
+    value = int.from_bytes(hashlib.blake2b(canonical.encode('utf-8'), digest_size=8).digest(), 'big')
+    return value - (1 << 64) if value >= 1 << 63 else value
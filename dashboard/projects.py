@@ -2,48 +2,118 @@ from typing import List, Dict
 import os
 import sys
 import json
+import time
 import logging
+import tempfile
+import threading
 
-from dashboard import CONFIG_DIR
+from dashboard import CONFIG_DIR, settings
 import dashboard.apiclient as apiclient
 
 logger = logging.getLogger(__name__)
 
 _all_projects = None  # acts as a singleton because we only load it once (after we update it from central server)
+_loaded_mtime = None  # modification time of the file _all_projects was read from
+_refresh_lock = threading.Lock()  # only one refresh from the main server at a time
+_background_refresh = threading.Lock()  # held while a background refresh is running
 
 
 def _path_to_config_file() -> str:
     return os.path.join(CONFIG_DIR, 'projects.json')
 
 
+def _path_to_validators_file() -> str:
+    return os.path.join(CONFIG_DIR, 'projects.validators.json')
+
+
+def _write_atomically(path: str, data) -> None:
+    # write to a temp file in the same dir and rename it over the old one, so readers never see a half-written file
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), prefix='.tmp-', suffix='.json')
+    try:
+        with os.fdopen(fd, 'w') as f:
+            json.dump(data, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
+
+
+def _read_validators() -> Dict:
+    try:
+        with open(_path_to_validators_file(), 'r') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def refresh_project_list() -> bool:
+    """
+    Download the project list from the main server if it has changed (a conditional request), and save it.
+    :return: True if a new list was saved
+    """
+    with _refresh_lock:
+        validators = _read_validators() if os.path.exists(_path_to_config_file()) else {}
+        projects_list, validators = apiclient.get_projects_list_if_modified(validators)
+        if projects_list is None:  # not modified, so just mark our copy as fresh again
+            os.utime(_path_to_config_file())
+            logger.info("  config file from main server unchanged")
+            return False
+        if len(projects_list) == 0:
+            raise RuntimeError("Fetched empty project list was empty - bailing unhappily")
+        _write_atomically(_path_to_config_file(), projects_list)
+        _write_atomically(_path_to_validators_file(), validators)
+        logger.info("  updated config file from main server - {} projects".format(len(projects_list)))
+        return True
+
+
+def _refresh_in_background() -> None:
+    if not _background_refresh.acquire(blocking=False):
+        return  # one is already running
+
+    def _refresh():
+        try:
+            refresh_project_list()
+        except Exception as e:
+            # keep serving the stale copy; we'll try again on the next call after the TTL
+            logger.warning("Couldn't refresh project list from main server: {}".format(e))
+        finally:
+            _background_refresh.release()
+    threading.Thread(target=_refresh, name='refresh-projects', daemon=True).start()
+
+
 def load_project_list(force_reload: bool = False, download_if_missing: bool = False) -> List[Dict]:
     """
-    Treats config like a singleton that is lazy-loaded once the first time this is called.
-    :param force_reload: Override the default behaviour and load the config from file system again.
+    Treats config like a singleton that is lazy-loaded once the first time this is called. The locally cached copy is
+    always returned right away; once it is older than PROJECTS_TTL seconds it is refreshed from the main server in the
+    background (stale-while-revalidate), so a slow or unreachable main server never blocks a page.
+    :param force_reload: Override the default behaviour and download the config from the main server before returning.
     :param download_if_missing: If the file is missing try to download it as a backup plan
     :return: list of configurations for projects to query about
     """
-    global _all_projects
-    if _all_projects and not force_reload:
-        return _all_projects
+    global _all_projects, _loaded_mtime
     try:
         file_exists = os.path.exists(_path_to_config_file())
-        if force_reload or (download_if_missing and not file_exists):  # grab the latest config file from main server
-            projects_list = apiclient.get_projects_list()
-            with open(_path_to_config_file(), 'w') as f:
-                json.dump(projects_list, f)
-                file_exists = True # we might have just created it for the first time
-            logger.info("  updated config file from main server - {} projects".format(len(projects_list)))
-            if len(projects_list) == 0:
-                raise RuntimeError("Fetched empty project list was empty - bailing unhappily")
-        # load and return the (perhaps updated) locally cached file
-        if file_exists:
+        if force_reload or (download_if_missing and not file_exists):  # nothing to serve, so we have to wait
+            refresh_project_list()
+            file_exists = True  # we might have just created it for the first time
+        if not file_exists:
+            _all_projects = []
+            return _all_projects
+        mtime = os.path.getmtime(_path_to_config_file())
+        if time.time() - mtime > settings.PROJECTS_TTL:
+            _refresh_in_background()
+        # (re)load the locally cached file if it changed since we last read it (ie. another process refreshed it)
+        if _all_projects is None or mtime != _loaded_mtime:
             with open(_path_to_config_file(), "r") as f:
                 _all_projects = json.load(f)
-        else:
-            _all_projects = []
+            _loaded_mtime = mtime
         return _all_projects
     except Exception as e:
+        if _all_projects:
+            logger.warning("Can't load config file, using the copy we already have: {}".format(e))
+            return _all_projects
         # bail completely if we can't load the config file
         logger.error("Can't load config file - dying ungracefully")
         logger.exception(e)
@@ -0,0 +1,97 @@
+"""
+Run a page's independent database queries at the same time instead of one after another, so a page takes about as
+long as its slowest query rather than the sum of all of them. Queries run on a shared thread pool (each one checks out
+its own pooled connection); results come back on the calling thread, which is the only one that should touch
+Streamlit.
+"""
+import contextvars
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed, Future
+from typing import Callable, Dict, Iterator, List, Tuple
+
+from dashboard import settings
+import dashboard.database.profiling as profiling
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def _shared_executor() -> ThreadPoolExecutor:
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            # two databases' worth of pooled connections
+            _executor = ThreadPoolExecutor(max_workers=2 * settings.DB_POOL_MAX_SIZE, thread_name_prefix='dashboard-query')
+        return _executor
+
+
+class QueryScheduler:
+
+    def __init__(self, executor: ThreadPoolExecutor = None):
+        self._executor = executor or _shared_executor()
+        self._futures = {}  # future -> label
+        self._timings = {}  # label -> (start, end) relative to when the scheduler was created
+        self._created = time.perf_counter()
+        self._finished = None
+
+    def _timed(self, label: str, func: Callable, args, kwargs):
+        start = time.perf_counter()
+        try:
+            with profiling.chart(label):  # so the query profiles say which chart they were for
+                return func(*args, **kwargs)
+        finally:
+            self._timings[label] = (start - self._created, time.perf_counter() - self._created)
+
+    def submit(self, label: str, func: Callable, *args, **kwargs) -> Future:
+        """
+        Start running `func(*args, **kwargs)` in the background.
+        :param label: unique name for this query, used to hand back its result and in the timing report
+        """
+        if label in self._futures.values():
+            raise ValueError("A query labelled '{}' was already submitted".format(label))
+        context = contextvars.copy_context()  # so tracing/profiling context follows the query into the thread
+        future = self._executor.submit(context.run, self._timed, label, func, args, kwargs)
+        self._futures[future] = label
+        return future
+
+    def as_completed(self, return_exceptions: bool = False) -> Iterator[Tuple[str, object]]:
+        """
+        Yield (label, result) pairs in the order the queries finish. Exceptions are re-raised here.
+        :param return_exceptions: yield a failed query's exception as its result instead, so the others still come back
+        """
+        for future in as_completed(list(self._futures)):
+            if return_exceptions and future.exception() is not None:
+                yield self._futures[future], future.exception()
+            else:
+                yield self._futures[future], future.result()
+        self._finished = time.perf_counter() - self._created
+
+    def results(self) -> Dict[str, object]:
+        """
+        Wait for everything and return the results by label.
+        """
+        return dict(self.as_completed())
+
+    def report(self) -> Dict:
+        """
+        :return: dict with per-query `timings` (label, start, end, duration in seconds), the `wall` time until the
+                 last one finished, the `total` of all their durations and the resulting `overlap` factor
+        """
+        timings = [dict(label=label, start=start, end=end, duration=end - start)
+                   for label, (start, end) in sorted(self._timings.items(), key=lambda item: item[1][0])]
+        wall = self._finished if self._finished is not None else max([t['end'] for t in timings] or [0])
+        total = sum(t['duration'] for t in timings)
+        return dict(timings=timings, wall=wall, total=total, overlap=(total / wall) if wall else 1)
+
+
+def timing_lines(report: Dict) -> List[str]:
+    """
+    Human-readable summary of a `QueryScheduler.report()`, one line per query plus a total.
+    """
+    lines = ["{label}: {start_ms:.0f}-{end_ms:.0f}ms ({duration_ms:.0f}ms)".format(
+        start_ms=t['start'] * 1000, end_ms=t['end'] * 1000, duration_ms=t['duration'] * 1000, **t)
+        for t in report['timings']]
+    lines.append("{:.0f}ms of queries in {:.0f}ms wall time ({:.1f}x overlap)".format(
+        report['total'] * 1000, report['wall'] * 1000, report['overlap']))
+    return lines
@@ -1,5 +1,5 @@
 import os
 
-from processor import base_dir
+from dashboard import base_dir
 
-test_fixture_dir = os.path.join(base_dir, "processor", "test", "fixtures")
+test_fixture_dir = os.path.join(base_dir, "dashboard", "test", "fixtures")
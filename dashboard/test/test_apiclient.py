@@ -0,0 +1,134 @@
+import gzip
+import json
+import threading
+import time
+import unittest
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from unittest import mock
+
+import requests
+
+from dashboard import settings
+import dashboard.apiclient as apiclient
+
+PROJECTS = [dict(id=1, title="Test project", language_model_id=2, rss_url="http://example.com/rss")]
+MODELS = [dict(id=2, name="Test model")]
+
+
+class StubApiServer(BaseHTTPRequestHandler):
+    """
+    Stands in for the main server's API, and can be told to fail or be slow.
+    """
+    protocol_version = 'HTTP/1.1'  # keep-alive
+    failures = 0  # answer this many requests with a 503 first
+    delay = 0
+    requests = []
+
+    def do_GET(self):
+        StubApiServer.requests.append(dict(path=self.path, accept_encoding=self.headers.get('Accept-Encoding'),
+                                           client_port=self.client_address[1]))
+        time.sleep(StubApiServer.delay)
+        if StubApiServer.failures > 0:
+            StubApiServer.failures -= 1
+            self._send(503, b'')
+            return
+        data = MODELS if 'language_models' in self.path else PROJECTS
+        self._send(200, gzip.compress(json.dumps(data).encode('utf-8')), {'Content-Encoding': 'gzip'})
+
+    def _send(self, status, body, headers=None):
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+class QuietServer(ThreadingHTTPServer):
+
+    def handle_error(self, request, client_address):
+        pass  # the tests that time out or refuse big responses hang up on purpose
+
+
+class TestApiClient(unittest.TestCase):
+
+    def setUp(self):
+        StubApiServer.requests = []
+        StubApiServer.failures = 0
+        StubApiServer.delay = 0
+        self.server = QuietServer(('127.0.0.1', 0), StubApiServer)
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.patches = [
+            mock.patch.object(settings, 'FEMINICIDE_API_URL', 'http://127.0.0.1:{}'.format(self.server.server_port)),
+            mock.patch.object(apiclient, 'RETRY_BACKOFF', 0),
+            mock.patch.object(apiclient, '_session', None),
+            mock.patch.object(apiclient, '_metrics', {}),
+        ]
+        for p in self.patches:
+            p.start()
+
+    def tearDown(self):
+        if apiclient._session is not None:
+            apiclient._session.close()
+        for p in self.patches:
+            p.stop()
+        self.server.shutdown()
+        self.server.server_close()
+
+    def test_gzip_and_keep_alive(self):
+        assert apiclient.get_projects_list() == PROJECTS
+        assert apiclient.get_projects_list() == PROJECTS
+        assert 'gzip' in StubApiServer.requests[0]['accept_encoding']
+        # both requests went over the same connection
+        assert StubApiServer.requests[0]['client_port'] == StubApiServer.requests[1]['client_port']
+
+    def test_retries_server_errors(self):
+        StubApiServer.failures = 2
+        assert apiclient.get_projects_list() == PROJECTS
+        assert len(StubApiServer.requests) == 3
+
+    def test_gives_up_after_max_retries(self):
+        StubApiServer.failures = apiclient.MAX_RETRIES + 1
+        with self.assertRaises(requests.HTTPError):
+            apiclient.get_projects_list()
+        assert len(StubApiServer.requests) == apiclient.MAX_RETRIES + 1
+        stats = list(apiclient.request_metrics().values())[0]
+        assert stats['count'] == 1 and stats['errors'] == 1
+
+    def test_read_timeout(self):
+        StubApiServer.delay = 0.5
+        with mock.patch.object(apiclient, 'READ_TIMEOUT', 0.1), mock.patch.object(apiclient, 'MAX_RETRIES', 0):
+            with self.assertRaises(requests.ConnectionError):  # urllib3 wraps the timeout once retries run out
+                apiclient.get_projects_list()
+
+    def test_response_size_limit(self):
+        with mock.patch.object(apiclient, 'MAX_RESPONSE_BYTES', 10):
+            with self.assertRaises(ValueError):
+                apiclient.get_projects_list()
+
+    def test_response_size_limit_without_length(self):
+        response = mock.Mock(url='http://example.com', headers={})
+        response.iter_content.return_value = iter([b'[1, ', b'2, ', b'3]'])
+        assert apiclient._read_limited(response) == b'[1, 2, 3]'
+        response.iter_content.return_value = iter([b'[1, ', b'2, ', b'3]'])
+        with mock.patch.object(apiclient, 'MAX_RESPONSE_BYTES', 6):
+            with self.assertRaises(ValueError):  # counted as it's decoded, as the length isn't known up front
+                apiclient._read_limited(response)
+        response.close.assert_called_once()
+
+    def test_parallel_fetch(self):
+        StubApiServer.delay = 0.3
+        start = time.time()
+        project_list, models = apiclient.get_projects_and_language_models()
+        assert time.time() - start < 0.55
+        assert project_list == PROJECTS
+        assert models == MODELS
+        assert len(apiclient.request_metrics()) == 2
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,25 @@
+import datetime as dt
+import unittest
+
+from dashboard.database.bucketing import pick_bucket, bucket_start, earliest_date
+
+
+class TestBucketing(unittest.TestCase):
+
+    def test_pick_bucket(self):
+        self.assertEqual(pick_bucket(45), 'day')
+        self.assertEqual(pick_bucket(120), 'day')
+        self.assertEqual(pick_bucket(365), 'week')
+        self.assertEqual(pick_bucket(1825), 'month')
+        self.assertEqual(pick_bucket(365, max_points=400), 'day')
+        self.assertEqual(pick_bucket(36500), 'month')  # nothing fits, so the biggest
+
+    def test_bucket_start(self):
+        day = dt.date(2023, 5, 18)  # a Thursday
+        self.assertEqual(bucket_start(day, 'day'), day)
+        self.assertEqual(bucket_start(day, 'week'), dt.date(2023, 5, 15))
+        self.assertEqual(bucket_start(day, 'month'), dt.date(2023, 5, 1))
+        self.assertEqual(earliest_date(400, 'month').day, 1)
+        with self.assertRaises(ValueError):
+            bucket_start(day, 'fortnight')
+
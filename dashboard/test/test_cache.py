@@ -0,0 +1,65 @@
+import unittest
+from unittest import mock
+
+from dashboard.database.cache import QueryCache
+
+
+class TestQueryCache(unittest.TestCase):
+
+    def setUp(self):
+        self.calls = 0
+
+    def _run(self):
+        self.calls += 1
+        return [dict(count=self.calls)]
+
+    def test_hit_ignores_whitespace(self):
+        cache = QueryCache()
+        first = cache.get_or_run('processor', 'count', "select count(1)\n   from stories", self._run)
+        second = cache.get_or_run('processor', 'count', "select count(1) from stories", self._run)
+        assert first is second
+        assert self.calls == 1
+        assert cache.stats()['hits'] == 1
+        assert cache.stats()['misses'] == 1
+
+    def test_key_includes_namespace_and_params(self):
+        cache = QueryCache()
+        cache.get_or_run('processor', 'count', "select 1", self._run)
+        cache.get_or_run('alerts', 'count', "select 1", self._run)
+        cache.get_or_run('alerts', 'count', "select 1", self._run, params=(1,))
+        assert self.calls == 3
+
+    def test_family_ttl(self):
+        cache = QueryCache(ttls=dict(count=10), default_ttl=0)
+        with mock.patch('time.monotonic', return_value=100):
+            cache.get_or_run('processor', 'count', "select 1", self._run)
+            cache.get_or_run('processor', None, "select 2", self._run)
+        with mock.patch('time.monotonic', return_value=105):
+            cache.get_or_run('processor', 'count', "select 1", self._run)  # still fresh
+            cache.get_or_run('processor', None, "select 2", self._run)  # expired
+        with mock.patch('time.monotonic', return_value=111):
+            cache.get_or_run('processor', 'count', "select 1", self._run)  # expired
+        assert self.calls == 4
+
+    def test_lru_eviction(self):
+        cache = QueryCache(max_entries=2)
+        cache.get_or_run('processor', 'count', "select 1", self._run)
+        cache.get_or_run('processor', 'count', "select 2", self._run)
+        cache.get_or_run('processor', 'count', "select 1", self._run)  # now most recently used
+        cache.get_or_run('processor', 'count', "select 3", self._run)  # evicts "select 2"
+        cache.get_or_run('processor', 'count', "select 1", self._run)
+        assert self.calls == 3
+        cache.get_or_run('processor', 'count', "select 2", self._run)
+        assert self.calls == 4
+        assert cache.stats()['entries'] == 2
+
+    def test_clear(self):
+        cache = QueryCache()
+        cache.get_or_run('processor', 'count', "select 1", self._run)
+        cache.clear()
+        cache.get_or_run('processor', 'count', "select 1", self._run)
+        assert self.calls == 2
+
+
+if __name__ == "__main__":
+    unittest.main()
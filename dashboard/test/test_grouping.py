@@ -0,0 +1,108 @@
+import unittest
+from unittest import mock
+
+import psycopg2.errors
+
+import dashboard.database.grouping as grouping
+import dashboard.database.alerts_db as alerts_db
+from dashboard.database.cache import query_cache
+
+TITLE = "Woman killed by her partner in Lima, police say"
+
+
+def _articles(*titles_and_urls, project_id=1):
+    return [(i + 1, project_id, title, url) for i, (title, url) in enumerate(titles_and_urls)]
+
+
+class TestFingerprints(unittest.TestCase):
+
+    def test_canonical_url(self):
+        self.assertEqual(grouping.canonical_url("https://www.Example.com/news/1/?utm_source=alert#top"),
+                         grouping.canonical_url("http://example.com/news/1"))
+        self.assertNotEqual(grouping.canonical_url("https://example.com/news/1"),
+                            grouping.canonical_url("https://example.com/news/2"))
+        self.assertEqual(grouping.url_hash(None), 0)
+
+    def test_canonical_url_keeps_meaningful_parameters(self):
+        self.assertEqual(grouping.canonical_url("https://news.com/article.php?id=1&utm_medium=email&fbclid=x"),
+                         "news.com/article.php?id=1")
+        self.assertNotEqual(grouping.url_hash("https://news.com/article.php?id=1"),
+                            grouping.url_hash("https://news.com/article.php?id=2"))
+        self.assertEqual(grouping.canonical_url("https://news.com/a?b=2&a=1"),
+                         grouping.canonical_url("https://news.com/a?a=1&b=2"))
+        self.assertNotEqual(grouping.canonical_url("https://news.com/News/1"),
+                            grouping.canonical_url("https://news.com/news/1"))
+
+    def test_canonical_url_follows_redirects(self):
+        first = "https://www.google.com/url?rct=j&sa=t&url=https://a.com/x%3Fid%3D7%26utm_source%3Dalert&ct=ga"
+        second = "https://www.google.com/url?rct=j&sa=t&url=https://b.com/y&ct=ga"
+        self.assertEqual(grouping.canonical_url(first), "a.com/x?id=7")
+        self.assertEqual(grouping.canonical_url(second), "b.com/y")
+        self.assertEqual(grouping.canonical_url("https://google.com/url?q=https://www.b.com/y/"), "b.com/y")
+        self.assertEqual(grouping.canonical_url("https://google.com/url?rct=j"), "google.com/url?rct=j")
+
+    def test_similar_titles_have_similar_signatures(self):
+        same, edited, other, empty = grouping.minhashes([grouping.title_words(t) for t in [
+            TITLE, TITLE + " - El Comercio", "Man arrested after a shooting in Bogota", ""]])
+        self.assertEqual(len(same), grouping.PERMUTATIONS)
+        self.assertGreaterEqual(grouping.similarity(same, edited), grouping.MIN_SIMILARITY)
+        self.assertLess(grouping.similarity(same, other), grouping.MIN_SIMILARITY)
+        self.assertIsNone(empty)
+
+    def test_signatures_are_stable(self):
+        # they're stored, so the same title has to give the same signature every time
+        first = grouping.signatures(_articles((TITLE, "https://example.com/1")))
+        second = grouping.signatures(_articles((TITLE, "https://example.com/1")))
+        self.assertEqual(first, second)
+
+
+class TestAssign(unittest.TestCase):
+
+    def test_groups_near_duplicates(self):
+        articles = _articles(
+            (TITLE, "https://example.com/a"),
+            (TITLE + " - El Comercio", "https://elcomercio.pe/b"),
+            ("Man arrested after a shooting in Bogota", "https://example.com/c"),
+            ("Completely different headline", "https://www.example.com/a?utm_source=alert"),  # same link as the first
+        )
+        assigned, _ = grouping.assign(grouping.BandIndex(), grouping.signatures(articles))
+        self.assertEqual([s.cluster_id for _, s in assigned], [1, 1, 3, 1])
+
+    def test_groups_stay_within_a_project(self):
+        articles = [(1, 1, TITLE, "https://example.com/a"), (2, 2, TITLE, "https://example.com/a")]
+        assigned, _ = grouping.assign(grouping.BandIndex(), grouping.signatures(articles))
+        self.assertEqual([s.cluster_id for _, s in assigned], [1, 2])
+
+    def test_exact_repeats_are_not_indexed(self):
+        articles = _articles(*[(TITLE, "https://example.com/a?utm_medium={}".format(i)) for i in range(10)])
+        assigned, indexed = grouping.assign(grouping.BandIndex(), grouping.signatures(articles))
+        self.assertEqual({s.cluster_id for _, s in assigned}, {1})
+        self.assertEqual(len(indexed), 1)
+
+    def test_matches_earlier_batches(self):
+        # later batches only see what was indexed before, loaded back as rows like `refresh` does
+        index = grouping.BandIndex()
+        _, indexed = grouping.assign(index, grouping.signatures(_articles((TITLE, "https://example.com/a"))))
+        rows = [(project_id, band, value, s.articles_id, list(s.minhash), s.url_hash, s.cluster_id)
+                for project_id, s in indexed for band, value in grouping.band_keys(s)]
+        next_batch = grouping.BandIndex()
+        next_batch.load(rows)
+        signed = grouping.signatures([(2, 1, TITLE + " (video)", "https://other.example.com/x")])
+        assigned, _ = grouping.assign(next_batch, signed)
+        self.assertEqual(assigned[0][1].cluster_id, 1)
+
+
+
+class TestNotGroupedYet(unittest.TestCase):
+
+    def test_missing_tables(self):
+        query_cache.clear()
+        missing = psycopg2.errors.UndefinedTable('relation "article_clusters" does not exist')
+        with mock.patch.object(alerts_db, '_execute', side_effect=missing):
+            with self.assertRaisesRegex(alerts_db.NotComputedError, 'dashboard.database.grouping'):
+                alerts_db.grouped_articles(1)
+            self.assertRaises(alerts_db.NotComputedError, alerts_db.group_articles, 7)
+
+
+if __name__ == "__main__":
+    unittest.main()
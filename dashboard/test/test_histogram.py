@@ -0,0 +1,43 @@
+import datetime as dt
+import unittest
+
+from psycopg2 import sql
+
+from dashboard.database.histogram import summary_sql, histogram_columns, bin_edges
+from dashboard.database.query import as_text
+
+
+class TestHistogram(unittest.TestCase):
+
+    def test_summary_sql(self):
+        text = as_text(summary_sql('stories', sql.SQL("project_id = %(project_id)s")))
+        assert 'width_bucket(model_score, 0, 1, %(bins)s)' in text
+        assert 'numeric' not in text
+        assert text.count('FROM "stories"') == 1  # one scan for the bins, percentiles and counters
+        assert 'percentile_cont(%(percentiles)s::float8[]) WITHIN GROUP (ORDER BY model_score)' in text
+        assert 'count(1) FILTER (WHERE above_threshold IS False) AS below' in text
+        assert text.endswith('GROUP BY 1) SELECT totals.*, bins.* FROM totals LEFT JOIN bins ON True '
+                             'ORDER BY bins.bucket')
+        text = as_text(summary_sql('stories', sql.SQL("True"), by='source'))
+        assert 'source AS "source"' in text
+        assert text.endswith('GROUP BY 1, 2) SELECT totals.*, bins.* FROM totals LEFT JOIN bins ON True '
+                             'ORDER BY bins."source", bins.bucket')
+        self.assertRaises(ValueError, summary_sql, 'stories', sql.SQL("True"), 'language')
+
+    def test_bin_edges(self):
+        assert bin_edges(4) == [0, 0.25, 0.5, 0.75, 1]
+        assert bin_edges(10)[3] == 0.3
+
+    def test_columns_fill_empty_bins(self):
+        columns = histogram_columns([dict(bucket=2, stories=5), dict(bucket=4, stories=1)], 4)
+        assert columns == dict(bin_start=[0, 0.25, 0.5, 0.75], bin_end=[0.25, 0.5, 0.75, 1], stories=[0, 5, 0, 1])
+
+    def test_columns_with_breakdown(self):
+        day = dt.date(2023, 5, 1)
+        columns = histogram_columns([dict(bucket=1, day=day, stories=3), dict(bucket=10, day=day, stories=2)], 10,
+                                    by='day')
+        assert columns == dict(bin_start=[0, 0.9], bin_end=[0.1, 1], stories=[3, 2], day=[day, day])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,44 @@
+import datetime as dt
+import unittest
+
+from psycopg2 import sql
+
+from dashboard.database.paging import keyset_page_sql, split_page
+from dashboard.database.query import as_text
+
+ORDER = ['processed_date', 'stories_id']
+
+
+class TestPaging(unittest.TestCase):
+
+    def test_first_page(self):
+        query, params = keyset_page_sql('stories', ['stories_id', 'processed_date'],
+                                        sql.SQL("project_id = %(project_id)s"), dict(project_id=1), ORDER, None, 20)
+        assert as_text(query) == 'SELECT "stories_id", "processed_date" FROM "stories" ' \
+                                 'WHERE project_id = %(project_id)s ' \
+                                 'ORDER BY "processed_date" DESC, "stories_id" DESC LIMIT %(limit)s'
+        assert params == dict(project_id=1, limit=21)
+
+    def test_next_page(self):
+        after = (dt.datetime(2023, 5, 1, 12), 1234)
+        query, params = keyset_page_sql('stories', ['stories_id', 'processed_date'],
+                                        sql.SQL("project_id = %(project_id)s"), dict(project_id=1), ORDER, after, 20)
+        assert 'AND ("processed_date", "stories_id") < (%(after_0)s, %(after_1)s) ORDER BY' in as_text(query)
+        assert params['after_0'] == after[0] and params['after_1'] == 1234
+
+    def test_only_whitelisted_sort_keys(self):
+        self.assertRaises(ValueError, keyset_page_sql, 'stories', ['stories_id'], sql.SQL("True"), {},
+                          ['stories_id; drop table stories'])
+
+    def test_split_page(self):
+        rows = [dict(stories_id=i, processed_date=dt.datetime(2023, 5, 1) - dt.timedelta(hours=i)) for i in range(5)]
+        page, after = split_page(rows, ORDER, 4)
+        assert len(page) == 4
+        assert after == (rows[3]['processed_date'], 3)
+        page, after = split_page(rows, ORDER, 5)
+        assert len(page) == 5
+        assert after is None
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,135 @@
+import threading
+import unittest
+
+import psycopg2
+import psycopg2.extensions
+from psycopg2.pool import PoolError
+
+from dashboard.database.pool import ConnectionPool
+
+
+class FakeCursor:
+
+    def __init__(self, conn):
+        self.conn = conn
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        pass
+
+    def execute(self, query):
+        if self.conn.broken:
+            self.conn.closed = 1
+            raise psycopg2.OperationalError("server closed the connection unexpectedly")
+        self.conn.in_transaction = True
+
+
+class FakeConnection:
+    """
+    Stands in for a psycopg2 connection, so we can test the pool without a running Postgres.
+    """
+
+    def __init__(self, dsn, **kwargs):
+        self.dsn = dsn
+        self.kwargs = kwargs
+        self.closed = 0
+        self.broken = False
+        self.in_transaction = False
+
+    def cursor(self, **kwargs):
+        return FakeCursor(self)
+
+    def get_transaction_status(self):
+        if self.in_transaction:
+            return psycopg2.extensions.TRANSACTION_STATUS_INTRANS
+        return psycopg2.extensions.TRANSACTION_STATUS_IDLE
+
+    def commit(self):
+        self.in_transaction = False
+
+    def rollback(self):
+        self.in_transaction = False
+
+    def close(self):
+        self.closed = 1
+
+
+class TestConnectionPool(unittest.TestCase):
+
+    def setUp(self):
+        self.opened = []
+
+        def connect(dsn, **kwargs):
+            conn = FakeConnection(dsn, **kwargs)
+            self.opened.append(conn)
+            return conn
+        self.connect = connect
+
+    def test_reuses_connections(self):
+        pool = ConnectionPool('postgresql:///test', min_size=1, max_size=2, connect=self.connect)
+        with pool.connection() as conn:
+            first = conn
+        with pool.connection() as conn:
+            assert conn is first
+        assert len(self.opened) == 1
+        assert pool.stats() == dict(idle=1, in_use=0, max_size=2)
+
+    def test_statement_timeout(self):
+        ConnectionPool('postgresql:///test', statement_timeout=1234, connect=self.connect)
+        assert self.opened[0].kwargs['options'] == '-c statement_timeout=1234'
+
+    def test_concurrent_checkouts(self):
+        pool = ConnectionPool('postgresql:///test', min_size=0, max_size=2, connect=self.connect)
+        a = pool.getconn()
+        b = pool.getconn()
+        assert a is not b
+        pool.putconn(a)
+        pool.putconn(b)
+        assert len(self.opened) == 2
+
+    def test_blocks_then_times_out_when_exhausted(self):
+        pool = ConnectionPool('postgresql:///test', min_size=0, max_size=1, checkout_timeout=0.05,
+                              connect=self.connect)
+        conn = pool.getconn()
+        self.assertRaises(PoolError, pool.getconn)
+        # a connection returned from another thread unblocks a waiting checkout
+        timer = threading.Timer(0.01, pool.putconn, [conn])
+        pool._checkout_timeout = 1
+        timer.start()
+        assert pool.getconn() is conn
+
+    def test_broken_connection_is_replaced(self):
+        pool = ConnectionPool('postgresql:///test', min_size=1, max_size=1, connect=self.connect)
+        with self.assertRaises(psycopg2.OperationalError):
+            with pool.connection() as conn:
+                conn.broken = True
+                with conn.cursor() as cursor:
+                    cursor.execute("select 1")
+        with pool.connection() as conn:
+            assert conn is not self.opened[0]
+            assert not conn.closed
+
+    def test_failed_query_leaves_no_open_transaction(self):
+        pool = ConnectionPool('postgresql:///test', min_size=1, max_size=1, connect=self.connect)
+        with self.assertRaises(ValueError):
+            with pool.connection() as conn:
+                with conn.cursor() as cursor:
+                    cursor.execute("select 1")
+                raise ValueError()
+        with pool.connection() as conn:
+            assert conn is self.opened[0]
+            assert not conn.in_transaction
+
+    def test_health_check_reconnects(self):
+        pool = ConnectionPool('postgresql:///test', min_size=1, max_size=1, health_check_after=0,
+                              connect=self.connect)
+        self.opened[0].broken = True  # ie. the server restarted while it sat idle
+        with pool.connection() as conn:
+            assert conn is self.opened[1]
+        assert self.opened[0].closed
+
+
+if __name__ == "__main__":
+    unittest.main()
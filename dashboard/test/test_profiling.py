@@ -0,0 +1,64 @@
+import threading
+import time
+import unittest
+
+import dashboard.database.profiling as profiling
+from dashboard.scheduler import QueryScheduler
+
+
+def fake_query(rows):
+    with profiling.profiled('processor', 'count', "select count(1) from stories") as profile:
+        time.sleep(0.01)
+        profile.add_rows(rows)
+    return profile
+
+
+class TestProfiling(unittest.TestCase):
+
+    def setUp(self):
+        profiling.reset_metrics()
+
+    def test_profile(self):
+        with profiling.chart('Statistics'):
+            profile = fake_query([dict(count=12345), dict(count=None)])
+        assert profile.chart == 'Statistics'
+        assert profile.rows == 2
+        assert profile.bytes == 5
+        assert profile.seconds >= 0.01
+
+    def test_bytes_estimated_from_a_sample(self):
+        rows = [(i, 'media-cloud') for i in range(10000, 20000)]  # 5 + 11 characters each
+        profile = fake_query(rows)
+        assert profile.rows == 10000
+        assert profile.bytes == 16 * 10000
+
+    def test_collects_from_scheduler_threads(self):
+        with profiling.collecting() as profiles, profiling.chart('History'):
+            scheduler = QueryScheduler()
+            scheduler.submit('processed', fake_query, [(1, 'media-cloud')])
+            scheduler.submit('published', fake_query, [])
+        scheduler.results()
+        assert sorted(p.chart for p in profiles) == ['History/processed', 'History/published']
+        assert threading.current_thread() is threading.main_thread()
+
+    def test_sql_comment(self):
+        with profiling.chart('*/ drop table stories; --'):
+            comment = profiling.sql_comment('count')
+        assert comment.startswith('/* application=feminicide-dashboard chart=')
+        assert comment.count('*/') == 1 and comment.endswith('*/ ')
+        assert '%' not in comment and ';' not in comment
+
+    def test_prometheus_text(self):
+        with profiling.chart('Statistics'):
+            fake_query([dict(count=1)])
+            fake_query([dict(count=2)])
+        text = profiling.prometheus_text()
+        labels = 'database="processor",chart="Statistics",family="count"'
+        assert 'dashboard_query_duration_seconds_count{' + labels + '} 2' in text
+        assert 'dashboard_query_duration_seconds_bucket{' + labels + ',le="+Inf"} 2' in text
+        assert 'dashboard_query_rows_total{' + labels + '} 2' in text
+        assert 'dashboard_query_bytes_total{' + labels + '} 2' in text
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -1,10 +1,79 @@
+import json
+import os
+import shutil
+import tempfile
+import threading
+import time
 import unittest
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from unittest import mock
 
-import processor.projects as projects
+from dashboard import settings
+import dashboard.apiclient as apiclient
+import dashboard.projects as projects
+
+PROJECTS = [dict(id=1, title="Test project", language_model_id=2, rss_url="http://example.com/rss")]
+
+
+class StubMainServer(BaseHTTPRequestHandler):
+    """
+    Stands in for the main server's projects.json endpoint, with ETag support.
+    """
+    etag = '"v1"'
+    delay = 0
+    requests = []
+
+    def do_GET(self):
+        StubMainServer.requests.append(dict(path=self.path, if_none_match=self.headers.get('If-None-Match')))
+        time.sleep(StubMainServer.delay)
+        if self.headers.get('If-None-Match') == StubMainServer.etag:
+            self.send_response(304)
+            self.end_headers()
+            return
+        body = json.dumps(PROJECTS).encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.send_header('ETag', StubMainServer.etag)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
 
 
 class TestProjects(unittest.TestCase):
 
+    def setUp(self):
+        StubMainServer.requests = []
+        StubMainServer.delay = 0
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), StubMainServer)
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.config_dir = tempfile.mkdtemp()
+        self.patches = [
+            mock.patch.object(settings, 'FEMINICIDE_API_URL', 'http://127.0.0.1:{}'.format(self.server.server_port)),
+            mock.patch.object(apiclient, 'RETRY_BACKOFF', 0),
+            mock.patch.object(apiclient, '_session', None),
+            mock.patch.object(projects, 'CONFIG_DIR', self.config_dir),
+            mock.patch.object(projects, '_all_projects', None),
+            mock.patch.object(projects, '_loaded_mtime', None),
+        ]
+        for p in self.patches:
+            p.start()
+
+    def tearDown(self):
+        self._wait_for_background_refresh()
+        for p in self.patches:
+            p.stop()
+        if self.server is not None:
+            self.server.shutdown()
+            self.server.server_close()
+        shutil.rmtree(self.config_dir)
+
+    def _wait_for_background_refresh(self):
+        with projects._background_refresh:
+            pass
+
     def test_update_list(self):
         project_list = projects.load_project_list(True)
         assert len(project_list) > 0
@@ -12,6 +81,39 @@ class TestProjects(unittest.TestCase):
             assert 'id' in p
             assert 'language_model_id' in p
             assert 'rss_url' in p
+        assert sorted(os.listdir(self.config_dir)) == ['projects.json', 'projects.validators.json']
+
+    def test_conditional_request(self):
+        projects.refresh_project_list()
+        assert projects.refresh_project_list() is False  # 304, nothing new
+        assert StubMainServer.requests[0]['if_none_match'] is None
+        assert StubMainServer.requests[1]['if_none_match'] == '"v1"'
+
+    def test_serves_stale_copy_while_refreshing(self):
+        projects.load_project_list(download_if_missing=True)
+        old = time.time() - 3600
+        os.utime(projects._path_to_config_file(), (old, old))
+        StubMainServer.delay = 0.5
+        start = time.time()
+        with mock.patch.object(settings, 'PROJECTS_TTL', 60):
+            project_list = projects.load_project_list(download_if_missing=True)
+        assert time.time() - start < 0.25  # didn't wait on the slow server
+        assert project_list == PROJECTS
+        self._wait_for_background_refresh()
+        assert len(StubMainServer.requests) == 2
+        assert os.path.getmtime(projects._path_to_config_file()) > old
+
+    def test_server_down_keeps_stale_copy(self):
+        projects.load_project_list(download_if_missing=True)
+        old = time.time() - 3600
+        os.utime(projects._path_to_config_file(), (old, old))
+        self.server.shutdown()
+        self.server.server_close()
+        self.server = None
+        with mock.patch.object(settings, 'PROJECTS_TTL', 60):
+            assert projects.load_project_list(download_if_missing=True) == PROJECTS
+            self._wait_for_background_refresh()
+            assert projects.load_project_list(download_if_missing=True) == PROJECTS
 
 
 if __name__ == "__main__":
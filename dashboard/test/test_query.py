@@ -0,0 +1,29 @@
+import unittest
+
+from psycopg2 import sql
+
+from dashboard.database.query import identifier, where, as_text, to_positional
+
+
+class TestQuery(unittest.TestCase):
+
+    def test_identifier_whitelist(self):
+        assert as_text(identifier('processed_date')) == '"processed_date"'
+        self.assertRaises(ValueError, identifier, "processed_date; drop table stories")
+
+    def test_as_text(self):
+        query = sql.SQL("select {col}::date from stories where {clauses}").format(
+            col=identifier('published_date'),
+            clauses=where([sql.SQL("project_id = %(project_id)s"), sql.SQL("source = %(source)s")]))
+        assert as_text(query) == 'select "published_date"::date from stories ' \
+                                 'where (project_id = %(project_id)s) AND (source = %(source)s)'
+        assert as_text(where([])) == "True"
+
+    def test_to_positional(self):
+        text, names = to_positional("select %(a)s, %(b)s, %(a)s where x like 'y%%'")
+        assert text == "select $1, $2, $1 where x like 'y%'"
+        assert names == ['a', 'b']
+
+
+if __name__ == "__main__":
+    unittest.main()
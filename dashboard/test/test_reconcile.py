@@ -0,0 +1,106 @@
+import unittest
+from unittest import mock
+
+import psycopg2.errors
+
+import dashboard.database.alerts_db as alerts_db
+from dashboard.database.cache import query_cache
+import dashboard.database.reconcile as reconcile
+from dashboard.database.reconcile import merge_join, _best_story
+from dashboard.database.urls import canonical_url, url_key
+
+
+class TestUrlKeys(unittest.TestCase):
+
+    def test_same_page_same_key(self):
+        self.assertEqual(url_key("https://www.example.com/news/story-1/?utm_source=google&utm_medium=alert"),
+                         url_key("http://example.com/news/story-1"))
+        self.assertNotEqual(url_key("https://example.com/news/story-1"), url_key("https://example.com/news/story-2"))
+        self.assertEqual(canonical_url("https://user@Example.com:443/a/#top"), "example.com/a")
+
+    def test_different_parameters_different_keys(self):
+        self.assertNotEqual(url_key("https://news.com/article.php?id=1"), url_key("https://news.com/article.php?id=2"))
+        self.assertEqual(url_key("https://news.com/article.php?id=1&utm_source=alert"),
+                         url_key("https://news.com/article.php?id=1"))
+
+    def test_key_fits_a_bigint(self):
+        for i in range(1000):
+            key = url_key("https://example.com/{}".format(i))
+            self.assertTrue(-2**63 <= key < 2**63)
+        self.assertIsNone(url_key(""))
+        self.assertIsNone(url_key(None))
+
+
+class TestMergeJoin(unittest.TestCase):
+
+    def test_matches_equal_keys(self):
+        left = [(1, 10, 'a'), (1, 20, 'b'), (1, 20, 'c'), (2, 10, 'd'), (2, 30, 'e')]
+        right = [(1, 5, 'x'), (1, 20, 'y'), (1, 20, 'z'), (2, 30, 'w'), (3, 1, 'v')]
+        joined = [(row[2], [m[2] for m in matches]) for row, matches in merge_join(left, right)]
+        self.assertEqual(joined, [('a', []), ('b', ['y', 'z']), ('c', ['y', 'z']), ('d', []), ('e', ['w'])])
+
+    def test_query_parameters_pick_the_story(self):
+        stories = sorted([(1, url_key("https://news.com/article.php?id=1"), 100),
+                          (1, url_key("https://www.google.com/url?rct=j&url=https://other.com/x"), 101)])
+        articles = sorted([(1, url_key("https://news.com/article.php?id=2&utm_source=alert"), 'a'),
+                           (1, url_key("https://news.com/article.php?utm_source=alert&id=1"), 'b'),
+                           (1, url_key("https://www.google.com/url?rct=j&url=https://other.com/y"), 'c')])
+        matched = {row[2]: [m[2] for m in matches] for row, matches in merge_join(articles, stories)}
+        self.assertEqual(matched, dict(a=[], b=[100], c=[]))
+
+    def test_empty_sides(self):
+        self.assertEqual(list(merge_join([], [(1, 1)])), [])
+        self.assertEqual(list(merge_join([(1, 1, 'a')], [])), [((1, 1, 'a'), [])])
+
+    def test_best_story_has_the_highest_score(self):
+        matches = [(1, 1, 100, None, None), (1, 1, 101, 0.9, True), (1, 1, 102, 0.2, False)]
+        self.assertEqual(_best_story(matches)[2], 101)
+
+
+
+
+class TestMatchNewStories(unittest.TestCase):
+
+    def setUp(self):
+        # article_url_keys, as articles_id -> (project_id, url_key, stories_id, model_score)
+        self.articles = {1: (1, 10, 500, 0.3), 2: (1, 10, None, None), 3: (1, 20, None, None)}
+
+    def _lookup(self, conn, query, keys):
+        # stands in for the SQL, filters included
+        rows = [(project_id, key, articles_id)
+                for articles_id, (project_id, key, stories_id, _) in self.articles.items()
+                if (project_id, key) in keys and ('stories_id IS NULL' not in query or stories_id is None)]
+        return sorted(rows)
+
+    def _save_matches(self, conn, matched):
+        updated = 0
+        for articles_id, stories_id, model_score, _ in matched:
+            project_id, key, current, current_score = self.articles[articles_id]
+            if current is None or current_score is None or current_score < model_score:
+                self.articles[articles_id] = (project_id, key, stories_id, model_score)
+                updated += 1
+        return updated
+
+    def test_better_story_in_a_later_batch(self):
+        batches = [[(1, 10, 501, 0.4, False), (1, 20, 502, 0.9, True)],
+                   [(1, 10, 503, 0.8, True)]]  # the same URL as 501, scoring higher, in the next batch
+        with mock.patch.object(reconcile.streaming, 'iter_batches', return_value=iter(batches)), \
+                mock.patch.object(reconcile, '_lookup', side_effect=self._lookup), \
+                mock.patch.object(reconcile, '_save_matches', side_effect=self._save_matches):
+            total = reconcile.match_new_stories(mock.Mock(), mock.Mock(), after=0)
+        self.assertEqual({a: row[2] for a, row in self.articles.items()}, {1: 503, 2: 503, 3: 502})
+        self.assertEqual(total, 5)  # 1 and 2 to 501, 3 to 502, then 1 and 2 up to 503
+
+
+class TestNotReconciledYet(unittest.TestCase):
+
+    def test_missing_index_table(self):
+        query_cache.clear()
+        missing = psycopg2.errors.UndefinedTable('relation "article_url_keys" does not exist')
+        with mock.patch.object(alerts_db, '_execute', side_effect=missing):
+            with self.assertRaisesRegex(alerts_db.NotComputedError, 'dashboard.database.reconcile'):
+                alerts_db.article_coverage_by_day(1)
+
+
+if __name__ == "__main__":
+    unittest.main()
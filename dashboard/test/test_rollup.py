@@ -0,0 +1,105 @@
+import datetime as dt
+import unittest
+
+import dashboard.database.rollup as rollup
+from dashboard.database.query import as_text
+
+WATERMARK = dt.datetime(2023, 5, 1, 12)
+NEWEST = dt.datetime(2023, 5, 2, 8)
+
+
+class FakeCursor:
+    """
+    Records the statements a refresh runs, and answers its few single-value selects.
+    """
+
+    def __init__(self, conn):
+        self.conn = conn
+        self.rowcount = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        pass
+
+    def execute(self, query, params=None):
+        text = " ".join(as_text(query).split())
+        self.conn.statements.append((text, params))
+        self.rowcount = 2 if text.startswith('INSERT INTO story_daily_counts') else 0
+        if 'from story_rollup_state' in text:
+            self.result = (self.conn.watermark,) if self.conn.watermark else None
+        elif 'greatest(max(processed_date), max(posted_date))' in text:
+            self.result = (self.conn.newest,)
+        elif 'from touched_days' in text:
+            self.result = (3,)
+
+    def fetchone(self):
+        return self.result
+
+
+class FakeConnection:
+
+    def __init__(self, watermark=WATERMARK, newest=NEWEST):
+        self.watermark = watermark
+        self.newest = newest
+        self.statements = []
+        self.commits = 0
+
+    def cursor(self):
+        return FakeCursor(self)
+
+    def commit(self):
+        self.commits += 1
+
+    def texts(self):
+        return [text for text, _ in self.statements]
+
+    def params(self, start):
+        return next(params for text, params in self.statements if text.startswith(start))
+
+
+class TestRollupRefresh(unittest.TestCase):
+
+    def test_schema_has_a_unique_key(self):
+        assert 'CREATE UNIQUE INDEX IF NOT EXISTS story_daily_counts_key' in rollup.SCHEMA
+        assert 'coalesce(project_id, -1), coalesce(source, \'\')' in rollup.SCHEMA
+
+    def test_incremental(self):
+        conn = FakeConnection()
+        summary = rollup.refresh(conn)
+        texts = conn.texts()
+        # the lock comes before anything is read, and nothing is truncated
+        assert texts[1] == "select pg_advisory_xact_lock(%(key)s)"
+        assert conn.statements[1][1] == dict(key=rollup.LOCK_KEY)
+        assert texts[2].startswith("select watermark")
+        assert not any(t.startswith("TRUNCATE") for t in texts)
+        assert conn.params("CREATE TEMP TABLE touched_days") == dict(since=WATERMARK - rollup.DEFAULT_OVERLAP)
+        inserts = [t for t in texts if t.startswith("INSERT INTO story_daily_counts")]
+        assert len(inserts) == len(rollup.DATE_KINDS)
+        assert 'JOIN stories s ON s."posted_date" >= t.day AND s."posted_date" < t.day + 1' in inserts[-1]
+        assert texts.index("DELETE FROM story_daily_counts c USING touched_days t WHERE c.date_kind = t.date_kind "
+                           "AND c.day = t.day") < texts.index(inserts[0])
+        assert conn.params("INSERT INTO story_rollup_state") == dict(watermark=NEWEST)
+        self.assertEqual(summary, dict(days=3, rows=2 * len(rollup.DATE_KINDS), watermark=NEWEST))
+
+    def test_full(self):
+        conn = FakeConnection()
+        rollup.refresh(conn, full=True)
+        texts = conn.texts()
+        assert not any(t.startswith("select watermark") for t in texts)  # the old watermark doesn't matter
+        assert conn.params("CREATE TEMP TABLE touched_days") == dict(since=dt.datetime.min)
+        assert "TRUNCATE story_daily_counts" in texts
+        assert conn.params("INSERT INTO story_rollup_state") == dict(watermark=NEWEST)
+
+    def test_first_run_and_no_stories(self):
+        conn = FakeConnection(watermark=None)
+        rollup.refresh(conn)
+        assert conn.params("CREATE TEMP TABLE touched_days") == dict(since=dt.datetime.min)
+        conn = FakeConnection(newest=None)
+        self.assertEqual(rollup.refresh(conn), dict(days=0, rows=0, watermark=WATERMARK))
+        assert not any(t.startswith("DELETE") for t in conn.texts())
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,52 @@
+import time
+import unittest
+
+from dashboard.scheduler import QueryScheduler, timing_lines
+
+
+def slow_query(seconds, value):
+    time.sleep(seconds)
+    return value
+
+
+class TestQueryScheduler(unittest.TestCase):
+
+    def test_runs_queries_concurrently(self):
+        scheduler = QueryScheduler()
+        for i in range(3):
+            scheduler.submit('query-{}'.format(i), slow_query, 0.2, i)
+        results = scheduler.results()
+        assert results == {'query-0': 0, 'query-1': 1, 'query-2': 2}
+        report = scheduler.report()
+        assert report['wall'] < 0.5  # much less than the 0.6s it would take one after another
+        assert report['overlap'] > 1.5
+        assert len(timing_lines(report)) == 4
+
+    def test_results_arrive_as_they_finish(self):
+        scheduler = QueryScheduler()
+        scheduler.submit('slow', slow_query, 0.2, 'slow')
+        scheduler.submit('fast', slow_query, 0, 'fast')
+        assert [label for label, _ in scheduler.as_completed()] == ['fast', 'slow']
+
+    def test_errors_are_raised_to_the_caller(self):
+        scheduler = QueryScheduler()
+        scheduler.submit('broken', slow_query, 'not a number', None)
+        with self.assertRaises(TypeError):
+            scheduler.results()
+
+    def test_errors_returned_as_results(self):
+        scheduler = QueryScheduler()
+        scheduler.submit('broken', slow_query, 'not a number', None)
+        scheduler.submit('fine', slow_query, 0.1, 'fine')
+        results = dict(scheduler.as_completed(return_exceptions=True))
+        assert isinstance(results['broken'], TypeError)
+        assert results['fine'] == 'fine'
+
+    def test_labels_are_unique(self):
+        scheduler = QueryScheduler()
+        scheduler.submit('query', slow_query, 0, 1)
+        self.assertRaises(ValueError, scheduler.submit, 'query', slow_query, 0, 2)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,112 @@
+import datetime as dt
+import shutil
+import tempfile
+import threading
+import time
+import unittest
+from decimal import Decimal
+from unittest import mock
+
+from dashboard.database.cache import QueryCache
+from dashboard.database.shared_cache import SharedCache
+
+try:
+    import pyarrow  # noqa: F401
+    HAVE_PYARROW = True
+except ImportError:
+    HAVE_PYARROW = False
+
+ROWS = [dict(day=dt.date(2023, 5, 1), source='media-cloud', above=3, below=Decimal(4)),
+        dict(day=dt.date(2023, 5, 2), source=None, above=0, below=Decimal(1))]
+
+
+@unittest.skipUnless(HAVE_PYARROW, "needs pyarrow")
+class TestSharedCache(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.calls = 0
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def _run(self):
+        self.calls += 1
+        return ROWS
+
+    def test_shared_between_processes(self):
+        first, second = SharedCache(self.directory), SharedCache(self.directory)  # ie. two workers
+        results, _ = first.get_or_run("select 1", 300, self._run)
+        self.assertEqual(results, ROWS)
+        results, _ = second.get_or_run("select 1", 300, self._run)
+        self.assertEqual(results, ROWS)  # same types back, from the Arrow file
+        self.assertEqual(self.calls, 1)
+        self.assertEqual(second.stats(), dict(hits=1, misses=0, waits=0))
+        second.get_or_run("select 2", 300, self._run)
+        self.assertEqual(self.calls, 2)
+        self.assertEqual(first.get_or_run("select 3", 300, lambda: [])[0], [])
+        columns = dict(day=[dt.date(2023, 5, 1)], source=['media-cloud'], above=[3])
+        first.get_or_run("select 4", 300, lambda: columns)
+        self.assertEqual(second.get_or_run("select 4", 300, self._run)[0], columns)  # back as columns, not rows
+
+    def test_time_buckets(self):
+        cache = SharedCache(self.directory)
+        with mock.patch('time.time', return_value=1000):
+            _, expires_in = cache.get_or_run("select 1", 300, self._run)
+            self.assertEqual(expires_in, 200)
+        with mock.patch('time.time', return_value=1199):
+            cache.get_or_run("select 1", 300, self._run)
+        self.assertEqual(self.calls, 1)
+        with mock.patch('time.time', return_value=1200):  # the next bucket
+            cache.get_or_run("select 1", 300, self._run)
+        self.assertEqual(self.calls, 2)
+        cache.clear()
+        cache.get_or_run("select 1", 300, self._run)
+        self.assertEqual(self.calls, 3)
+
+    def test_single_flight(self):
+        def slow_run():
+            time.sleep(0.3)
+            return self._run()
+        caches = [SharedCache(self.directory) for _ in range(4)]
+        threads = [threading.Thread(target=cache.get_or_run, args=("select 1", 300, slow_run)) for cache in caches]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(self.calls, 1)
+        self.assertEqual(sum(cache.stats()['waits'] for cache in caches), 3)
+
+    def test_behind_query_cache(self):
+        shared = SharedCache(self.directory)
+        cache = QueryCache(max_entries=10, ttls=dict(history=300, page=120), shared=True)
+        with mock.patch('dashboard.database.cache.shared_cache', return_value=shared):
+            cache.get_or_run('processor', 'history', "select 1", self._run)
+            cache.get_or_run('processor', 'page', "select 2", self._run)  # not a shared family
+            cache.clear()
+            cache.get_or_run('processor', 'history', "select 1", self._run)
+        self.assertEqual(self.calls, 2)
+        self.assertEqual(shared.stats(), dict(hits=1, misses=1, waits=0))
+
+    def test_clear_reaches_every_worker(self):
+        workers = [(QueryCache(max_entries=10, ttls=dict(history=300, page=120), shared=True),
+                    SharedCache(self.directory)) for _ in range(2)]
+
+        def lookup(worker, family, query):
+            cache, shared = workers[worker]
+            with mock.patch('dashboard.database.cache.shared_cache', return_value=shared):
+                return cache.get_or_run('processor', family, query, self._run)
+
+        for worker in [0, 1]:
+            lookup(worker, 'history', "select 1")
+            lookup(worker, 'page', "select 2")  # only ever kept in memory
+        self.assertEqual(self.calls, 3)  # the history query ran once, for both
+        generation = workers[0][1].generation()
+        workers[0][1].clear()  # "Refresh now" on the first worker
+        self.assertNotEqual(workers[1][1].generation(), generation)
+        lookup(1, 'page', "select 2")
+        lookup(1, 'history', "select 1")
+        self.assertEqual(self.calls, 5)  # the second worker's in-memory entries went too
+        lookup(0, 'history', "select 1")
+        self.assertEqual(self.calls, 5)
+        self.assertEqual(workers[1][0].stats()['entries'], 2)
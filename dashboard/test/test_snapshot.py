@@ -0,0 +1,152 @@
+import datetime as dt
+import os
+import shutil
+import tempfile
+import unittest
+from unittest import mock
+
+from dashboard import settings
+import dashboard.database.processor_db as processor_db
+import dashboard.database.duckdb_db as duckdb_db
+import dashboard.database.snapshot as snapshot
+from dashboard.database.cache import query_cache
+
+try:
+    import duckdb  # noqa: F401
+    import pyarrow  # noqa: F401
+    HAVE_SNAPSHOT_DEPENDENCIES = True
+except ImportError:
+    HAVE_SNAPSHOT_DEPENDENCIES = False
+
+TODAY = dt.datetime.combine(dt.date.today(), dt.time(12))
+
+
+def _story(i):
+    processed = TODAY - dt.timedelta(days=i % 400)
+    return (i, 1000 + i, 1 + i % 2, 3, ['media-cloud', 'newscatcher'][i % 3 % 2], 'https://example.com/{}'.format(i),
+            (i % 100) / 100, i % 100 >= 50, processed - dt.timedelta(days=1), processed, processed,
+            None if i % 7 == 0 else processed)
+
+
+STORIES = [_story(i) for i in range(2000)]
+
+
+class FakeCursor:
+    """
+    Stands in for a psycopg2 server-side cursor, returning the STORIES rows on the day asked for.
+    """
+
+    def __init__(self, conn):
+        self.connection = conn
+        self.rows = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        pass
+
+    def execute(self, query, params=None):
+        day = params['day']
+        self.rows = [row for row in STORIES if row[9].date() == day]
+
+    def fetchmany(self, size):
+        rows, self.rows = self.rows[:size], self.rows[size:]
+        return rows
+
+
+class FakeConnection:
+
+    def cursor(self, name=None):
+        return FakeCursor(self)
+
+
+class TestToDuckdb(unittest.TestCase):
+
+    def test_placeholders_and_rewrites(self):
+        text, names = duckdb_db.to_duckdb(
+            "select * from stories where project_id = %(project_id)s and url like 'a%%' "
+            "order by md5(ctid::text || %(seed)s) limit %(limit)s offset %(project_id)s")
+        self.assertEqual(text, "select * from stories where project_id = $1 and url like 'a%' "
+                               "order by md5(id::text || $2) limit $3 offset $1")
+        self.assertEqual(names, ['project_id', 'seed', 'limit'])
+
+
+@unittest.skipUnless(HAVE_SNAPSHOT_DEPENDENCIES, "needs duckdb and pyarrow")
+class TestSnapshot(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        conn = FakeConnection()
+        days = sorted({row[9].date() for row in STORIES})
+        with mock.patch.object(settings, 'DB_CURSOR_ITERSIZE', 100):
+            self.written = sum(snapshot.write_partition(conn, self.directory, snapshot.TABLES['stories'], day)
+                               for day in days)
+        self.patches = [mock.patch.object(settings, 'QUERY_BACKEND', 'duckdb'),
+                        mock.patch.object(settings, 'SNAPSHOT_DIR', self.directory),
+                        mock.patch.object(settings, 'USE_STORY_ROLLUP', True)]  # ignored with the snapshot
+        for patch in self.patches:
+            patch.start()
+        duckdb_db.close()
+        query_cache.clear()
+
+    def tearDown(self):
+        for patch in self.patches:
+            patch.stop()
+        duckdb_db.close()
+        query_cache.clear()
+        shutil.rmtree(self.directory)
+
+    def test_partitions(self):
+        self.assertEqual(self.written, len(STORIES))
+        day = STORIES[0][9].date()
+        self.assertTrue(os.path.exists(os.path.join(snapshot.partition_dir(self.directory, 'stories', day),
+                                                    snapshot.PART_FILE)))
+        self.assertEqual(len(os.listdir(snapshot.table_dir(self.directory, 'stories'))), 400)
+
+    def test_counts_by_day(self):
+        counts = processor_db.story_counts_by_day('processed_date', project_id=1, limit=730, bucket='day')
+        expected = {}
+        for row in STORIES:
+            if row[2] == 1:
+                key = (row[9].date(), row[4])
+                above, below = expected.get(key, (0, 0))
+                expected[key] = (above + row[7], below + (not row[7]))
+        self.assertEqual(dict(zip(zip(counts['day'], counts['source']), zip(counts['above'], counts['below']))),
+                         expected)
+        self.assertEqual(counts['day'][0], dt.date.today())
+
+    def test_counts_by_week(self):
+        counts = processor_db.story_counts_by_day('processed_date', project_id=1, limit=730)  # too many days
+        self.assertTrue(all(day.weekday() == 0 for day in counts['day']))
+        self.assertLessEqual(len(set(counts['day'])), 120)
+        self.assertEqual(sum(counts['above']) + sum(counts['below']), sum(1 for row in STORIES if row[2] == 1))
+
+    def test_counters(self):
+        summary = processor_db.project_summary(2)
+        project = [row for row in STORIES if row[2] == 2]
+        counters = {name: summary[name] for name in ['unposted_above', 'posted_above', 'below']}
+        self.assertEqual(counters, dict(unposted_above=sum(1 for r in project if r[7] and r[11] is None),
+                                       posted_above=sum(1 for r in project if r[7] and r[11] is not None),
+                                       below=sum(1 for r in project if not r[7])))
+        self.assertEqual(processor_db.unposted_above_story_count(2), summary['unposted_above'])
+        self.assertEqual(processor_db.below_story_count(2), summary['below'])
+        self.assertEqual(sum(summary['columns']['stories']), len(project))
+        self.assertEqual(processor_db.score_distribution(2), summary)  # the same query, from the cache
+
+    def test_scores_and_listings(self):
+        distribution = processor_db.score_distribution(1, bins=10)
+        self.assertEqual(sum(distribution['columns']['stories']), sum(1 for row in STORIES if row[2] == 1))
+        self.assertAlmostEqual(distribution['percentiles'][0.5], 0.5, places=1)
+        by_source = processor_db.score_distribution(1, bins=10, by='source')
+        self.assertEqual(set(by_source['columns']['source']), {row[4] for row in STORIES if row[2] == 1})
+        self.assertEqual(by_source['below'], sum(1 for row in STORIES if row[2] == 1 and not row[7]))
+        page, after = processor_db.story_page(1, page_size=10)
+        self.assertEqual(len(page), 10)
+        self.assertEqual(page[0]['processed_date'], TODAY)
+        next_page, _ = processor_db.story_page(1, after=after, page_size=10)
+        self.assertLess((next_page[0]['processed_date'], next_page[0]['stories_id']), after)
+        sample = processor_db.recent_stories(1, True, mode='random', seed=3)
+        self.assertEqual(sample, processor_db.recent_stories(1, True, mode='random', seed=3))
+        unposted = processor_db.unposted_stories(1, 30)
+        self.assertEqual(list(unposted.columns), processor_db.STORY_LIST_COLUMNS)
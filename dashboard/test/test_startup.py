@@ -0,0 +1,68 @@
+import json
+import os
+import subprocess
+import sys
+import unittest
+from unittest import mock
+
+from dashboard import base_dir, Settings, ConfigError, SETTINGS
+
+IMPORT_TIME_LIMIT = 1.0  # seconds; generous, it is a few tens of milliseconds on a laptop
+
+# imports what every page imports, with no config at all, and reports what that cost
+IMPORT_SCRIPT = """
+import json, sys, time
+start = time.perf_counter()
+import dashboard
+import dashboard.projects
+import dashboard.database.processor_db
+import dashboard.database.alerts_db
+duration = time.perf_counter() - start
+print(json.dumps(dict(seconds=duration, modules=sorted(sys.modules))))
+"""
+HEAVY_MODULES = ['streamlit', 'pandas', 'sentry_sdk', 'altair', 'dotenv']
+
+
+class TestStartup(unittest.TestCase):
+
+    def _import_in_subprocess(self):
+        env = {k: v for k, v in os.environ.items() if k not in SETTINGS}
+        result = subprocess.run([sys.executable, '-c', IMPORT_SCRIPT], cwd=base_dir, env=env, capture_output=True,
+                                text=True, timeout=60)
+        self.assertEqual(result.returncode, 0, result.stderr)
+        return json.loads(result.stdout)
+
+    def test_import_has_no_side_effects(self):
+        # no settings, no database - importing still works, and doesn't pull in the heavy libraries
+        imported = self._import_in_subprocess()
+        for module in HEAVY_MODULES:
+            self.assertNotIn(module, imported['modules'])
+
+    def test_import_time(self):
+        imported = self._import_in_subprocess()
+        self.assertLess(imported['seconds'], IMPORT_TIME_LIMIT)
+
+    def test_missing_settings_reported_on_first_use(self):
+        settings = Settings()
+        with mock.patch.dict(os.environ, dict(FEMINICIDE_API_URL='http://example.com'), clear=True), \
+                mock.patch('dotenv.load_dotenv'):
+            with self.assertRaises(ConfigError) as raised:
+                settings.PROCESSOR_DB_URI
+        self.assertIn('PROCESSOR_DB_URI', str(raised.exception))
+        self.assertIn('FEMINICIDE_API_KEY', str(raised.exception))
+        self.assertNotIn('FEMINICIDE_API_URL', str(raised.exception))
+
+    def test_settings_parsed_once(self):
+        settings = Settings()
+        env = dict(FEMINICIDE_API_URL='http://example.com', FEMINICIDE_API_KEY='key', PROCESSOR_DB_URI='postgresql:///a',
+                   ALERTS_DB_URI='postgresql:///b', DB_POOL_MAX_SIZE='7', USE_STORY_ROLLUP='yes')
+        with mock.patch.dict(os.environ, env, clear=True), mock.patch('dotenv.load_dotenv') as load_dotenv:
+            self.assertEqual(settings.DB_POOL_MAX_SIZE, 7)
+            self.assertTrue(settings.USE_STORY_ROLLUP)
+            self.assertEqual(settings.DB_CURSOR_ITERSIZE, 2000)
+            self.assertIsNone(settings.PROMETHEUS_TEXTFILE)
+        self.assertEqual(load_dotenv.call_count, 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
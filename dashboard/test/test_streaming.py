@@ -0,0 +1,84 @@
+import unittest
+
+from dashboard.database.streaming import iter_batches, to_frame, to_columns
+
+ROWS = [(i, 'media-cloud', 0.5 + i / 100) for i in range(25)]
+
+
+class FakeNamedCursor:
+    """
+    Stands in for a psycopg2 server-side cursor over ROWS.
+    """
+
+    def __init__(self, conn, name):
+        self.conn = self.connection = conn
+        self.name = name
+        self.itersize = 2000
+        self.position = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.conn.closed_cursors.append(self.name)
+
+    def execute(self, query, params=None):
+        self.conn.executed.append((query, params))
+
+    def fetchmany(self, size):
+        self.conn.fetch_sizes.append(size)
+        rows = ROWS[self.position:self.position + size]
+        self.position += len(rows)
+        return rows
+
+
+class FakeConnection:
+
+    def __init__(self):
+        self.executed = []
+        self.fetch_sizes = []
+        self.closed_cursors = []
+
+    def cursor(self, name=None):
+        assert name is not None  # has to be a server-side cursor
+        return FakeNamedCursor(self, name)
+
+
+class TestStreaming(unittest.TestCase):
+
+    def test_iter_batches(self):
+        conn = FakeConnection()
+        batches = list(iter_batches(conn, "select * from stories where project_id = %(project_id)s",
+                                    dict(project_id=1), itersize=10))
+        assert [len(rows) for rows in batches] == [10, 10, 5]
+        assert set(conn.fetch_sizes) == {10}
+        assert conn.executed == [("select * from stories where project_id = %(project_id)s", dict(project_id=1))]
+        assert len(conn.closed_cursors) == 1
+
+    def test_closing_early_closes_cursor(self):
+        conn = FakeConnection()
+        batches = iter_batches(conn, "select 1", itersize=10)
+        next(batches)
+        batches.close()
+        assert len(conn.closed_cursors) == 1
+        assert len(conn.fetch_sizes) == 1
+
+    def test_to_frame(self):
+        df = to_frame(['stories_id', 'source', 'model_score'], [ROWS[:10], ROWS[10:]])
+        assert list(df.columns) == ['stories_id', 'source', 'model_score']
+        assert len(df) == 25
+        assert df['stories_id'].tolist() == list(range(25))
+        assert df['model_score'].dtype == float
+
+    def test_to_frame_empty(self):
+        df = to_frame(['stories_id', 'source'], [])
+        assert list(df.columns) == ['stories_id', 'source']
+        assert len(df) == 0
+
+    def test_to_columns(self):
+        assert to_columns(['day', 'stories'], [(1, 10), (2, 20)]) == dict(day=[1, 2], stories=[10, 20])
+        assert to_columns(['day', 'stories'], []) == dict(day=[], stories=[])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,80 @@
+"""
+Sidebar controls and query diagnostics shared by the dashboard pages.
+"""
+from contextlib import contextmanager
+
+import sentry_sdk
+import streamlit as st
+import pandas as pd
+
+import dashboard.database.profiling as profiling
+from dashboard.database.alerts_db import NotComputedError
+from dashboard.database.cache import query_cache
+from dashboard.database.shared_cache import shared_cache
+from dashboard.scheduler import QueryScheduler, timing_lines
+
+
+def cache_controls(page: str):
+    """
+    Sidebar control to drop cached query results (they're otherwise reused for a few minutes), plus cache stats.
+    """
+    shared = shared_cache()
+    if st.sidebar.button("Refresh now", key="refresh-" + page, help="Re-run queries instead of using cached results"):
+        query_cache.clear()
+        if shared is not None:  # (for every worker: each drops its query cache when it sees the new generation)
+            shared.clear()
+        st.session_state.pop('section_results', None)  # and the results the Projects page keeps per section
+    st.sidebar.caption("Query cache: {hits} hits, {misses} misses, {entries} of {max_entries} entries".format(
+        **query_cache.stats()))
+    if shared is not None:
+        st.sidebar.caption("Shared cache: {hits} hits, {misses} misses, {waits} waits for another worker".format(
+            **shared.stats()))
+
+
+def query_failure(error: Exception):
+    """
+    Show why a chart or list couldn't be loaded, in its place, so the rest of the page still renders.
+    """
+    if isinstance(error, NotComputedError):
+        st.info(str(error))
+    else:
+        sentry_sdk.capture_exception(error)
+        st.error("Couldn't load this: {}".format(error))
+
+
+def query_timings(scheduler: QueryScheduler):
+    """
+    Show when each of the page's queries ran, to check they actually overlapped.
+    """
+    report = scheduler.report()
+    with st.expander("Query timings ({:.0f}ms)".format(report['wall'] * 1000)):
+        st.text("\n".join(timing_lines(report)))
+
+
+@contextmanager
+def profiled_render(page: str, section: str = None):
+    """
+    Profile the queries run (or started) inside the block: they're labelled with the section (or page), sent to Sentry
+    as spans of one render transaction, and collected for `debug_panel`.
+    """
+    name = page if section is None else page + '/' + section
+    with sentry_sdk.start_transaction(op='streamlit.render', name=name), profiling.collecting() as profiles, \
+            profiling.chart(section or page):
+        yield profiles
+
+
+def debug_panel(page: str, profiles):
+    """
+    Optional (sidebar toggle) list of every query this render sent to the database, with its timing and size.
+    """
+    if not st.sidebar.checkbox("Show query debug panel", key="debug-" + page):
+        return
+    with st.expander("Queries on this render: {} taking {:.0f}ms (cache hits aren't listed)".format(
+            len(profiles), sum(p.seconds for p in profiles) * 1000), expanded=True):
+        if not profiles:
+            return
+        df = pd.DataFrame([p.as_dict() for p in profiles],
+                          columns=['chart', 'database', 'family', 'seconds', 'rows', 'bytes', 'query'])
+        df['ms'] = (df.pop('seconds') * 1000).round(1)
+        st.dataframe(df[['chart', 'database', 'family', 'ms', 'rows', 'bytes', 'query']], use_container_width=True,
+                     hide_index=True)
@@ -1,148 +1,376 @@
+import random
+import time
+from collections import OrderedDict
 import altair
 import streamlit as st
 import pandas as pd
 from dashboard import PLATFORMS
 import dashboard.projects as projects
 import dashboard.database.processor_db as processor_db
-from Dashboard import draw_graph, story_results_graph
+import dashboard.database.alerts_db as alerts_db
+from dashboard.database.sampling import SAMPLE_MODES, SAMPLE_PROBE
+from dashboard.database.bucketing import pick_bucket
+from dashboard.scheduler import QueryScheduler
+from dashboard.charts import draw_graph, story_results_graph, draw_coverage
+from dashboard.widgets import cache_controls, query_timings, query_failure, profiled_render, debug_panel
 
+STORY_PAGE_SIZE = 50
+GROUP_PAGE_SIZE = 20
+SCORE_BINS = [10, 20, 50, 100]
+# days of history to chart; longer ranges are only offered when queries run over the snapshot (see QUERY_BACKEND)
+HISTORY_DAYS = [45, 90, 365, 730, 1825]
+SECTION_RESULTS_MAX = 64  # query results kept in each session, across projects and sections
 
-def draw_model_scores(project_id):
-    scores = [entry.values() for entry in processor_db.project_binned_model_scores(project_id)]
-    chart = pd.DataFrame(scores, columns=["scores", "number of projects"])
-    chart["scores"] *= 10
-    bar_chart = altair.Chart(chart).mark_bar().encode(
-        x=altair.X('scores'),
-        y="number of projects",
-        size=altair.SizeValue(35)
-    )
-    st.altair_chart(bar_chart, use_container_width=True)
+
+def draw_model_scores(distribution):
+    scores = pd.DataFrame(distribution['columns'])
+    x = altair.X('bin_start:Q', title="model score", scale=altair.Scale(domain=[0, 1]))
+    if 'day' in scores:  # a heatmap of score bins by day
+        scores['day'] = pd.to_datetime(scores['day'])
+        chart = altair.Chart(scores).mark_rect().encode(
+            x=x, x2='bin_end:Q', y=altair.Y('yearmonthdate(day):O', title="day"),
+            color=altair.Color('stories:Q', title="number of stories"))
+    else:
+        chart = altair.Chart(scores).mark_bar().encode(
+            x=x, x2='bin_end:Q', y=altair.Y('stories:Q', title="number of stories"))
+        if 'source' in scores:  # stacked by source
+            chart = chart.encode(color='source:N')
+    percentiles = pd.DataFrame(dict(percentile=["p{:g}".format(p * 100) for p in distribution['percentiles']],
+                                    score=list(distribution['percentiles'].values()))).dropna()
+    rules = altair.Chart(percentiles).mark_rule(strokeDash=[4, 4]).encode(x='score:Q', tooltip=['percentile', 'score'])
+    st.altair_chart(chart + rules, use_container_width=True)
+    if len(percentiles) > 0:
+        st.caption("Score percentiles: " + ", ".join("{} = {:.3f}".format(row.percentile, row.score)
+                                                     for row in percentiles.itertuples()))
     return
 
 
-def latest_stories(stories):
-    ids = [""] + [s.stories_id for s in stories]
-    story_id = st.selectbox(
-        'Select story',
-        (ids))
+def story_details(stories, key):
+    stories_by_id = {s['stories_id']: s for s in stories}
+    story_id = st.selectbox('Select story', [""] + list(stories_by_id.keys()), key=key)
     if story_id != "":
-        s = [story for story in stories_above if story.stories_id == story_id][0]
-        st.markdown('ID : ' + str(s.stories_id))
-        st.markdown('Source: ' + str(s.source))
-        st.markdown('Published Date: ' + str(s.published_date))
-        st.markdown('URL: [link](story.url)')
-        st.markdown('Model Score: ' + str(s.model_score))
+        s = stories_by_id[story_id]
+        st.markdown('ID : ' + str(s['stories_id']))
+        st.markdown('Source: ' + str(s['source']))
+        st.markdown('Published Date: ' + str(s['published_date']))
+        st.markdown('URL: [link]({})'.format(s['url']))
+        st.markdown('Model Score: ' + str(s['model_score']))
     return
 
 
-# Projects
-st.title("Projects Specific Feminicide Story Dashboard")
-st.markdown("Choose a project ID from the dropdown box to show the story dashboard")
-list_of_projects = projects.load_project_list(force_reload=True, download_if_missing=True)
-titles = [""] + [p['title'] for p in list_of_projects]
-option = st.selectbox('Select project', titles)
+def new_sample():
+    st.session_state['sample_seed'] = random.randrange(2**31)
 
-if option != "":
-    selected = [p for p in list_of_projects if p['title'] == option][0]
-    st.markdown(
-        """
-    <style>
-    [data-testid="stMetricValue"] {
-        font-size: 25px;
-    }
-    </style>
-    """,
-        unsafe_allow_html=True,
-    )
-    # Project Attributes
-    st.caption("Project Attributes")
-    col1, col2, col3 = st.columns(3)
-    col1.metric("ID", str(selected['id']))
-    st.markdown('Title : ' + str(selected['title']))
-    st.markdown("Model : " + str(selected['language_model']))
-    st.divider()
 
-    # Project Statistics
-    unposted_above_story_count = processor_db.unposted_above_story_count(selected['id'])
-    posted_above_story_count = processor_db.posted_above_story_count(selected['id'])
-    below_story_count = processor_db.below_story_count(selected['id'])
+def draw_statistics(summary):
+    unposted_above_story_count = summary['unposted_above']
+    posted_above_story_count = summary['posted_above']
+    below_story_count = summary['below']
     try:
         above_threshold_pct = 100 * (unposted_above_story_count + posted_above_story_count) / below_story_count
     except ZeroDivisionError:
         above_threshold_pct = 100
-
-    st.markdown(
-        """
-    <style>
-    [data-testid="stMetricValue"] {
-        font-size: 25px;
-    }
-    </style>
-    """,
-        unsafe_allow_html=True,
-    )
-    st.caption("Statistics")
     col1, col2 = st.columns(2)
     col1.metric("Average Above Threshold Percentage", above_threshold_pct)
     col2.metric("Unposted Above Threshold Stories", unposted_above_story_count)
     col3, col4 = st.columns(2)
     col3.metric("Posted Above Threshold Stories", posted_above_story_count)
     col4.metric("Below Threshold Stories", below_story_count)
-    st.divider()
 
-    # Model Scores
-    st.subheader("Model Scores")
-    draw_model_scores(project_id=selected['id'])
-    st.divider()
 
+def draw_story_list(stories, key):
+    st.dataframe(pd.DataFrame(stories, columns=processor_db.STORY_LIST_COLUMNS), use_container_width=True,
+                 hide_index=True)
+    story_details(stories, key)
+
+
+def story_browser_filters(project_id, source, threshold, scores):
+    """
+    The story browser's filters. Changing them (or the project) starts the browser back at the first page.
+    """
+    min_score, max_score = scores
+    filters = dict(project_id=project_id, source=None if source == 'all' else source,
+                   above_threshold=None if threshold == 'all' else threshold == 'above',
+                   min_score=None if min_score == 0.0 else min_score, max_score=None if max_score == 1.0 else max_score)
+    if st.session_state.get('browser_filters') != filters:
+        st.session_state['browser_filters'] = filters
+        st.session_state['browser_pages'] = [None]  # the `after` each visited page starts from
+    return filters
+
+
+def next_story_page():
+    st.session_state['browser_pages'].append(st.session_state['browser_next'])
+
+
+def previous_story_page():
+    if len(st.session_state['browser_pages']) > 1:
+        st.session_state['browser_pages'].pop()
+
+
+def draw_story_browser_filters(project_id):
+    col1, col2, col3 = st.columns(3)
+    source = col1.selectbox("Source", ['all'] + PLATFORMS, key='browser_source')
+    threshold = col2.radio("Threshold", ['all', 'above', 'below'], horizontal=True, key='browser_threshold')
+    scores = col3.slider("Model score", 0.0, 1.0, (0.0, 1.0), step=0.05, key='browser_scores')
+    return story_browser_filters(project_id, source, threshold, scores)
+
+
+def draw_story_page(stories, next_after):
+    st.session_state['browser_next'] = next_after
+    page_number = len(st.session_state['browser_pages'])
+    draw_story_list(stories, 'browser_story')
+    col1, col2, col3 = st.columns([1, 1, 4])
+    col1.button("Previous", on_click=previous_story_page, disabled=page_number == 1)
+    col2.button("Next", on_click=next_story_page, disabled=next_after is None)
+    col3.caption("Page {} ({} stories)".format(page_number, len(stories)))
+
+
+def group_browser_pages(project_id):
+    """
+    The `after` each visited page of article groups starts from, back at the first page when the project changes.
+    """
+    if st.session_state.get('group_project') != project_id:
+        st.session_state['group_project'] = project_id
+        st.session_state['group_pages'] = [None]
+    return st.session_state['group_pages']
+
+
+def next_group_page():
+    st.session_state['group_pages'].append(st.session_state['group_next'])
+
+
+def previous_group_page():
+    if len(st.session_state['group_pages']) > 1:
+        st.session_state['group_pages'].pop()
+
+
+def draw_group_page(groups, next_after):
+    st.session_state['group_next'] = next_after
+    page_number = len(st.session_state['group_pages'])
+    st.dataframe(pd.DataFrame(groups, columns=alerts_db.ARTICLE_GROUP_COLUMNS), use_container_width=True,
+                 hide_index=True)
+    col1, col2, col3 = st.columns([1, 1, 4])
+    col1.button("Previous", on_click=previous_group_page, disabled=page_number == 1, key='group_previous')
+    col2.button("Next", on_click=next_group_page, disabled=next_after is None, key='group_next_button')
+    col3.caption("Page {} ({} groups)".format(page_number, len(groups)))
+
+
+def draw_group_details(groups):
+    groups_by_id = {g['cluster_id']: g for g in groups}
+    cluster_id = st.selectbox('Show the articles in group', [""] + list(groups_by_id.keys()), key='group_details',
+                              format_func=lambda c: "" if c == "" else "{} ({} articles)".format(
+                                  groups_by_id[c]['title'], groups_by_id[c]['articles']))
+    if cluster_id != "":
+        try:
+            articles = alerts_db.group_articles(cluster_id)
+        except alerts_db.NotComputedError as e:
+            query_failure(e)
+            return
+        st.dataframe(pd.DataFrame(articles, columns=alerts_db.GROUP_ARTICLE_COLUMNS), use_container_width=True,
+                     hide_index=True)
+
+
+def section_results(project_id, section, queries):
+    """
+    Results for one section's queries, kept in session state per project so going back to a section (or project)
+    doesn't query again. Whatever isn't there yet runs side by side.
+    :param queries: dict of label -> (function, args, kwargs)
+    :return: the results by label, and the scheduler that ran the missing ones (None if nothing had to run). A query
+             that failed with a NotComputedError has that as its result, and isn't kept (so it runs again next time).
+    """
+    results = st.session_state.setdefault('section_results', OrderedDict())
+    keys = {label: repr((project_id, section, label, func.__name__, args, sorted(kwargs.items())))
+            for label, (func, args, kwargs) in queries.items()}
+    missing = [label for label, key in keys.items() if key not in results]
+    scheduler = None
+    failed = {}
+    if missing:
+        scheduler = QueryScheduler()
+        for label in missing:
+            func, args, kwargs = queries[label]
+            scheduler.submit(label, func, *args, **kwargs)
+        for label, result in scheduler.as_completed(return_exceptions=True):
+            if isinstance(result, Exception):
+                failed[label] = result
+            else:
+                results[keys[label]] = result
+        while len(results) > SECTION_RESULTS_MAX:
+            results.popitem(last=False)
+        for error in failed.values():
+            if not isinstance(error, alerts_db.NotComputedError):
+                raise error  # (the other queries' results are kept)
+    for label, key in keys.items():
+        if label not in failed:
+            results.move_to_end(key)
+    return {label: failed[label] if label in failed else results[key] for label, key in keys.items()}, scheduler
+
+
+def statistics_section(project):
+    # one query for all the counters, and the default score histogram
+    results, scheduler = section_results(project['id'], 'statistics', dict(
+        summary=(processor_db.project_summary, (project['id'],), {})))
+    draw_statistics(results['summary'])
+    return scheduler
+
+
+def model_scores_section(project):
+    col1, col2 = st.columns(2)
+    bins = col1.select_slider("Bins", SCORE_BINS, key='score_bins')
+    breakdown = col2.radio("Break down by", ['none', 'source', 'day'], horizontal=True, key='score_breakdown')
+    results, scheduler = section_results(project['id'], 'model scores', dict(
+        scores=(processor_db.score_distribution, (project['id'],),
+                dict(bins=bins, by=None if breakdown == 'none' else breakdown))))
+    draw_model_scores(results['scores'])
+    return scheduler
+
+
+def history_section(project):
+    processed, published = 45, 30
+    if processor_db.using_snapshot():
+        processed = published = st.select_slider("Days of history", HISTORY_DAYS, key='history_days')
+    # long ranges are counted per week or month, so the charts don't get more bars than they can show
+    processed_bucket, published_bucket = pick_bucket(processed), pick_bucket(published)
+    # stories_by_posted_day groups on processed_date too, so the posted-day chart shares its results
+    results, scheduler = section_results(project['id'], 'history', dict(
+        processed=(processor_db.story_counts_by_day, ('processed_date', project['id']),
+                   dict(limit=processed, bucket=processed_bucket)),
+        published=(processor_db.story_counts_by_day, ('published_date', project['id']),
+                   dict(limit=published, bucket=published_bucket))))
     st.subheader('Above Threshold Stories')
-    # by posted day
-    st.caption("Platform Stories by Posted Day")
-    draw_graph(processor_db.stories_by_posted_day, selected['id'])
+    st.caption("Platform Stories by Posted {}".format(processed_bucket.title()))
+    draw_graph(results['processed'], bucket=processed_bucket)
     st.divider()
-    # History (by discovery date)
     st.subheader("History")
-    st.caption("Platform Stories by Published Day")
-    draw_graph(processor_db.stories_by_published_day, selected['id'])
-    st.caption("Platform Stories by Discovery Day")
-    draw_graph(processor_db.stories_by_processed_day, selected['id'])
-    st.caption("Platform Stories by Discovery Day")
-    story_results_graph(selected['id'])
-    st.divider()
+    st.caption("Platform Stories by Published {}".format(published_bucket.title()))
+    draw_graph(results['published'], bucket=published_bucket)
+    st.caption("Platform Stories by Discovery {}".format(processed_bucket.title()))
+    draw_graph(results['processed'], bucket=processed_bucket)
+    st.caption("Platform Stories by Discovery {}".format(processed_bucket.title()))
+    story_results_graph(results['processed'], bucket=processed_bucket)
+    return scheduler
 
-    # Latest Stories
-    st.subheader("Latest Stories")
+
+def latest_stories_section(project):
+    # keep the same seed across reruns so the sample doesn't change every time a widget is touched
+    if 'sample_seed' not in st.session_state:
+        new_sample()
+    st.button("New sample", on_click=new_sample)
+    sample_mode = st.radio("Sample", SAMPLE_MODES, index=SAMPLE_MODES.index(SAMPLE_PROBE), horizontal=True,
+                           key='sample_mode')
+    sample = dict(mode=sample_mode, seed=st.session_state['sample_seed'])
+    results, scheduler = section_results(project['id'], 'latest stories', dict(
+        stories_above=(processor_db.recent_stories, (project['id'], True), sample),
+        stories_below=(processor_db.recent_stories, (project['id'], False), sample)))
     st.caption("Above threshold")
-    stories_above = processor_db.recent_stories(selected['id'], True)
-    latest_stories(stories_above)
-    for s in stories_above:
-        st.markdown('ID : ' + str(s.stories_id))
-        st.markdown('Source: ' + str(s.source))
-        st.markdown('Published Date: ' + str(s.published_date))
-        st.markdown('URL: [link](story.url)')
-        st.markdown('Model Score: ' + str(s.model_score))
+    draw_story_list(results['stories_above'], 'above_story')
     st.divider()
-
     st.caption("Below threshold")
-    stories_below = processor_db.recent_stories(selected['id'], False)
-    latest_stories(stories_below)
-    for s in stories_below:
-        st.markdown('ID : ' + str(s.stories_id))
-        st.markdown('Source: ' + str(s.source))
-        st.markdown('Published Date: ' + str(s.published_date))
-        st.markdown('URL: [link](story.url)')
-        st.markdown('Model Score: ' + str(s.model_score))
-    st.divider()
+    draw_story_list(results['stories_below'], 'below_story')
+    return scheduler
 
-    st.title('Project Speficic Email Alert Dashboard')
-    st.markdown("Choose a project ID from the dropdown box to show the email alert dashboard")
-    st.divider()
 
-    # Grouped Articles
-    st.subheader('Grouped Articles')
+def browse_stories_section(project):
+    filters = draw_story_browser_filters(project['id'])
+    results, scheduler = section_results(project['id'], 'browse stories', dict(
+        story_page=(processor_db.story_page, (), dict(after=st.session_state['browser_pages'][-1],
+                                                      page_size=STORY_PAGE_SIZE, **filters))))
+    draw_story_page(*results['story_page'])
+    return scheduler
+
+
+def coverage_section(project):
+    results, scheduler = section_results(project['id'], 'coverage', dict(
+        coverage=(alerts_db.article_coverage_by_day, (project['id'],), {})))
+    coverage = results['coverage']
+    if isinstance(coverage, Exception):
+        query_failure(coverage)
+        return scheduler
+    articles = sum(day['articles'] for day in coverage)
+    matched = sum(day['matched'] for day in coverage)
+    col1, col2, col3 = st.columns(3)
+    col1.metric("Alert Articles (last 30 days)", articles)
+    share = 100 * matched / articles if articles else 0
+    col2.metric("Reached the Story Processor", "{} ({:.0f}%)".format(matched, share))
+    col3.metric("Missing", articles - matched)
+    st.caption("Alert Articles by Published Day, matched to processed stories by URL")
+    draw_coverage(coverage)
+    return scheduler
+
+
+def email_alerts_section(project):
+    if 'sample_seed' not in st.session_state:
+        new_sample()
+    results, scheduler = section_results(project['id'], 'email alerts', dict(
+        groups=(alerts_db.grouped_articles, (project['id'],),
+                dict(after=group_browser_pages(project['id'])[-1], page_size=GROUP_PAGE_SIZE)),
+        articles=(alerts_db.recent_articles, (project['id'],), dict(seed=st.session_state['sample_seed']))))
+    st.caption("Grouped articles: the same story sent by several alerts, most recently seen first")
+    if isinstance(results['groups'], Exception):
+        query_failure(results['groups'])
+    else:
+        draw_group_page(*results['groups'])
+        draw_group_details(results['groups'][0])
     st.divider()
+    st.caption("Raw articles: a sample of the articles from the last week")
+    st.dataframe(pd.DataFrame(results['articles']), use_container_width=True, hide_index=True)
+    return scheduler
+
+
+# each section only runs its queries when it is the one being shown
+SECTIONS = {
+    "Statistics": statistics_section,
+    "Model Scores": model_scores_section,
+    "History": history_section,
+    "Latest Stories": latest_stories_section,
+    "Browse Stories": browse_stories_section,
+    "Coverage": coverage_section,
+    "Email Alerts": email_alerts_section,
+}
 
-    # Raw Articles
-    st.subheader('Raw Articles')
+
+# Projects
+st.title("Projects Specific Feminicide Story Dashboard")
+cache_controls('projects')
+st.markdown("Choose a project ID from the dropdown box to show the story dashboard")
+list_of_projects = projects.load_project_list(download_if_missing=True)
+titles = [""] + [p['title'] for p in list_of_projects]
+option = st.selectbox('Select project', titles)
+
+if option != "":
+    selected = [p for p in list_of_projects if p['title'] == option][0]
+
+    st.markdown(
+        """
+    <style>
+    [data-testid="stMetricValue"] {
+        font-size: 25px;
+    }
+    </style>
+    """,
+        unsafe_allow_html=True,
+    )
+    # Project Attributes
+    st.caption("Project Attributes")
+    col1, col2, col3 = st.columns(3)
+    col1.metric("ID", str(selected['id']))
+    st.markdown('Title : ' + str(selected['title']))
+    st.markdown("Model : " + str(selected['language_model']))
     st.divider()
 
+    section = st.radio("Section", list(SECTIONS.keys()), horizontal=True, key='projects_section',
+                       label_visibility='collapsed')
+    st.subheader(section)
+    start = time.perf_counter()
+    with profiled_render('Projects', section) as render_profiles:
+        section_scheduler = SECTIONS[section](selected)
+    render_time = time.perf_counter() - start
+    st.session_state.setdefault('section_timings', {})[section] = render_time
+    st.caption("{} rendered in {:.0f}ms{}".format(section, render_time * 1000,
+                                                  "" if section_scheduler else " (from results kept for this session)"))
+    if section_scheduler:
+        query_timings(section_scheduler)
+    debug_panel('projects', render_profiles)
+    with st.expander("Section render timings"):
+        st.text("\n".join("{}: {:.0f}ms".format(name, seconds * 1000)
+                          for name, seconds in st.session_state['section_timings'].items()))
+    st.divider()